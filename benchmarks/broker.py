@@ -0,0 +1,193 @@
+# Minimal in-process MQTT broker used by benchmarks. It is not a real broker: no retained messages,
+# no QoS 2 state, no persistent sessions except "session present" flag, topic filters support only trailing '#'.
+# Shared subscriptions ($share/group/filter) are delivered round-robin between group members.
+import asyncio
+import itertools
+import struct
+import time
+
+from gmqtt.transports import MemoryServer
+from gmqtt.websocket import WebSocketProtocol
+
+
+def pack_vbi(value):
+    result = bytearray()
+    while True:
+        value, b = divmod(value, 128)
+        if value:
+            b |= 0x80
+        result.append(b)
+        if not value:
+            return bytes(result)
+
+
+class StandInBroker:
+    def __init__(self, ack=True, receive_maximum=None, connack_code=0, server_reference=None):
+        self.ack = ack
+        self.receive_maximum = receive_maximum
+        # e.g. 156 (use another server) with server_reference to redirect clients
+        self.connack_code = connack_code
+        self.server_reference = server_reference
+        self.sessions = set()
+        self.subscriptions = []
+        self.published = 0
+        self.connections = set()
+        self.connect_times = []
+        self._share_counter = itertools.count()
+
+    def protocol_factory(self):
+        return StandInBrokerProtocol(self)
+
+    async def serve(self, host='127.0.0.1', port=0, ssl=None):
+        server = await asyncio.get_running_loop().create_server(self.protocol_factory, host, port, ssl=ssl)
+        return server, server.sockets[0].getsockname()[1]
+
+    async def serve_unix(self, path):
+        return await asyncio.get_running_loop().create_unix_server(self.protocol_factory, path)
+
+    async def serve_websocket(self, host='127.0.0.1', port=0, compression=True):
+        server = await asyncio.get_running_loop().create_server(
+            lambda: WebSocketProtocol(self.protocol_factory, is_client=False, compression=compression), host, port)
+        return server, server.sockets[0].getsockname()[1]
+
+    def serve_memory(self, name):
+        return MemoryServer(name, self.protocol_factory)
+
+    def drop_connections(self):
+        for protocol in list(self.connections):
+            protocol.transport.abort()
+
+
+class StandInBrokerProtocol(asyncio.Protocol):
+    def __init__(self, broker):
+        self.broker = broker
+        self.transport = None
+        self.buffer = b''
+        self.version = 5
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.broker.connections.add(self)
+
+    def connection_lost(self, exc):
+        self.broker.connections.discard(self)
+        self.broker.subscriptions = [s for s in self.broker.subscriptions if s[0] is not self]
+
+    def data_received(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 2:
+            multiplier, size, offset = 1, 0, 1
+            while True:
+                if offset >= len(self.buffer):
+                    return
+                b = self.buffer[offset]
+                size += (b & 127) * multiplier
+                multiplier *= 128
+                offset += 1
+                if not b & 128:
+                    break
+            if len(self.buffer) < offset + size:
+                return
+            cmd, packet = self.buffer[0], self.buffer[offset:offset + size]
+            self.buffer = self.buffer[offset + size:]
+            self.handle(cmd, packet)
+
+    def send(self, cmd, body):
+        self.transport.write(bytes([cmd]) + pack_vbi(len(body)) + body)
+
+    def send_ack(self, cmd, mid):
+        self.send(cmd, struct.pack('!H', mid) + (b'\x00\x00' if self.version == 5 else b''))
+
+    def handle(self, cmd, packet):
+        handler = getattr(self, 'handle_{:x}'.format(cmd >> 4), None)
+        if handler is not None:
+            handler(cmd, packet)
+
+    def handle_1(self, cmd, packet):
+        # CONNECT
+        self.broker.connect_times.append(time.monotonic())
+        (name_len, ) = struct.unpack_from('!H', packet)
+        self.version, flags = packet[2 + name_len], packet[3 + name_len]
+        offset = 6 + name_len
+        if self.version == 5:
+            offset += 1 + packet[offset]
+        (id_len, ) = struct.unpack_from('!H', packet, offset)
+        client_id = packet[offset + 2:offset + 2 + id_len]
+        session_present = 0 if flags & 0x02 else int(client_id in self.broker.sessions)
+        self.broker.sessions.add(client_id)
+        body = bytes([session_present, self.broker.connack_code])
+        if self.version == 5:
+            properties = b''
+            if self.broker.receive_maximum:
+                properties = b'\x21' + struct.pack('!H', self.broker.receive_maximum)
+            if self.broker.server_reference:
+                reference = self.broker.server_reference.encode()
+                properties += b'\x1c' + struct.pack('!H', len(reference)) + reference
+            body += pack_vbi(len(properties)) + properties
+        self.send(0x20, body)
+        if self.broker.connack_code:
+            self.transport.close()
+
+    def handle_3(self, cmd, packet):
+        # PUBLISH
+        self.broker.published += 1
+        qos = (cmd >> 1) & 0x03
+        (topic_len, ) = struct.unpack_from('!H', packet)
+        topic = packet[2:2 + topic_len]
+        if qos and self.broker.ack:
+            (mid, ) = struct.unpack_from('!H', packet, 2 + topic_len)
+            self.send_ack(0x40 if qos == 1 else 0x50, mid)
+        groups = {}
+        for protocol, topic_filter in self.broker.subscriptions:
+            group = None
+            if topic_filter.startswith(b'$share/'):
+                group, topic_filter = topic_filter[7:].split(b'/', 1)
+            if topic_filter == topic or (topic_filter.endswith(b'#') and topic.startswith(topic_filter[:-1])):
+                if group is None:
+                    protocol.send(cmd & 0xF7, packet)
+                else:
+                    groups.setdefault((group, topic_filter), []).append(protocol)
+        for members in groups.values():
+            members[next(self.broker._share_counter) % len(members)].send(cmd & 0xF7, packet)
+
+    def handle_6(self, cmd, packet):
+        # PUBREL
+        (mid, ) = struct.unpack_from('!H', packet)
+        self.send_ack(0x70, mid)
+
+    def handle_8(self, cmd, packet):
+        # SUBSCRIBE
+        (mid, ) = struct.unpack_from('!H', packet)
+        offset = 2
+        if self.version == 5:
+            offset += 1 + packet[offset]
+        codes = b''
+        while offset < len(packet):
+            (filter_len, ) = struct.unpack_from('!H', packet, offset)
+            self.broker.subscriptions.append((self, packet[offset + 2:offset + 2 + filter_len]))
+            codes += bytes([packet[offset + 2 + filter_len] & 0x03])
+            offset += 3 + filter_len
+        self.send(0x90, struct.pack('!H', mid) + (b'\x00' if self.version == 5 else b'') + codes)
+
+    def handle_a(self, cmd, packet):
+        # UNSUBSCRIBE
+        (mid, ) = struct.unpack_from('!H', packet)
+        offset = 2
+        if self.version == 5:
+            offset += 1 + packet[offset]
+        codes = b''
+        while offset < len(packet):
+            (filter_len, ) = struct.unpack_from('!H', packet, offset)
+            topic_filter = packet[offset + 2:offset + 2 + filter_len]
+            self.broker.subscriptions = [s for s in self.broker.subscriptions if s != (self, topic_filter)]
+            codes += b'\x00'
+            offset += 2 + filter_len
+        self.send(0xB0, struct.pack('!H', mid) + (b'\x00' + codes if self.version == 5 else b''))
+
+    def handle_c(self, cmd, packet):
+        # PINGREQ
+        self.send(0xD0, b'')
+
+    def handle_e(self, cmd, packet):
+        # DISCONNECT
+        self.transport.close()
@@ -0,0 +1,79 @@
+# Measures how fast a client with several broker endpoints recovers when its broker goes away,
+# compared with a single endpoint client which waits reconnect_delay, and how fast it follows
+# CONNACK "use another server" redirect.
+#
+#   python -m benchmarks.failover [rounds]
+import asyncio
+import statistics
+import sys
+import time
+
+from gmqtt import Client
+
+from benchmarks.broker import StandInBroker
+
+
+async def wait_connected(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not client.is_connected and time.monotonic() < deadline:
+        await asyncio.sleep(0.001)
+
+
+async def broker_loss(multi_endpoint):
+    primary, backup = StandInBroker(), StandInBroker()
+    primary_server, primary_port = await primary.serve()
+    backup_server, backup_port = await backup.serve()
+
+    client = Client('failover')
+    client.set_config({'reconnect_delay': 1})
+    endpoints = ['127.0.0.1:{}'.format(primary_port)]
+    if multi_endpoint:
+        endpoints.append('127.0.0.1:{}'.format(backup_port))
+    await client.connect(endpoints, keepalive=60)
+
+    primary_server.close()
+    primary.drop_connections()
+    if not multi_endpoint:
+        # the same broker comes back right away, single endpoint client still waits reconnect_delay
+        primary_server, _ = await primary.serve(port=primary_port)
+    await asyncio.sleep(0.01)
+    await wait_connected(client)
+
+    failover_time = client.metrics['failover_time_last']
+    await client.disconnect()
+    primary_server.close()
+    backup_server.close()
+    return failover_time
+
+
+async def redirect():
+    target = StandInBroker()
+    target_server, target_port = await target.serve()
+    moved = StandInBroker(connack_code=156, server_reference='127.0.0.1:{}'.format(target_port))
+    moved_server, moved_port = await moved.serve()
+
+    client = Client('redirect')
+    started = time.monotonic()
+    await client.connect('127.0.0.1', moved_port, raise_exc=False)
+    await asyncio.sleep(0.001)
+    await wait_connected(client)
+    elapsed = time.monotonic() - started
+    assert client.endpoint == ('127.0.0.1', target_port)
+
+    await client.disconnect()
+    target_server.close()
+    moved_server.close()
+    return elapsed
+
+
+async def main(rounds):
+    for name, scenario in [('single endpoint, broker restart', lambda: broker_loss(False)),
+                           ('two endpoints, broker loss', lambda: broker_loss(True)),
+                           ('CONNACK 156 redirect', redirect)]:
+        timings = [await scenario() for _ in range(rounds)]
+        print('{:32s} median {:8.2f} ms, max {:8.2f} ms'.format(
+            name, statistics.median(timings) * 1000, max(timings) * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -0,0 +1,35 @@
+# Connects a fleet of clients to the stand-in broker and reports per-client memory and connect throughput.
+#
+#   python -m benchmarks.fleet [clients] [connect_rate]
+import asyncio
+import sys
+import tracemalloc
+
+from gmqtt.fleet import ClientFleet
+
+from benchmarks.broker import StandInBroker
+
+
+async def main(clients, connect_rate):
+    broker = StandInBroker()
+    server, port = await broker.serve()
+
+    tracemalloc.start()
+    fleet = ClientFleet(['fleet-{}'.format(i) for i in range(clients)], connect_rate=connect_rate, concurrency=500)
+    tracemalloc.stop()
+
+    await fleet.connect('127.0.0.1', port, keepalive=60)
+    metrics = fleet.metrics
+    print('clients: {clients}, connected: {connected}, failed: {connect_failed}'.format(**metrics))
+    print('memory per client (not connected): {:.0f} bytes'.format(metrics['memory_per_client']))
+    print('connect time: {:.2f}s, throughput: {:.0f} connects/s'.format(
+        metrics['connect_time'], metrics['connect_throughput']))
+
+    await fleet.disconnect()
+    server.close()
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    connect_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    asyncio.run(main(clients, connect_rate))
@@ -0,0 +1,64 @@
+# Event loop overhead of keepalive timers of idle connections: one loop timer per connection
+# versus one TimerWheel shared by all of them. Connections use fake transport, PINGREQ is answered at once.
+#
+#   python -m benchmarks.keepalive_timers [seconds] [keepalive]
+import asyncio
+import sys
+import time
+
+from gmqtt.mqtt.connection import MQTTConnection
+from gmqtt.mqtt.timer_wheel import TimerWheel
+
+
+class FakeTransport:
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.connection = None
+        self.pings = 0
+
+    def set_connection(self, connection):
+        self.connection = connection
+
+    def send_ping_request(self):
+        self.pings += 1
+        self.connection._last_data_in = time.monotonic()
+
+
+async def measure(clients, seconds, keepalive, timer_wheel):
+    protocols = [FakeProtocol() for _ in range(clients)]
+    connections = [MQTTConnection(FakeTransport(), protocol, True, keepalive, timer_wheel=timer_wheel)
+                   for protocol in protocols]
+    loop = asyncio.get_running_loop()
+
+    started_cpu, started = time.process_time(), time.monotonic()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - started_cpu
+    wall = time.monotonic() - started
+
+    scheduled = len(loop._scheduled)
+    for connection in connections:
+        connection._keep_connection_callback.cancel()
+    if timer_wheel is not None:
+        timer_wheel.close()
+    return cpu / wall, sum(p.pings for p in protocols), scheduled
+
+
+async def main(seconds, keepalive):
+    for clients in (1000, 10000, 50000):
+        for name, timer_wheel in (('loop timers', None), ('timer wheel', TimerWheel(tick=0.5))):
+            load, pings, scheduled = await measure(clients, seconds, keepalive, timer_wheel)
+            print('{:>6} clients, {:>11}: loop cpu {:5.1f}%, {:>7} pings, {:>6} loop timers'.format(
+                clients, name, load * 100, pings, scheduled))
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    keepalive = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+    asyncio.run(main(seconds, keepalive))
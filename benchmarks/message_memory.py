@@ -0,0 +1,41 @@
+# Queues messages published while disconnected and reports memory taken per queued message (payloads excluded),
+# for new messages to 1000 topics and for one FrozenMessage published again and again.
+#
+#   python -m benchmarks.message_memory [messages]
+import os
+import sys
+import time
+import tracemalloc
+
+from gmqtt import Message, FrozenMessage
+from gmqtt.storage import OfflineQueue
+
+
+def measure(count, make_message):
+    queue = OfflineQueue(capacity=count)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for i in range(count):
+        queue.put(make_message(i))
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size / count, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    payloads = [os.urandom(64) for _ in range(count)]
+    frozen = FrozenMessage('site/1/telemetry', payloads[0], qos=1)
+
+    for name, make_message in (
+            ('Message', lambda i: Message('site/{}/telemetry'.format(i % 1000), payloads[i], qos=1)),
+            ('FrozenMessage', lambda i: frozen)):
+        per_message, elapsed = measure(count, make_message)
+        print('{:14} {} queued: {:.0f} bytes/message ({:.1f} s with tracemalloc)'.format(
+            name, count, per_message, elapsed))
+
+
+if __name__ == '__main__':
+    main()
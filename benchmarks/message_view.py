@@ -0,0 +1,67 @@
+# Feeds received MQTT 5.0 PUBLISH packets with properties to the handler and compares dispatch time of
+# on_message and on_message_view, for callbacks reading only the topic and for ones reading everything.
+#
+#   python -m benchmarks.message_view [messages]
+import sys
+import time
+
+from gmqtt import Client, Message
+from gmqtt.mqtt.package import PublishPacket
+from gmqtt.mqtt.protocol import MQTTProtocol
+from gmqtt.mqtt.utils import unpack_variable_byte_integer
+
+
+def make_packets(count):
+    packets = []
+    for i in range(count):
+        message = Message('site/{}/telemetry'.format(i % 100), b'x' * 256, qos=0, content_type='application/json',
+                          user_property=[('device', 'sensor-{}'.format(i))], message_expiry_interval=60)
+        _, package = PublishPacket.build_package(message, MQTTProtocol)
+        _, packet = unpack_variable_byte_integer(bytes(package[1:]))
+        packets.append((package[0], packet))
+    return packets
+
+
+def run(packets, view, read_all):
+    client = Client('view-benchmark')
+    client._logger.disabled = True
+    # only the last message is kept, so callbacks don't pile up memory
+    last = [None]
+    if view and read_all:
+        def on_message_view(client, message):
+            last[0] = (message.topic, message.properties, message.payload)
+        client.on_message_view = on_message_view
+    elif view:
+        def on_message_view(client, message):
+            last[0] = message.topic
+        client.on_message_view = on_message_view
+    elif read_all:
+        def on_message(client, topic, payload, qos, properties):
+            last[0] = (topic, properties, payload)
+        client.on_message = on_message
+    else:
+        def on_message(client, topic, payload, qos, properties):
+            last[0] = topic
+        client.on_message = on_message
+    best = None
+    for _ in range(3):
+        started = time.perf_counter()
+        for cmd, packet in packets:
+            client(cmd, packet)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(packets)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    packets = make_packets(count)
+    for read_all in (False, True):
+        callback = run(packets, view=False, read_all=read_all)
+        view = run(packets, view=True, read_all=read_all)
+        print('{:9} on_message {:.2f} us/message, on_message_view {:.2f} us/message'.format(
+            'all' if read_all else 'topic', callback * 1e6, view * 1e6))
+
+
+if __name__ == '__main__':
+    main()
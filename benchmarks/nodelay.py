@@ -0,0 +1,49 @@
+# Request/response latency over loopback with and without TCP_NODELAY. Every round the client publishes
+# telemetry nobody answers and then a request it is subscribed to itself. With Nagle's algorithm the
+# request waits in the socket until the broker acknowledges the telemetry segment (delayed ACK).
+#
+#   python -m benchmarks.nodelay [rounds]
+import asyncio
+import statistics
+import sys
+import time
+
+from gmqtt import Client
+
+from benchmarks.broker import StandInBroker
+
+
+async def round_trips(nodelay, rounds):
+    server, port = await StandInBroker().serve()
+    received = asyncio.Event()
+
+    client = Client('nodelay')
+    client.on_message = lambda *args: received.set()
+    await client.connect('127.0.0.1', port, keepalive=60, socket_options={'nodelay': nodelay})
+    client.subscribe('request/#')
+    await asyncio.sleep(0.01)
+
+    timings = []
+    for _ in range(rounds):
+        received.clear()
+        started = time.monotonic()
+        client.publish('telemetry/1', b'{"t": 21.5}')
+        client.publish('request/1', b'ping')
+        await received.wait()
+        timings.append(time.monotonic() - started)
+        await asyncio.sleep(0.001)
+
+    await client.disconnect()
+    server.close()
+    return timings
+
+
+async def main(rounds):
+    for name, nodelay in [('TCP_NODELAY on', True), ('TCP_NODELAY off', False)]:
+        timings = sorted(await round_trips(nodelay, rounds))
+        print('{:16s} median {:7.3f} ms, p99 {:7.3f} ms, max {:7.3f} ms'.format(
+            name, statistics.median(timings) * 1000, timings[int(len(timings) * 0.99)] * 1000, timings[-1] * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
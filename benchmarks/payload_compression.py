@@ -0,0 +1,75 @@
+# Publishes JSON telemetry with and without payload compression and reports bytes sent and the
+# longest event loop stall while large payloads are compressed in the loop and in thread pool.
+#
+#   python -m benchmarks.payload_compression [messages]
+import asyncio
+import json
+import random
+import sys
+import time
+
+from gmqtt import Client
+from gmqtt.compression import PayloadCompression
+
+from benchmarks.broker import StandInBroker
+
+
+def telemetry(records):
+    return json.dumps([{'device_id': 'sensor-{:04d}'.format(i % 50), 'timestamp': 1700000000 + i,
+                        'temperature': round(random.uniform(18, 26), 2), 'humidity': round(random.uniform(30, 60), 1),
+                        'status': 'ok'} for i in range(records)])
+
+
+async def watch_loop_lag(lags, interval=0.001):
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(time.monotonic() - started - interval)
+
+
+async def run(port, compression, payloads):
+    client = Client('compression', payload_compression=compression)
+    await client.connect('127.0.0.1', port, keepalive=60)
+    lags = []
+    watcher = asyncio.ensure_future(watch_loop_lag(lags))
+    await asyncio.sleep(0.01)
+
+    started = time.monotonic()
+    for payload in payloads:
+        client.publish('site/1/telemetry', payload, qos=1)
+        await asyncio.sleep(0)
+    while client._compression_pending:
+        await asyncio.sleep(0.001)
+    await client._persistent_storage.wait_empty()
+    elapsed = time.monotonic() - started
+
+    watcher.cancel()
+    metrics = client.metrics
+    await client.disconnect()
+    sent = metrics.get('compression_bytes_after', 0) + sum(len(p) for p in payloads) - \
+        metrics.get('compression_bytes_before', 0)
+    return sent, elapsed, max(lags)
+
+
+async def main(count):
+    random.seed(1)
+    broker = StandInBroker()
+    server, port = await broker.serve()
+
+    small = [telemetry(20).encode() for _ in range(count)]
+    large = [telemetry(20000).encode() for _ in range(10)]
+    print('{} payloads of ~{} bytes, 10 payloads of ~{} MB'.format(count, len(small[0]), len(large[0]) // 2 ** 20))
+    for name, offload_threshold in [('no compression', False), ('compression in loop', None),
+                                    ('compression offloaded', 64 * 1024)]:
+        for label, payloads in (('small', small), ('large', large)):
+            compression = None if offload_threshold is False else \
+                PayloadCompression(offload_threshold=offload_threshold)
+            sent, elapsed, lag = await run(port, compression, payloads)
+            total = sum(len(p) for p in payloads)
+            print('{:22s} {:5s}: {:5.1f}% of payload bytes sent, {:8.1f} ms total, max loop stall {:7.2f} ms'.format(
+                name, label, sent * 100.0 / total, elapsed * 1000, lag * 1000))
+    server.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,136 @@
+# Measures time from connection loss to the first message received on the new connection over
+# a link with simulated round trip time: resubscribing from on_connect costs CONNACK round trip more
+# than pipelined session, where SUBSCRIBE goes right after CONNECT.
+#
+#   python -m benchmarks.pipelined_session [rtt_ms] [rounds]
+import asyncio
+import statistics
+import sys
+import time
+
+from gmqtt import Client
+
+from benchmarks.broker import StandInBroker
+
+
+class DelayedLink(asyncio.Protocol):
+    # TCP proxy delaying every chunk by half of rtt in each direction
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+        self.upstream = None
+        self.pending = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.proxy.links.add(self)
+        asyncio.ensure_future(self.open_upstream())
+
+    async def open_upstream(self):
+        loop = asyncio.get_running_loop()
+        self.upstream, _ = await loop.create_connection(lambda: Upstream(self), '127.0.0.1', self.proxy.port)
+        for data in self.pending:
+            self.upstream.write(data)
+
+    def data_received(self, data):
+        asyncio.get_running_loop().call_later(self.proxy.delay, self.forward, data)
+
+    def forward(self, data):
+        if self.upstream is None:
+            self.pending.append(data)
+        elif not self.upstream.is_closing():
+            self.upstream.write(data)
+
+    def backward(self, data):
+        if not self.transport.is_closing():
+            self.transport.write(data)
+
+    def connection_lost(self, exc):
+        self.proxy.links.discard(self)
+        if self.upstream is not None:
+            self.upstream.close()
+
+
+class Upstream(asyncio.Protocol):
+    def __init__(self, link):
+        self.link = link
+
+    def data_received(self, data):
+        asyncio.get_running_loop().call_later(self.link.proxy.delay, self.link.backward, data)
+
+    def connection_lost(self, exc):
+        self.link.transport.close()
+
+
+class DelayProxy:
+    def __init__(self, port, rtt):
+        self.port = port
+        self.delay = rtt / 2
+        self.links = set()
+
+    async def serve(self):
+        server = await asyncio.get_running_loop().create_server(lambda: DelayedLink(self), '127.0.0.1', 0)
+        return server, server.sockets[0].getsockname()[1]
+
+    def drop_connections(self):
+        for link in list(self.links):
+            link.transport.abort()
+
+
+async def first_message_after_loss(pipelined, rtt):
+    broker = StandInBroker()
+    broker_server, broker_port = await broker.serve()
+    proxy = DelayProxy(broker_port, rtt)
+    proxy_server, proxy_port = await proxy.serve()
+
+    received = asyncio.Event()
+    subscriber = Client('subscriber')
+    subscriber.set_config({'reconnect_delay': 0, 'pipelined_session': pipelined})
+    subscriber.on_message = lambda *args: received.set()
+    if not pipelined:
+        # usual way to restore subscriptions, see examples/resubscription.py
+        def on_connect(client, flags, rc, properties):
+            for subscription in client.subscriptions:
+                client.resubscribe(subscription)
+        subscriber.on_connect = on_connect
+    await subscriber.connect('127.0.0.1', proxy_port, keepalive=60)
+    subscriber.subscribe('ticks/#')
+    await asyncio.sleep(rtt * 2)
+
+    ticker = Client('ticker')
+    await ticker.connect('127.0.0.1', broker_port, keepalive=60)
+
+    async def tick():
+        while True:
+            ticker.publish('ticks/1', b'tick')
+            await asyncio.sleep(0.001)
+
+    ticking = asyncio.ensure_future(tick())
+    await asyncio.wait_for(received.wait(), 5)
+
+    received.clear()
+    lost = time.monotonic()
+    proxy.drop_connections()
+    await asyncio.sleep(0)
+    await asyncio.wait_for(received.wait(), 5)
+    elapsed = time.monotonic() - lost
+
+    ticking.cancel()
+    await ticker.disconnect()
+    await subscriber.disconnect()
+    proxy_server.close()
+    broker_server.close()
+    return elapsed
+
+
+async def main(rtt, rounds):
+    print('simulated rtt {:.0f} ms'.format(rtt * 1000))
+    for name, pipelined in [('resubscribe in on_connect', False), ('pipelined session', True)]:
+        timings = [await first_message_after_loss(pipelined, rtt) for _ in range(rounds)]
+        print('{:28s} loss to first message: median {:8.2f} ms, max {:8.2f} ms'.format(
+            name, statistics.median(timings) * 1000, max(timings) * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05,
+                     int(sys.argv[2]) if len(sys.argv) > 2 else 5))
@@ -0,0 +1,68 @@
+# Restarts the stand-in broker under many connected clients and compares reconnect strategies:
+# peak rate of CONNECT packets the broker receives and time until every client is connected again.
+#
+#   python -m benchmarks.reconnect_storm [clients] [downtime]
+import asyncio
+import sys
+import time
+
+from gmqtt import Client
+from gmqtt.reconnect import ExponentialBackoff, ConnectRateLimiter, JITTER_FULL, JITTER_DECORRELATED
+
+from benchmarks.broker import StandInBroker
+
+SCENARIOS = [
+    ('fixed delay 1s', lambda: {'reconnect_delay': 1}),
+    ('full jitter', lambda: {'reconnect_strategy': ExponentialBackoff(0.5, 5, JITTER_FULL)}),
+    ('decorrelated jitter', lambda: {'reconnect_strategy': ExponentialBackoff(0.5, 5, JITTER_DECORRELATED)}),
+    ('full jitter + 1000/s limit', lambda: {'reconnect_strategy': ExponentialBackoff(0.5, 5, JITTER_FULL),
+                                            'connect_rate_limiter': ConnectRateLimiter(1000, burst=100)}),
+]
+
+
+def peak_rate(times, window=0.1):
+    times = sorted(times)
+    peak, start = 0, 0
+    for end in range(len(times)):
+        while times[end] - times[start] > window:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak / window
+
+
+async def run(clients, downtime, config):
+    broker = StandInBroker()
+    server, port = await broker.serve()
+    connected = [Client('storm-{}'.format(i)) for i in range(clients)]
+    for client in connected:
+        client.set_config(config)
+    await asyncio.gather(*(client.connect('127.0.0.1', port, keepalive=60) for client in connected))
+
+    server.close()
+    broker.drop_connections()
+    restarted = time.monotonic()
+    broker.connect_times.clear()
+    await asyncio.sleep(downtime)
+    server, _ = await broker.serve(port=port)
+
+    while not all(client.is_connected for client in connected):
+        await asyncio.sleep(0.01)
+    recovery = time.monotonic() - restarted
+
+    attempts = sum(client.metrics['connect_attempts'] for client in connected) - clients
+    await asyncio.gather(*(client.disconnect() for client in connected))
+    server.close()
+    return recovery, peak_rate(broker.connect_times), attempts
+
+
+async def main(clients, downtime):
+    for name, config in SCENARIOS:
+        recovery, peak, attempts = await run(clients, downtime, config())
+        print('{:28s} recovery: {:5.2f}s, peak: {:6.0f} CONNECT/s, connect attempts: {}'.format(
+            name, recovery, peak, attempts))
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    downtime = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    asyncio.run(main(clients, downtime))
@@ -0,0 +1,61 @@
+# Hands received messages over to a consumer process through multiprocessing.Queue (pickled tuples)
+# and through SharedRing, reports messages per second for both.
+#
+#   python -m benchmarks.ring_handoff [messages] [payload_size]
+import multiprocessing
+import sys
+import time
+
+from gmqtt.ring import SharedRing
+
+
+def consume_queue(queue, messages, done):
+    for _ in range(messages):
+        queue.get()
+    done.set()
+
+
+def consume_ring(name, messages, done):
+    ring = SharedRing(name, create=False)
+    for _ in range(messages):
+        ring.get()
+    ring.close()
+    done.set()
+
+
+def bench_queue(messages, payload):
+    queue, done = multiprocessing.Queue(maxsize=10000), multiprocessing.Event()
+    consumer = multiprocessing.Process(target=consume_queue, args=(queue, messages, done))
+    consumer.start()
+    started = time.monotonic()
+    properties = {'dup': 0, 'retain': 0, 'content_type': ['application/json']}
+    for _ in range(messages):
+        queue.put(('sensors/device-1/temperature', payload, 1, properties))
+    done.wait()
+    elapsed = time.monotonic() - started
+    consumer.join()
+    return messages / elapsed
+
+
+def bench_ring(messages, payload):
+    ring, done = SharedRing(size=4 * 1024 * 1024), multiprocessing.Event()
+    consumer = multiprocessing.Process(target=consume_ring, args=(ring.name, messages, done))
+    consumer.start()
+    started = time.monotonic()
+    topic, properties = b'sensors/device-1/temperature', b'\x13\x03\x00\x10application/json'
+    for _ in range(messages):
+        while not ring.write(0x02, topic, properties, payload):
+            time.sleep(0.0001)
+    done.wait()
+    elapsed = time.monotonic() - started
+    consumer.join()
+    ring.close()
+    ring.unlink()
+    return messages / elapsed
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    payload = b'x' * (int(sys.argv[2]) if len(sys.argv) > 2 else 256)
+    print('multiprocessing.Queue: {:.0f} msg/s'.format(bench_queue(messages, payload)))
+    print('SharedRing:            {:.0f} msg/s'.format(bench_ring(messages, payload)))
@@ -0,0 +1,59 @@
+# Serializes telemetry records with every available serializer and reports time and size per message,
+# then publishes updates to an offline queue with conflation and compares eager and lazy serialization.
+#
+#   python -m benchmarks.serializers [messages]
+import sys
+import time
+
+from gmqtt import Message
+from gmqtt.serializers import StructSerializer, get_serializer, orjson, msgpack
+from gmqtt.storage import OfflineQueue
+
+RECORD = {'device_id': 'sensor-0042', 'timestamp': 1700000000, 'temperature': 21.53, 'humidity': 44.1,
+          'status': 'ok'}
+STRUCT_RECORD = (42, 1700000000, 21.53, 44.1, 1)
+
+
+def measure(serializer, record, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        payload = Message('site/1/telemetry', record, serializer=serializer).payload
+    return (time.perf_counter() - started) / count, len(payload)
+
+
+def offline_updates(count, topics, eager):
+    queue = OfflineQueue(capacity=topics, conflate=True)
+    started = time.perf_counter()
+    for i in range(count):
+        message = Message('site/{}/telemetry'.format(i % topics), RECORD)
+        if eager:
+            # what Message did before serializers were lazy
+            message.payload
+        queue.put(message)
+    for message in queue.take_all():
+        message.payload
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    serializers = [('json', RECORD)]
+    if orjson is not None:
+        serializers.append(('orjson', RECORD))
+    if msgpack is not None:
+        serializers.append(('msgpack', RECORD))
+    serializers.append((StructSerializer('struct', '<HIffB'), STRUCT_RECORD))
+
+    for serializer, record in serializers:
+        serializer = get_serializer(serializer) if isinstance(serializer, str) else serializer
+        elapsed, size = measure(serializer, record, count)
+        print('{:8} {:6.2f} us/message {:4d} bytes'.format(serializer.name, elapsed * 1e6, size))
+
+    eager = offline_updates(count, 100, eager=True)
+    lazy = offline_updates(count, 100, eager=False)
+    print('offline queue, {} updates of 100 topics: eager {:.0f} ms, lazy {:.0f} ms'.format(
+        count, eager * 1000, lazy * 1000))
+
+
+if __name__ == '__main__':
+    main()
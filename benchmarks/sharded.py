@@ -0,0 +1,69 @@
+# Publishes from many clients placed on 1..N shards of ShardedRuntime and reports total message rate.
+# Broker runs in a separate process, so it may become the bottleneck on machines with few cores.
+#
+#   python -m benchmarks.sharded [clients] [messages_per_client] [max_shards] [mode]
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+from gmqtt.sharded import ShardedRuntime
+
+from benchmarks.broker import StandInBroker
+
+
+def serve_broker(port_queue):
+    async def main():
+        server, port = await StandInBroker().serve()
+        port_queue.put(port)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+async def publish_batch(client, messages):
+    payload = b'x' * 64
+    for i in range(messages):
+        client.publish('sharded/{}'.format(i % 16), payload, qos=1)
+    await client._persistent_storage.wait_empty()
+
+
+def run(port, clients, messages, shards, mode):
+    with ShardedRuntime(shards=shards, mode=mode) as runtime:
+        handles = [runtime.add_client('sharded-{}'.format(i)) for i in range(clients)]
+        for future in [handle.connect('127.0.0.1', port) for handle in handles]:
+            future.result()
+
+        started = time.monotonic()
+        for future in [handle.call(publish_batch, messages) for handle in handles]:
+            future.result()
+        elapsed = time.monotonic() - started
+        connected = runtime.metrics['connected']
+    return connected, clients * messages / elapsed
+
+
+def main(clients, messages, max_shards, mode):
+    port_queue = multiprocessing.Queue()
+    broker = multiprocessing.Process(target=serve_broker, args=(port_queue, ), daemon=True)
+    broker.start()
+    port = port_queue.get()
+
+    baseline = None
+    shards = 1
+    while shards <= max_shards:
+        connected, rate = run(port, clients, messages, shards, mode)
+        baseline = baseline or rate
+        print('shards: {:2d}, connected: {}, {:.0f} msg/s, speedup x{:.2f}'.format(
+            shards, connected, rate, rate / baseline))
+        shards *= 2
+
+    broker.terminate()
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    max_shards = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    mode = sys.argv[4] if len(sys.argv) > 4 else None
+    main(clients, messages, max_shards, mode)
@@ -0,0 +1,81 @@
+# Consumes a shared subscription with 1..N worker processes and reports throughput per worker count.
+# Message handler is CPU bound, so throughput should grow with number of workers up to number of cores.
+#
+#   python -m benchmarks.shared_subscription [messages] [max_workers]
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+
+from gmqtt import Client
+from gmqtt.runner import SharedSubscriptionRunner
+
+from benchmarks.broker import StandInBroker
+
+
+def handle_message(client, topic, payload, qos, properties):
+    for _ in range(200):
+        payload = hashlib.sha256(payload).digest()
+    return 0
+
+
+def wait_for(runner, predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        runner.poll()
+        if predicate(runner.metrics):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+async def publish(port, messages):
+    client = Client('shared-publisher')
+    await client.connect('127.0.0.1', port)
+    for i in range(messages):
+        client.publish('jobs/{}'.format(i % 16), os.urandom(64), qos=1)
+    # wait for all PUBACKs before disconnect
+    await client._persistent_storage.wait_empty()
+    await client.disconnect()
+
+
+def run(loop, port, messages, workers):
+    runner = SharedSubscriptionRunner('bench', 'jobs/#', handle_message, ('127.0.0.1', port), workers=workers,
+                                      metrics_interval=0.05)
+    runner.start()
+    try:
+        wait_for(runner, lambda metrics: metrics.get('connected', 0) == workers)
+        started = time.monotonic()
+        asyncio.run_coroutine_threadsafe(publish(port, messages), loop).result()
+        wait_for(runner, lambda metrics: metrics.get('received', 0) >= messages)
+        elapsed = time.monotonic() - started
+    finally:
+        runner.shutdown()
+    return runner.metrics['received'], elapsed
+
+
+def main(messages, max_workers):
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server, port = asyncio.run_coroutine_threadsafe(StandInBroker().serve(), loop).result()
+
+    baseline = None
+    workers = 1
+    while workers <= max_workers:
+        received, elapsed = run(loop, port, messages, workers)
+        throughput = received / elapsed
+        baseline = baseline or throughput
+        print('workers: {:2d}, received: {}, {:.0f} msg/s, speedup x{:.2f}'.format(
+            workers, received, throughput, throughput / baseline))
+        workers *= 2
+
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    main(messages, max_workers)
@@ -0,0 +1,62 @@
+# Measures failover time of a client with hot standby connection: primary broker drops the connection
+# while QoS 1 messages are unacknowledged, standby connection on the second broker takes over and
+# the messages are resent there. Compared with reconnecting to the second endpoint without standby.
+#
+#   python -m benchmarks.standby [rounds] [pending_messages]
+import asyncio
+import statistics
+import sys
+import time
+
+from gmqtt import Client
+
+from benchmarks.broker import StandInBroker
+
+
+async def failover(standby, pending):
+    # primary broker never acknowledges, so published messages stay pending
+    primary, backup = StandInBroker(ack=False), StandInBroker()
+    primary_server, primary_port = await primary.serve()
+    backup_server, backup_port = await backup.serve()
+    backup_endpoint = '127.0.0.1:{}'.format(backup_port)
+
+    if standby:
+        client = Client('standby-bench', standby_endpoint=backup_endpoint)
+        await client.connect('127.0.0.1', primary_port, keepalive=60)
+        while client._standby is None or not client._standby.ready:
+            await asyncio.sleep(0.001)
+    else:
+        client = Client('standby-bench')
+        await client.connect(['127.0.0.1:{}'.format(primary_port), backup_endpoint], keepalive=60)
+    client.set_config({'reconnect_delay': 1})
+
+    for i in range(pending):
+        client.publish('standby/bench', b'x' * 64, qos=1)
+    await asyncio.sleep(0.01)
+
+    started = time.monotonic()
+    primary_server.close()
+    primary.drop_connections()
+    await asyncio.wait_for(client._persistent_storage.wait_empty(), 10)
+    delivered = time.monotonic() - started
+
+    # without session on the second broker stored messages are dropped, not resent
+    result = client.metrics['failover_time_last'], delivered, backup.published
+    await client.disconnect()
+    backup_server.close()
+    return result
+
+
+async def main(rounds, pending):
+    for name, standby in [('reconnect to second endpoint', False), ('hot standby', True)]:
+        results = [await failover(standby, pending) for _ in range(rounds)]
+        print('{:30s} failover median {:6.2f} ms, max {:6.2f} ms; {} of {} pending messages delivered, '
+              'storage empty in {:6.2f} ms'.format(
+                  name, statistics.median(r[0] for r in results) * 1000, max(r[0] for r in results) * 1000,
+                  min(r[2] for r in results), pending, statistics.median(r[1] for r in results) * 1000))
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    pending = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    asyncio.run(main(rounds, pending))
@@ -0,0 +1,48 @@
+# Compares storing and acknowledging QoS 1 messages through the Task based storage API
+# (one Task per push and per remove) with synchronous push_nowait/remove_nowait fast path.
+#
+#   python -m benchmarks.storage_fast_path [messages] [in_flight]
+import asyncio
+import sys
+import time
+
+from gmqtt.storage import HeapPersistentStorage
+
+PACKAGE = bytearray(b'\x32\x10\x00\x04test\x00\x01\x00payload')
+
+
+async def run_tasks(storage, messages, in_flight):
+    for mid in range(messages):
+        storage.push_message_nowait(mid, PACKAGE)
+        if mid >= in_flight:
+            asyncio.ensure_future(storage.remove_message_by_mid(mid - in_flight))
+    # let scheduled tasks finish
+    while await storage.is_empty is False and len(asyncio.all_tasks()) > 1:
+        await asyncio.sleep(0)
+
+
+async def run_fast_path(storage, messages, in_flight):
+    for mid in range(messages):
+        storage.push_nowait(mid, PACKAGE)
+        if mid >= in_flight:
+            storage.remove_nowait(mid - in_flight)
+
+
+async def measure(func, messages, in_flight):
+    storage = HeapPersistentStorage()
+    started = time.perf_counter()
+    await func(storage, messages, in_flight)
+    return time.perf_counter() - started
+
+
+async def main(messages, in_flight):
+    for name, func in (('tasks', run_tasks), ('fast path', run_fast_path)):
+        elapsed = await measure(func, messages, in_flight)
+        print('{:>10}: {:.3f}s, {:.0f} msg/s, {:.2f} us/msg'.format(
+            name, elapsed, messages / elapsed, elapsed / messages * 1e6))
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(main(messages, in_flight))
@@ -0,0 +1,49 @@
+# Measures TLS handshake time and CPU time (client and broker share the process) per connection with
+# full handshake each time and with TLS session resumption.
+#
+#   python -m benchmarks.tls_resumption [reconnects]
+import asyncio
+import os
+import ssl
+import statistics
+import sys
+import time
+
+from gmqtt import Client
+from gmqtt.tls import create_default_context
+
+from benchmarks.broker import StandInBroker
+
+CERT = os.path.join(os.path.dirname(__file__), '..', 'tests', 'certs', 'localhost.pem')
+
+
+async def reconnects(context, count, resume):
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(CERT)
+    server, port = await StandInBroker().serve(ssl=server_context)
+
+    handshakes, reused = [], 0
+    cpu_started = time.process_time()
+    for _ in range(count):
+        if not resume:
+            context.clear_sessions()
+        client = Client('tls')
+        await client.connect('127.0.0.1', port, ssl=context, keepalive=60)
+        handshakes.append(client.metrics['tls_handshake_time_last'])
+        reused += client.metrics['tls_sessions_reused']
+        await client.disconnect()
+    cpu_time = time.process_time() - cpu_started
+
+    server.close()
+    return handshakes, cpu_time, reused
+
+
+async def main(count):
+    for name, resume in [('full handshake', False), ('session resumption', True)]:
+        handshakes, cpu_time, reused = await reconnects(create_default_context(cafile=CERT), count, resume)
+        print('{:20s} handshake median {:6.2f} ms, cpu {:6.2f} ms per connect, {} of {} sessions reused'.format(
+            name, statistics.median(handshakes) * 1000, cpu_time / count * 1000, reused, count))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,51 @@
+# Compares QoS 1 publish throughput (until every message is acknowledged) over TCP loopback,
+# unix domain socket and in-memory transport, client and broker share one event loop.
+#
+#   python -m benchmarks.transports [messages]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from gmqtt import Client
+from gmqtt.transports import MemoryTransport, UnixTransport
+
+from benchmarks.broker import StandInBroker
+
+
+async def throughput(host, port, transport, count):
+    client = Client('transports')
+    await client.connect(host, port, keepalive=60, transport=transport)
+    payload = b'x' * 64
+    started = time.monotonic()
+    for i in range(count):
+        client.publish('telemetry/1', payload, qos=1)
+        if i % 1000 == 999:
+            await asyncio.sleep(0)
+    await client._persistent_storage.wait_empty()
+    elapsed = time.monotonic() - started
+    await client.disconnect()
+    return count / elapsed
+
+
+async def main(count):
+    broker = StandInBroker()
+    tcp_server, port = await broker.serve()
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    unix_server = await broker.serve_unix(path)
+    memory_server = broker.serve_memory('broker')
+
+    for name, host, transport in [('tcp loopback', '127.0.0.1', None),
+                                  ('unix socket', path, UnixTransport()),
+                                  ('memory', 'broker', MemoryTransport())]:
+        print('{:14s} {:10.0f} msg/s'.format(name, await throughput(host, port, transport, count)))
+
+    tcp_server.close()
+    unix_server.close()
+    memory_server.close()
+    os.unlink(path)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,64 @@
+# Bytes on the wire for typical JSON telemetry sent over MQTT over WebSocket with and without
+# permessage-deflate, every PUBLISH is a separate WebSocket message.
+#
+#   python -m benchmarks.websocket_compression [messages]
+import asyncio
+import json
+import random
+import sys
+import time
+
+from gmqtt import Client
+from gmqtt.websocket import WebSocketTransport
+
+from benchmarks.broker import StandInBroker
+
+
+def telemetry(i):
+    return json.dumps({
+        'device_id': 'sensor-{:04d}'.format(i % 50),
+        'timestamp': 1700000000 + i,
+        'temperature': round(random.uniform(18, 26), 2),
+        'humidity': round(random.uniform(30, 60), 1),
+        'battery': random.randint(20, 100),
+        'status': 'ok',
+        'location': {'lat': 52.52, 'lon': 13.405},
+    }).encode()
+
+
+async def run(port, compression, qos, count):
+    client = Client('ws-telemetry')
+    await client.connect('127.0.0.1', port, keepalive=60, transport=WebSocketTransport(compression=compression))
+    websocket = client._connection.get_extra_info('websocket')
+    sent_before, payload_before = websocket.bytes_sent, websocket.payload_bytes_sent
+
+    started = time.monotonic()
+    for i in range(count):
+        client.publish('site/1/telemetry', telemetry(i), qos=qos)
+        if i % 100 == 99:
+            await asyncio.sleep(0)
+    await client._persistent_storage.wait_empty()
+    elapsed = time.monotonic() - started
+
+    wire = websocket.bytes_sent - sent_before
+    payload = websocket.payload_bytes_sent - payload_before
+    await client.disconnect()
+    return wire, payload, count / elapsed
+
+
+async def main(count):
+    random.seed(1)
+    sample = telemetry(0)
+    print('{} messages of ~{} bytes JSON'.format(count, len(sample)))
+    for compression in (False, True):
+        broker = StandInBroker()
+        server, port = await broker.serve_websocket(compression=compression)
+        for qos in (1, 0):
+            wire, payload, rate = await run(port, compression, qos, count)
+            print('compression {:5s} qos {}: {:9d} bytes on the wire for {:9d} bytes of MQTT ({:5.1f}%), '
+                  '{:7.0f} msg/s'.format(str(compression), qos, wire, payload, wire * 100.0 / payload, rate))
+        server.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -1,8 +1,9 @@
 import datetime
 
-from .client import Client, Message, Subscription
+from .client import Client, Message, FrozenMessage, Subscription
 from .mqtt import constants
 from .mqtt.protocol import BaseMQTTProtocol
+from .mqtt.incoming import IncomingMessage
 from .mqtt.handler import MQTTConnectError
 
 __author__ = "Mikhail Turchunovich"
@@ -19,7 +20,9 @@ __version__ = "0.7.0"
 __all__ = [
     'Client',
     'Message',
+    'FrozenMessage',
     'Subscription',
+    'IncomingMessage',
     'BaseMQTTProtocol',
     'MQTTConnectError',
     'constants'
@@ -1,46 +1,164 @@
 import asyncio
-import json
+import collections
+import struct
+import time
 
 import logging
 import uuid
-from copy import copy
+from types import MappingProxyType
 from typing import Union, Sequence
 
-from .mqtt.protocol import MQTTProtocol
 from .mqtt.connection import MQTTConnection
-from .mqtt.handler import MqttPackageHandler
+from .mqtt.handler import MqttPackageHandler, MQTTConnectError
+from .mqtt.package import PublishPacket
 from .mqtt.constants import MQTTv50, UNLIMITED_RECONNECTS
 
-from .storage import HeapPersistentStorage
+from .sockopts import SocketOptions
+from .standby import StandbyConnection
+from .storage import HeapPersistentStorage, StorageFullError
+from .serializers import get_deserializer, get_serializer
+from .tls import ResumingSSLContext, default_context
+
+
+def _parse_endpoints(hosts, default_port):
+    # accepts host, "host:port", (host, port) or list or tuple of them, returns list of (host, port)
+    if isinstance(hosts, str) or (isinstance(hosts, tuple) and len(hosts) == 2 and isinstance(hosts[1], int)):
+        hosts = [hosts]
+    endpoints = []
+    for endpoint in hosts:
+        if isinstance(endpoint, tuple):
+            host, port = endpoint
+        else:
+            host, sep, port = endpoint.rpartition(':')
+            # bare IPv6 address has colons too
+            if not sep or not port.isdigit() or (':' in host and not host.endswith(']')):
+                host, port = endpoint, default_port
+            host = host.strip('[]')
+        endpoints.append((host, int(port)))
+    if not endpoints:
+        raise ValueError('At least one broker endpoint is required')
+    return endpoints
+
+
+# encoded topics are shared by messages published to the same topic, cache is reset when it grows over the limit
+TOPIC_CACHE_SIZE = 65536
+_topic_cache = {}
+
+
+def _encode_topic(topic):
+    encoded = _topic_cache.get(topic)
+    if encoded is None:
+        if len(_topic_cache) >= TOPIC_CACHE_SIZE:
+            _topic_cache.clear()
+        encoded = _topic_cache[topic] = topic.encode('utf-8', errors='replace')
+    return encoded
+
+
+def _restore_message(cls, topic, payload, qos, retain, priority, properties):
+    return cls(topic, payload, qos=qos, retain=retain, priority=priority, **properties)
 
 
 class Message:
-    def __init__(self, topic, payload, qos=0, retain=False, **kwargs):
-        self.topic = topic.encode('utf-8', errors='replace') if isinstance(topic, str) else topic
+    __slots__ = ('topic', 'qos', 'retain', 'dup', 'priority', 'properties', '_payload', '_payload_object',
+                 '_serializer')
+
+    frozen = False
+
+    def __init__(self, topic, payload, qos=0, retain=False, priority=0, serializer=None, **kwargs):
+        self.topic = _encode_topic(topic) if isinstance(topic, str) else topic
         self.qos = qos
         self.retain = retain
         self.dup = False
+        # local only, used by storages which drop messages by priority on overflow
+        self.priority = priority
         self.properties = kwargs
 
-        if isinstance(payload, (list, tuple, dict)):
-            payload = json.dumps(payload, ensure_ascii=False)
+        # lists, tuples and dicts are serialized when payload is needed first (usually when the packet is built),
+        # so messages dropped or conflated before sending are never serialized; the object is not copied, changes
+        # made to it while message waits in offline queue are sent
+        self._payload = None
+        self._payload_object = None
+        self._serializer = get_serializer(serializer) if isinstance(serializer, str) else serializer
 
-        if isinstance(payload, (int, float)):
-            self.payload = str(payload).encode('ascii')
+        if isinstance(payload, (list, tuple, dict)):
+            self._payload_object = payload
+            # explicitly selected serializer tags the payload, so receivers may decode it by content type
+            if self._serializer is not None and 'content_type' not in kwargs:
+                kwargs['content_type'] = self._serializer.content_type
+        elif isinstance(payload, (int, float)):
+            self._payload = str(payload).encode('ascii')
         elif isinstance(payload, str):
-            self.payload = payload.encode('utf-8', errors='replace')
+            self._payload = payload.encode('utf-8', errors='replace')
         elif payload is None:
-            self.payload = b''
+            self._payload = b''
+        elif isinstance(payload, bytes):
+            self._payload = payload
         else:
-            self.payload = payload
-
-        self.payload_size = len(self.payload)
+            # other buffers (bytearray, mmap, array...) are not copied, they must not change until sent
+            payload = memoryview(payload)
+            if payload.ndim != 1 or payload.itemsize != 1:
+                payload = payload.cast('B') if payload.c_contiguous else memoryview(payload.tobytes())
+            self._payload = payload
 
-        if self.payload_size > 268435455:
+        if self._payload is not None and len(self._payload) > 268435455:
             raise ValueError('Payload too large.')
 
+    def __reduce__(self):
+        # memoryview payloads can't be pickled
+        return _restore_message, (type(self), self.topic, bytes(self.payload), self.qos, self.retain, self.priority,
+                                  dict(self.properties))
+
+    def copy(self):
+        # mutable copy sharing topic and payload
+        message = Message.__new__(Message)
+        for name in Message.__slots__:
+            setattr(message, name, getattr(self, name))
+        message.properties = dict(self.properties)
+        return message
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            payload = (self._serializer or get_serializer('json')).dumps(self._payload_object)
+            if len(payload) > 268435455:
+                raise ValueError('Payload too large.')
+            self._payload, self._payload_object = payload, None
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload):
+        self._payload, self._payload_object = payload, None
+
+    @property
+    def payload_size(self):
+        return len(self.payload)
+
+
+class FrozenMessage(Message):
+    # immutable message to publish many times: payload is serialized once, on creation
+    __slots__ = ('_sealed', )
+
+    frozen = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.payload
+        self.properties = MappingProxyType(self.properties)
+        self._sealed = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_sealed', False):
+            raise AttributeError('FrozenMessage is immutable, use copy()')
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError('FrozenMessage is immutable, use copy()')
+
 
 class Subscription:
+    __slots__ = ('topic', 'qos', 'no_local', 'retain_as_published', 'retain_handling_options', 'mid', 'acknowledged',
+                 'subscription_identifier')
+
     def __init__(self, topic, qos=0, no_local=False, retain_as_published=False, retain_handling_options=0,
                  subscription_identifier=None):
         self.topic = topic
@@ -140,7 +258,14 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
 
         self._host = None
         self._port = None
+        # broker endpoints in order of preference, connection is established to one of them
+        self._endpoints = []
+        self._redirect_pending = False
+        # reconnects without delay since the last delayed one, at most one per other endpoint
+        self._failovers_in_row = 0
         self._ssl = None
+        self._socket_options = None
+        self._transport_factory = None
 
         self._connect_properties = kwargs
         self._connack_properties = {}
@@ -148,12 +273,82 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
         self._will_message = will_message
 
         # TODO: this constant may be moved to config
-        self._persistent_storage = kwargs.pop('persistent_storage', HeapPersistentStorage())
+        self._persistent_storage = kwargs.pop('persistent_storage', None) or HeapPersistentStorage()
+        # ids of messages dropped by storage on overflow are not acknowledged, they are freed here
+        self._persistent_storage.on_drop = self._id_generator.free_id
+        # messages published while disconnected are kept here, if set
+        self._offline_queue = kwargs.pop('offline_queue', None)
+        # received QoS>0 messages are acknowledged after they are written to this log, if set
+        self._inbound_log = kwargs.pop('inbound_log', None)
+        # received messages are written to this sink (e.g. shared memory ring) instead of on_message, if set
+        self._inbound_sink = kwargs.pop('inbound_sink', None)
+        if self._inbound_sink is not None:
+            self._inbound_sink.set_flow_control(self._pause_reading, self._resume_reading)
+        # lists, tuples and dicts published without serializer are serialized with this one (json by default)
+        self._serializer = kwargs.pop('serializer', None)
+        # received payloads with content type of registered serializer are passed to on_message deserialized
+        self._deserialize = kwargs.pop('deserialize', False)
+        # published payloads are compressed and received ones decompressed with this PayloadCompression, if set
+        self._payload_compression = kwargs.pop('payload_compression', None)
+        # messages waiting for compression in thread pool and the ones published after them
+        self._compression_pending = collections.deque()
+        # keepalive timers are scheduled in this TimerWheel, if set (it may be shared by many clients)
+        self._timer_wheel = kwargs.pop('timer_wheel', None)
+        if 'inbound_qos2_state' in kwargs:
+            self._inbound_qos2 = kwargs.pop('inbound_qos2_state')
+        # hot standby: second connection kept ready on alternate endpoint and/or with alternate client id,
+        # it takes over when the primary connection is lost. Both connections must never share a client id,
+        # otherwise a (clustered) broker makes them take over each other's session
+        self._standby_endpoint = kwargs.pop('standby_endpoint', None)
+        self._standby_client_id = kwargs.pop('standby_client_id', None)
+        if self._standby_client_id is not None and self._standby_client_id == client_id:
+            raise ValueError('Standby connection must use other client id')
+        self._standby = None
+        self._standby_task = None
 
         self._topic_alias_maximum = kwargs.get('topic_alias_maximum', 0)
 
+        self._resend_inflight = set()
+        self._resend_window = None
+        self._metrics = {
+            'resend_total': 0,
+            'resend_sent': 0,
+            'expired_messages': 0,
+            'connect_attempts': 0,
+            'connect_success': 0,
+            'connect_failures': 0,
+            'connect_rate_wait': 0.0,
+            'reconnect_delay_last': 0.0,
+            'reconnect_delay_total': 0.0,
+            'failovers': 0,
+            'failover_time_last': 0.0,
+            'redirects': 0,
+            'standby_takeovers': 0,
+            'standby_failures': 0,
+            'standby_dropped_messages': 0,
+            'pipelined_subscriptions': 0,
+            'pipelined_messages': 0,
+            'pipeline_rollbacks': 0,
+            'tls_handshakes': 0,
+            'tls_sessions_reused': 0,
+            'tls_handshake_time_last': 0.0,
+            'tls_handshake_time_total': 0.0,
+        }
+        self._pipelined = None
+        self._previous_reconnect_delay = None
+
         self._logger = logger or logging.getLogger(__name__)
 
+    @property
+    def metrics(self):
+        metrics = {'failed_connections': self.failed_connections}
+        metrics.update(self._metrics)
+        if self._offline_queue is not None:
+            metrics.update(('offline_' + key, value) for key, value in self._offline_queue.metrics.items())
+        if self._payload_compression is not None:
+            metrics.update(('compression_' + key, value) for key, value in self._payload_compression.metrics.items())
+        return metrics
+
     def get_subscription_by_identifier(self, subscription_identifier):
         return next((sub for sub in self.subscriptions if sub.subscription_identifier == subscription_identifier), None)
 
@@ -162,42 +357,190 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
 
     def _remove_message_from_query(self, mid):
         self._logger.debug('[REMOVE MESSAGE] %s', mid)
-        asyncio.ensure_future(
-            self._persistent_storage.remove_message_by_mid(mid)
-        )
+        if mid in self._resend_inflight:
+            self._resend_inflight.discard(mid)
+            self._resend_window.set()
+        self._persistent_storage.remove_nowait(mid)
 
     @property
     def is_connected(self):
         # tells if connection is alive and CONNACK was received
         return self._connected.is_set() and not self._connection.is_closing()
 
+    async def _wait_resend_window(self, connection, receive_maximum):
+        # waits until broker acknowledges enough of resent messages, returns False if connection was lost
+        while len(self._resend_inflight) >= receive_maximum:
+            if connection is not self._connection or connection.is_closing():
+                return False
+            self._resend_window.clear()
+            try:
+                await asyncio.wait_for(self._resend_window.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        return connection is self._connection and not connection.is_closing()
+
+    async def _expire_stored_message(self, tm, mid, package):
+        # drops expired message or returns its copy with remaining message expiry interval
+        if self.protocol_version < MQTTv50:
+            return package
+        expiry = PublishPacket.find_message_expiry(package)
+        if expiry is None:
+            return package
+
+        offset, interval = expiry
+        elapsed = int(time.time() - tm)
+        if elapsed < interval:
+            # stored package keeps the original interval, it is counted from the enqueue time
+            package = bytearray(package)
+            struct.pack_into('!L', package, offset, interval - elapsed)
+            return package
+
+        self._logger.debug('[MESSAGE EXPIRED] mid: %s', mid)
+        await self._persistent_storage.remove_message_by_mid(mid)
+        self._id_generator.free_id(mid)
+        self._metrics['expired_messages'] += 1
+        self.on_message_expired(self, mid, package)
+        return None
+
     async def _resend_qos_messages(self):
         await self._connected.wait()
+        connection = self._connection
 
         if await self._persistent_storage.is_empty:
             self._logger.debug('[QoS query IS EMPTY]')
+            self._flush_offline_queue()
             return
-        elif self._connection.is_closing():
+        elif connection.is_closing():
             self._logger.debug('[Some msg need to resend] Transport is closing')
             return
-        else:
-            msgs = copy(await self._persistent_storage.get_all())
-            self._logger.debug('[msgs need to resend] processing %s messages', len(msgs))
-
-            await self._persistent_storage.clear()
 
-            for msg in msgs:
-                (_, mid, package) = msg
+        # messages stay in storage while being resent, they will be removed when acknowledged
+        receive_maximum = self._connack_properties.get('receive_maximum', [65535])[0]
+        total = self._persistent_storage.size_hint()
+        sent = 0
+        self._resend_inflight = set()
+        if self._resend_window is None:
+            self._resend_window = asyncio.Event()
+        self._metrics['resend_total'] = total
+        self._metrics['resend_sent'] = 0
+        self._logger.debug('[msgs need to resend] processing %s messages', total)
+
+        async for chunk in self._persistent_storage.iter_chunks(self._config['resend_chunk_size']):
+            for (tm, mid, package) in chunk:
+                package = await self._expire_stored_message(tm, mid, package)
+                if package is None:
+                    continue
+                if not await self._wait_resend_window(connection, receive_maximum):
+                    self._logger.debug('[RESEND INTERRUPTED] %s messages were resent', sent)
+                    return
 
                 try:
-                    self._connection.send_package(package)
+                    connection.send_package(PublishPacket.set_dup(package))
                 except Exception as exc:
                     self._logger.error('[ERROR WHILE RESENDING] mid: %s', mid, exc_info=exc)
-
-                await self._persistent_storage.push_message(mid, package)
-
-    async def _clear_resend_qos_queue(self):
-        await self._persistent_storage.clear()
+                    continue
+                self._resend_inflight.add(mid)
+                sent += 1
+
+            self._metrics['resend_sent'] = sent
+            self.on_resend_progress(self, sent, total)
+            try:
+                await connection.drain()
+            except ConnectionResetError:
+                self._logger.debug('[RESEND INTERRUPTED] %s messages were resent', sent)
+                return
+
+        self._logger.debug('[RESEND FINISHED] %s messages were resent', sent)
+        self._flush_offline_queue()
+
+    def _flush_offline_queue(self):
+        if self._offline_queue is None or not len(self._offline_queue) or not self.is_connected:
+            return
+        self._send_offline_queue()
+
+    def _send_offline_queue(self):
+        # returns sent messages with their mids
+        messages = []
+        for message in self._offline_queue.take_all():
+            try:
+                # payload objects are serialized here, one which can't be must not stop the flush
+                message.payload
+            except Exception as exc:
+                self._logger.warning('[OFFLINE QUEUE] could not serialize payload, message dropped: %s', exc)
+                continue
+            if message.qos > 0 and self._persistent_storage.has_capacity_limit:
+                try:
+                    self._persistent_storage.check_capacity(PublishPacket.package_size(message, self.protocol_version))
+                except StorageFullError:
+                    self._logger.warning('[OFFLINE QUEUE] persistent storage is full, message dropped')
+                    continue
+            messages.append(message)
+        self._logger.debug('[OFFLINE QUEUE] flushing %s messages', len(messages))
+
+        sent = []
+        for message, (mid, package) in zip(messages, self._connection.publish_many(messages)):
+            self._store_message(message, mid, package)
+            sent.append((message, mid))
+        return sent
+
+    def _send_subscriptions(self):
+        # one SUBSCRIBE per subscription identifier, returns their mids
+        groups = {}
+        for subscription in self.subscriptions:
+            groups.setdefault(subscription.subscription_identifier, []).append(subscription)
+        mids = []
+        for identifier, subscriptions in groups.items():
+            kwargs = {'subscription_identifier': identifier} if identifier is not None else {}
+            mids.append(self._connection.subscribe(subscriptions, **kwargs))
+        return mids
+
+    async def _pipeline_session(self):
+        # MQTT allows to send packets right after CONNECT, so subscriptions and queued messages
+        # do not wait for CONNACK round trip
+        if not self._config['pipelined_session']:
+            return
+        subscribe_mids = self._send_subscriptions()
+        sent = []
+        # messages stored by previous connection are resent after CONNACK, queued ones must go after them
+        if self._offline_queue is not None and len(self._offline_queue) and await self._persistent_storage.is_empty:
+            sent = self._send_offline_queue()
+        self._pipelined = (subscribe_mids, sent)
+        self._metrics['pipelined_subscriptions'] += len(self.subscriptions)
+        self._metrics['pipelined_messages'] += len(sent)
+
+    def _finish_pipelined_session(self, result):
+        if self._pipelined is None:
+            return False
+        if result != 0:
+            self._rollback_pipelined_session()
+            return False
+        (_, sent), self._pipelined = self._pipelined, None
+        if not sent:
+            return False
+        # messages published while waiting for CONNACK
+        self._flush_offline_queue()
+        return True
+
+    def _rollback_pipelined_session(self):
+        # CONNACK rejected or connection lost before it: pipelined messages go back to the offline queue
+        pipelined, self._pipelined = self._pipelined, None
+        if pipelined is None:
+            return
+        subscribe_mids, sent = pipelined
+        for mid in subscribe_mids:
+            self._id_generator.free_id(mid)
+        for message, mid in sent:
+            if mid is not None:
+                self._persistent_storage.remove_nowait(mid)
+                self._id_generator.free_id(mid)
+        if sent:
+            self._offline_queue.requeue([message for message, _ in sent])
+        self._metrics['pipeline_rollbacks'] += 1
+        self._logger.debug('[PIPELINE] rolled back %s messages', len(sent))
+
+    def _clear_resend_qos_queue(self):
+        # must be done before any new message is pushed to storage
+        self._persistent_storage.clear_nowait()
 
 
     @property
@@ -211,22 +554,36 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
         if isinstance(self._password, str):
             self._password = password.encode()
 
-    async def connect(self, host, port=1883, ssl=False, keepalive=60, version=MQTTv50, raise_exc=True):
+    @property
+    def endpoint(self):
+        # broker endpoint (host, port) the client is connected (or connecting) to
+        return self._host, self._port
+
+    async def connect(self, host, port=1883, ssl=False, keepalive=60, version=MQTTv50, raise_exc=True,
+                      socket_options=None, transport=None):
+        # host may be a list of broker endpoints: hosts, "host:port" strings or (host, port) tuples
+        # transport is a factory from gmqtt.transports (TCP by default), e.g. UnixTransport with socket path as host
         # Init connection
-        self._host = host
-        self._port = port
-        self._ssl = ssl
+        self._endpoints = _parse_endpoints(host, port)
+        self._host, self._port = self._endpoints[0]
+        # shared context resumes TLS sessions on reconnect instead of new context and full handshake each time
+        self._ssl = default_context() if ssl is True else ssl
         self._keepalive = keepalive
+        self._socket_options = SocketOptions(**socket_options) if isinstance(socket_options, dict) else socket_options
+        self._transport_factory = transport
         self._is_active = True
+        self._connection_lost_at = None
 
-        MQTTProtocol.proto_ver = version
+        self._protocol_version = version
 
         self._connection = await self._create_connection(
-            host, port=self._port, ssl=self._ssl, clean_session=self._clean_session, keepalive=keepalive)
+            self._host, port=self._port, ssl=self._ssl, clean_session=self._clean_session, keepalive=keepalive)
 
         await self._connection.auth(self._client_id, self._username, self._password, will_message=self._will_message,
                                     **self._connect_properties)
+        await self._pipeline_session()
         await self._connected.wait()
+        self._start_standby()
 
         await self._persistent_storage.wait_empty()
 
@@ -234,13 +591,154 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
             raise self._error
 
     async def _create_connection(self, host, port, ssl, clean_session, keepalive):
+        limiter = self._config['connect_rate_limiter']
+        if limiter is not None:
+            self._metrics['connect_rate_wait'] += await limiter.acquire()
         # important for reconnects, make sure u know what u are doing if wanna change :(
         self._exit_reconnecting_state()
         self._clear_topics_aliases()
-        connection = await MQTTConnection.create_connection(host, port, ssl, clean_session, keepalive, logger=self._logger)
+        self._metrics['connect_attempts'] += 1
+        try:
+            if len(self._endpoints) > 1:
+                connection, (self._host, self._port) = await self._probe_endpoints(ssl, clean_session, keepalive)
+            else:
+                connection = await MQTTConnection.create_connection(host, port, ssl, clean_session, keepalive,
+                                                                    logger=self._logger, timer_wheel=self._timer_wheel,
+                                                                    socket_options=self._socket_options,
+                                                                    transport=self._transport_factory,
+                                                                    id_generator=self._id_generator,
+                                                                    protocol_version=self._protocol_version)
+        except OSError:
+            self._metrics['connect_failures'] += 1
+            raise
+        self._update_tls_metrics(connection)
         connection.set_handler(self)
         return connection
 
+    @property
+    def _decodes_payload(self):
+        return self._payload_compression is not None or self._deserialize
+
+    def _decode_payload(self, payload, properties):
+        if self._payload_compression is not None:
+            try:
+                payload = self._payload_compression.decompress(payload, properties)
+            except Exception as exc:
+                # pluggable codecs raise their own errors
+                self._logger.warning('[COMPRESSION] could not decompress payload, passing it as is: %s', exc)
+                return payload
+        if self._deserialize and 'content_type' in properties:
+            serializer = get_deserializer(properties['content_type'][0])
+            if serializer is not None:
+                try:
+                    return serializer.loads(payload)
+                except Exception as exc:
+                    self._logger.warning('[DESERIALIZE] could not decode %s payload, passing it as is: %s',
+                                         properties['content_type'][0], exc)
+        return payload
+
+    def _update_tls_metrics(self, connection):
+        ssl_object = connection.get_extra_info('ssl_object')
+        if ssl_object is None:
+            return
+        self._metrics['tls_handshakes'] += 1
+        self._metrics['tls_sessions_reused'] += ssl_object.session_reused
+        started = getattr(ssl_object, 'handshake_started', None)
+        if started is not None:
+            self._metrics['tls_handshake_time_last'] = time.monotonic() - started
+            self._metrics['tls_handshake_time_total'] += self._metrics['tls_handshake_time_last']
+
+    def _save_tls_session(self):
+        ssl_object = self._connection.get_extra_info('ssl_object') if self._connection is not None else None
+        if ssl_object is not None and isinstance(ssl_object.context, ResumingSSLContext):
+            ssl_object.context.save_session(ssl_object)
+
+    async def _probe_endpoints(self, ssl, clean_session, keepalive):
+        # happy eyeballs: connection attempts start one after another with small delay, so preferred
+        # endpoints get a head start, and the first established connection wins
+        probe_delay = self._config['endpoint_probe_delay']
+
+        async def probe(index, host, port):
+            await asyncio.sleep(index * probe_delay)
+            connection = await MQTTConnection.create_connection(host, port, ssl, clean_session, keepalive,
+                                                                logger=self._logger, timer_wheel=self._timer_wheel,
+                                                                socket_options=self._socket_options,
+                                                                transport=self._transport_factory,
+                                                                id_generator=self._id_generator,
+                                                                protocol_version=self._protocol_version)
+            return connection, (host, port)
+
+        pending = {asyncio.ensure_future(probe(index, host, port))
+                   for index, (host, port) in enumerate(self._endpoints)}
+        winner, errors = None, []
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        asyncio.ensure_future(task.result()[0].close())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if winner is None:
+            raise OSError('Could not connect to any endpoint: {}'.format('; '.join(str(exc) for exc in errors)))
+        self._logger.debug('[ENDPOINT] connected to %s:%s', *winner[1])
+        return winner
+
+    def _update_connect_metrics(self, result):
+        if result == 0:
+            self._metrics['connect_success'] += 1
+            self._save_tls_session()
+            self._previous_reconnect_delay = None
+            if self._connection_lost_at is not None:
+                self._metrics['failover_time_last'] = time.monotonic() - self._connection_lost_at
+                self._connection_lost_at = None
+        else:
+            self._metrics['connect_failures'] += 1
+
+    def _handle_server_reference(self, server_reference):
+        # CONNACK or DISCONNECT with "use another server"/"server moved": reference is a space separated
+        # list of endpoints, they are tried first on the next reconnect, which starts without delay
+        self._logger.info('[REDIRECT] server reference: %s', server_reference)
+        endpoints = _parse_endpoints(server_reference.split(), self._port)
+        self._endpoints = endpoints + [endpoint for endpoint in self._endpoints if endpoint not in endpoints]
+        self._host, self._port = self._endpoints[0]
+        self._redirect_pending = True
+        self._metrics['redirects'] += 1
+
+    def _skip_reconnect_delay(self):
+        if self._redirect_pending:
+            self._redirect_pending = False
+            return True
+        if len(self._endpoints) > 1 and self.failed_connections == 0 \
+                and self._failovers_in_row < len(self._endpoints) - 1:
+            # connection to a healthy endpoint was lost: fail over to others right away, lost one goes last;
+            # brokers accepting connections and dropping them get the delay after every endpoint was tried
+            current = (self._host, self._port)
+            self._endpoints = [endpoint for endpoint in self._endpoints if endpoint != current] + [current]
+            self._host, self._port = self._endpoints[0]
+            self._failovers_in_row += 1
+            self._metrics['failovers'] += 1
+            return True
+        self._failovers_in_row = 0
+        return False
+
+    def _next_reconnect_delay(self):
+        strategy = self._config['reconnect_strategy']
+        if strategy is None:
+            delay = self._config['reconnect_delay']
+        else:
+            delay = strategy.delay(self.failed_connections, self._previous_reconnect_delay)
+        self._previous_reconnect_delay = delay
+        self._metrics['reconnect_delay_last'] = delay
+        self._metrics['reconnect_delay_total'] += delay
+        return delay
+
     def _allow_reconnect(self):
         if self._reconnecting_now or not self._is_active:
             return False
@@ -251,17 +749,99 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
         self._logger.error('[DISCONNECTED] max number of failed connection attempts achieved')
         return False
 
+    def _start_standby(self):
+        if self._standby_endpoint is None and self._standby_client_id is None:
+            return
+        if (self._standby is not None and self._standby.ready) or \
+                (self._standby_task is not None and not self._standby_task.done()):
+            return
+        if self._standby_endpoint is not None:
+            host, port = _parse_endpoints(self._standby_endpoint, self._port)[0]
+        else:
+            host, port = self._host, self._port
+        if self._standby_client_id is None and self._client_id:
+            self._standby_client_id = '{}-standby'.format(self._client_id)
+        client_id = self._standby_client_id or ''
+        if client_id and client_id == self._client_id:
+            raise ValueError('Standby connection must use other client id')
+        self._standby_task = asyncio.ensure_future(self._open_standby(host, port, client_id))
+
+    async def _open_standby(self, host, port, client_id):
+        while self._is_active:
+            standby = StandbyConnection(self, host, port, client_id)
+            try:
+                await standby.open()
+            except (OSError, asyncio.TimeoutError, MQTTConnectError) as exc:
+                self._metrics['standby_failures'] += 1
+                self._logger.warning('[STANDBY] could not connect to %s:%s: %s', host, port, exc)
+                await standby.close()
+                await asyncio.sleep(self._config['reconnect_delay'])
+                continue
+            self._logger.debug('[STANDBY] ready on %s:%s as %s', host, port, client_id)
+            if not self._is_active:
+                await standby.close()
+                return
+            self._standby = standby
+            return
+
+    def _handle_standby_lost(self, standby):
+        if standby is self._standby:
+            self._logger.info('[STANDBY] connection lost')
+            self._standby = None
+            if self._is_active:
+                self._start_standby()
+
+    def _take_over_standby(self):
+        standby, lost = self._standby, self._connection
+        self._standby = None
+        if lost is not None:
+            # lost connection must not trigger one more reconnect
+            lost.set_handler(lambda cmd, packet: None)
+            lost.abort()
+
+        # roles swap: next standby connection goes to the endpoint and uses client id of the lost one
+        self._standby_endpoint = (self._host, self._port)
+        self._standby_client_id = self._client_id
+        self._host, self._port, self._client_id = standby.host, standby.port, standby.client_id
+
+        self._clear_topics_aliases()
+        self._connection = standby.detach()
+        self._connection.set_handler(self)
+        self._connack_properties = standby.connack_properties
+        self._exit_reconnecting_state()
+        self._connected.set()
+
+        self._metrics['standby_takeovers'] += 1
+        if self._connection_lost_at is not None:
+            self._metrics['failover_time_last'] = time.monotonic() - self._connection_lost_at
+            self._connection_lost_at = None
+        self._logger.info('[STANDBY] took over connection to %s:%s as %s', self._host, self._port, self._client_id)
+
+        if not standby.session_present:
+            self._inbound_qos2.clear()
+            self._inbound_qos2_processing.clear()
+            # broker has no subscriptions for this client id
+            self._send_subscriptions()
+        # unacknowledged messages move to the new connection in any case
+        asyncio.ensure_future(self._resend_qos_messages())
+        self._start_standby()
+        self.on_connect(self, int(standby.session_present), 0, self.properties)
+
     async def reconnect(self, delay=False):
         if not self._allow_reconnect():
             return
+        self._rollback_pipelined_session()
+        if self._standby is not None and self._standby.ready:
+            self._take_over_standby()
+            return
         # stopping auto-reconnects during reconnect procedure is important, better do not touch :(
         self._temporatily_stop_reconnect()
         try:
             await self._disconnect()
         except:
             self._logger.info('[RECONNECT] ignored error while disconnecting, trying to reconnect anyway')
-        if delay:
-            await asyncio.sleep(self._config['reconnect_delay'])
+        if delay and not self._skip_reconnect_delay():
+            await asyncio.sleep(self._next_reconnect_delay())
         try:
             self._connection = await self._create_connection(self._host, self._port, ssl=self._ssl,
                                                              clean_session=False, keepalive=self._keepalive)
@@ -272,9 +852,16 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
             return
         await self._connection.auth(self._client_id, self._username, self._password,
                                     will_message=self._will_message, **self._connect_properties)
+        await self._pipeline_session()
+        self._start_standby()
 
     async def disconnect(self, reason_code=0, **properties):
         self._is_active = False
+        if self._standby_task is not None:
+            self._standby_task.cancel()
+        if self._standby is not None:
+            standby, self._standby = self._standby, None
+            await standby.close()
         await self._disconnect(reason_code=reason_code, **properties)
 
     async def _disconnect(self, reason_code=0, **properties):
@@ -289,12 +876,72 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
         if isinstance(message_or_topic, Message):
             message = message_or_topic
         else:
+            if self._serializer is not None:
+                kwargs.setdefault('serializer', self._serializer)
             message = Message(message_or_topic, payload, qos=qos, retain=retain, **kwargs)
 
+        if self._payload_compression is not None:
+            message = self._compress_payload(message)
+            if message is None:
+                return
+        self._publish_message(message)
+
+    def _compress_payload(self, message):
+        # returns message to publish now (compressed copy if payload was compressed) or None if it will be
+        # published later, when its payload (or one published before) is compressed
+        compression = self._payload_compression
+        # compressed payload is tagged with properties, MQTT 3.1.1 has none
+        if not compression.should_compress(message) or self.protocol_version < MQTTv50:
+            future = None
+        elif compression.should_offload(message):
+            compression.messages_offloaded += 1
+            future = asyncio.get_event_loop().run_in_executor(compression.executor, compression.codec.compress,
+                                                              message.payload)
+            future.add_done_callback(self._publish_compressed)
+        else:
+            message = compression.compress(message)
+            future = None
+        if future is None and not self._compression_pending:
+            return message
+        # messages must not overtake the one being compressed
+        self._compression_pending.append((message, future))
+        return None
+
+    def _publish_compressed(self, _):
+        while self._compression_pending:
+            message, future = self._compression_pending[0]
+            if future is not None:
+                if not future.done():
+                    return
+                if future.exception() is None:
+                    message = self._payload_compression.apply(message, future.result())
+                else:
+                    self._logger.warning('[COMPRESSION] sending payload uncompressed: %s', future.exception())
+            self._compression_pending.popleft()
+            # payload was serialized by should_compress in publish(), errors were raised to the caller there
+            try:
+                self._publish_message(message)
+            except StorageFullError:
+                # publish() has already returned, so the message compressed in executor (or waiting behind it)
+                # can only be dropped
+                self._logger.warning('[COMPRESSION] persistent storage is full, message dropped')
+
+    def _publish_message(self, message):
+        # while offline queue is not flushed new messages go there too, to keep the order
+        if self._offline_queue is not None and (not self.is_connected or len(self._offline_queue)):
+            self._offline_queue.put(message)
+            return
+
+        if message.qos > 0 and self._persistent_storage.has_capacity_limit:
+            self._persistent_storage.check_capacity(PublishPacket.package_size(message, self.protocol_version))
+
         mid, package = self._connection.publish(message)
+        self._store_message(message, mid, package)
 
-        if qos > 0:
-            self._persistent_storage.push_message_nowait(mid, package)
+    def _store_message(self, message, mid, package):
+        if message.qos > 0:
+            kwargs = {'priority': message.priority} if message.priority else {}
+            self._persistent_storage.push_nowait(mid, package, **kwargs)
 
     def _send_simple_command(self, cmd):
         self._connection.send_simple_command(cmd)
@@ -305,4 +952,4 @@ class Client(MqttPackageHandler, SubscriptionsHandler):
     @property
     def protocol_version(self):
         return self._connection._protocol.proto_ver \
-            if self._connection is not None else MQTTv50
+            if self._connection is not None else self._protocol_version
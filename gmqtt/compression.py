@@ -0,0 +1,109 @@
+import zlib
+
+TAG_USER_PROPERTY = 'user_property'
+TAG_CONTENT_TYPE = 'content_type'
+
+# user property naming the codec of compressed payload, like HTTP Content-Encoding header
+ENCODING_PROPERTY = 'content-encoding'
+
+
+class ZlibCodec(object):
+    # any codec with name, content_type, compress(bytes) and decompress(bytes) may be used instead,
+    # compress is called from thread pool for large payloads, so it should release GIL
+    name = 'deflate'
+    content_type = 'application/zlib'
+
+    # max_size limits decompressed payload, so a small message can not expand into gigabytes
+    def __init__(self, level=6, max_size=2 ** 28):
+        self.level = level
+        self.max_size = max_size
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(data, self.max_size)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Decompressed payload exceeds {} bytes'.format(self.max_size))
+        if not decompressor.eof:
+            raise ValueError('Compressed payload is incomplete')
+        return data
+
+
+class PayloadCompression(object):
+    # Compresses published payloads of threshold bytes or more with codec and tags them with
+    # "content-encoding" user property or with content_type (which replaces the original one).
+    # Received payloads tagged by any of codecs are decompressed before on_message.
+    # Payloads of offload_threshold bytes or more are compressed in executor (default one of the loop if None).
+    def __init__(self, threshold=1024, codec=None, codecs=(), tag=TAG_USER_PROPERTY, offload_threshold=256 * 1024,
+                 executor=None):
+        if tag not in (TAG_USER_PROPERTY, TAG_CONTENT_TYPE):
+            raise ValueError('Unknown compression tag {}'.format(tag))
+        self.codec = codec or ZlibCodec()
+        self.threshold = threshold
+        self.tag = tag
+        self.offload_threshold = offload_threshold
+        self.executor = executor
+        self._codecs_by_name = {c.name: c for c in (self.codec, ) + tuple(codecs)}
+        self._codecs_by_content_type = {c.content_type: c for c in (self.codec, ) + tuple(codecs)}
+
+        self.messages_compressed = 0
+        self.messages_offloaded = 0
+        self.messages_decompressed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    @property
+    def metrics(self):
+        return {
+            'messages_compressed': self.messages_compressed,
+            'messages_offloaded': self.messages_offloaded,
+            'messages_decompressed': self.messages_decompressed,
+            'bytes_before': self.bytes_before,
+            'bytes_after': self.bytes_after,
+        }
+
+    def should_compress(self, message):
+        return message.payload_size >= self.threshold
+
+    def should_offload(self, message):
+        return self.offload_threshold is not None and message.payload_size >= self.offload_threshold
+
+    def compress(self, message):
+        return self.apply(message, self.codec.compress(message.payload))
+
+    def apply(self, message, compressed):
+        # returns tagged copy of message with compressed payload, message itself is not changed;
+        # incompressible payloads are sent as is
+        if len(compressed) >= message.payload_size:
+            return message
+        self.messages_compressed += 1
+        self.bytes_before += message.payload_size
+        self.bytes_after += len(compressed)
+        message = message.copy()
+        message.payload = compressed
+        if self.tag == TAG_CONTENT_TYPE:
+            message.properties['content_type'] = self.codec.content_type
+            return message
+        user_property = message.properties.get('user_property')
+        if not user_property:
+            user_property = []
+        elif isinstance(user_property[0], str):
+            user_property = [tuple(user_property)]
+        message.properties['user_property'] = list(user_property) + [(ENCODING_PROPERTY, self.codec.name)]
+        return message
+
+    def decompress(self, payload, properties):
+        # returns payload as is if it is not tagged by known codec
+        codec = None
+        for name, value in properties.get('user_property', ()):
+            if name == ENCODING_PROPERTY:
+                codec = self._codecs_by_name.get(value)
+        if codec is None and 'content_type' in properties:
+            codec = self._codecs_by_content_type.get(properties['content_type'][0])
+        if codec is None:
+            return payload
+        payload = codec.decompress(payload)
+        self.messages_decompressed += 1
+        return payload
@@ -0,0 +1,146 @@
+import asyncio
+import copy
+import logging
+import time
+import tracemalloc
+
+from .client import Client
+from .mqtt.timer_wheel import TimerWheel
+from .storage import HeapPersistentStorage
+
+logger = logging.getLogger(__name__)
+
+
+def _fleet_callback(name):
+    # fleet callbacks are set to every client, callback receives the client as first argument
+    def getter(self):
+        return self._callbacks.get(name)
+
+    def setter(self, cb):
+        if not callable(cb):
+            raise ValueError
+        self._callbacks[name] = cb
+        for client in self._clients.values():
+            setattr(client, name, cb)
+
+    return property(getter, setter)
+
+
+class ClientFleet(object):
+    # Runs many clients in one process: clients share config, keepalive timer wheel, storage
+    # namespace (keyed by client id) and callbacks; connects are staggered and rate limited.
+    on_connect = _fleet_callback('on_connect')
+    on_disconnect = _fleet_callback('on_disconnect')
+    on_message = _fleet_callback('on_message')
+    on_subscribe = _fleet_callback('on_subscribe')
+    on_unsubscribe = _fleet_callback('on_unsubscribe')
+
+    def __init__(self, client_ids, connect_rate=100, concurrency=100, config=None, storage_factory=None,
+                 timer_wheel=None, username=None, password=None, client_class=Client, **client_kwargs):
+        self._connect_rate = connect_rate
+        self._concurrency = concurrency
+        self._storage_factory = storage_factory or HeapPersistentStorage
+        # wheel passed by caller may be shared with other clients, only own one is closed on disconnect
+        self._own_timer_wheel = timer_wheel is None
+        self._timer_wheel = timer_wheel or TimerWheel()
+        self._callbacks = {}
+        self._storages = {}
+
+        tracing = tracemalloc.is_tracing()
+        memory_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+
+        self._clients = {}
+        for client_id in client_ids:
+            client = client_class(client_id, persistent_storage=self.storage(client_id),
+                                  timer_wheel=self._timer_wheel, logger=logger, **client_kwargs)
+            if config:
+                # objects like connect_rate_limiter are shared on purpose, containers are copied per client
+                client.set_config({key: copy.deepcopy(value) if isinstance(value, (dict, list, set)) else value
+                                   for key, value in config.items()})
+            if username is not None:
+                client.set_auth_credentials(username, password)
+            self._clients[client_id] = client
+
+        self._memory_per_client = None
+        if tracing and self._clients:
+            self._memory_per_client = (tracemalloc.get_traced_memory()[0] - memory_before) / len(self._clients)
+
+        self._connect_time = None
+        self._connected = 0
+        self._failed = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients.values())
+
+    def __getitem__(self, client_id):
+        return self._clients[client_id]
+
+    def storage(self, client_id):
+        if client_id not in self._storages:
+            self._storages[client_id] = self._storage_factory()
+        return self._storages[client_id]
+
+    @property
+    def metrics(self):
+        connect_throughput = None
+        if self._connect_time:
+            connect_throughput = self._connected / self._connect_time
+        return {
+            'clients': len(self._clients),
+            'connected': sum(1 for client in self._clients.values() if client.is_connected),
+            'connect_failed': self._failed,
+            'connect_time': self._connect_time,
+            'connect_throughput': connect_throughput,
+            # measured only if tracemalloc was tracing when clients were created
+            'memory_per_client': self._memory_per_client,
+            'failed_connections': sum(client.failed_connections for client in self._clients.values()),
+        }
+
+    async def _connect_client(self, client, semaphore, connect_args):
+        async with semaphore:
+            try:
+                await client.connect(*connect_args[0], **connect_args[1])
+            except Exception as exc:
+                self._failed += 1
+                logger.warning('[FLEET] client %s failed to connect: %s', client._client_id, exc)
+            else:
+                self._connected += 1
+
+    async def connect(self, host, *args, **kwargs):
+        # starts at most connect_rate connects per second, with at most concurrency of them in progress
+        semaphore = asyncio.Semaphore(self._concurrency)
+        interval = 1.0 / self._connect_rate if self._connect_rate else 0
+        self._connected = self._failed = 0
+        started = time.monotonic()
+
+        tasks = []
+        for i, client in enumerate(self._clients.values()):
+            delay = started + i * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(self._connect_client(client, semaphore, ((host, ) + args, kwargs))))
+        await asyncio.gather(*tasks)
+
+        self._connect_time = time.monotonic() - started
+
+    def publish(self, client_id, *args, **kwargs):
+        return self._clients[client_id].publish(*args, **kwargs)
+
+    def subscribe(self, *args, **kwargs):
+        for client in self._clients.values():
+            client.subscribe(*args, **kwargs)
+
+    async def disconnect(self, *args, **kwargs):
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def disconnect_client(client):
+            async with semaphore:
+                await client.disconnect(*args, **kwargs)
+
+        await asyncio.gather(*(disconnect_client(client) for client in self._clients.values()
+                               if client._connection is not None), return_exceptions=True)
+        if self._own_timer_wheel:
+            self._timer_wheel.close()
@@ -1,11 +1,14 @@
 import asyncio
 import logging
 import time
+from functools import partial
 
 from .protocol import MQTTProtocol
+from ..transports import TCPTransport
 
 class MQTTConnection(object):
-    def __init__(self, transport: asyncio.Transport, protocol: MQTTProtocol, clean_session: bool, keepalive: int, logger=None):
+    def __init__(self, transport: asyncio.Transport, protocol: MQTTProtocol, clean_session: bool, keepalive: int,
+                 logger=None, timer_wheel=None):
         self._transport = transport
         self._protocol = protocol
         self._protocol.set_connection(self)
@@ -17,15 +20,28 @@ class MQTTConnection(object):
         self._last_data_in = time.monotonic()
         self._last_data_out = time.monotonic()
 
-        self._keep_connection_callback = asyncio.get_event_loop().call_later(self._keepalive / 2, self._keep_connection)
+        # keepalive timers may be scheduled in timer wheel shared by many connections
+        self._call_later = timer_wheel.call_later if timer_wheel is not None else asyncio.get_event_loop().call_later
+        self._keep_connection_callback = self._call_later(self._keepalive / 2, self._keep_connection)
 
         self._logger = logger or logging.getLogger(__name__)
 
     @classmethod
-    async def create_connection(cls, host, port, ssl, clean_session, keepalive, loop=None, logger=None):
+    async def create_connection(cls, host, port, ssl, clean_session, keepalive, loop=None, logger=None,
+                                timer_wheel=None, socket_options=None, transport=None, id_generator=None, protocol_version=None):
+        # transport is a factory from gmqtt.transports, TCP by default
         loop = loop or asyncio.get_event_loop()
-        transport, protocol = await loop.create_connection(MQTTProtocol, host, port, ssl=ssl)
-        return MQTTConnection(transport, protocol, clean_session, keepalive, logger=logger)
+        transport_factory = transport or TCPTransport()
+        if socket_options is None:
+            transport, protocol = await transport_factory.create_connection(loop, MQTTProtocol, host, port, ssl=ssl)
+        else:
+            transport, protocol = await transport_factory.create_connection(
+                loop, partial(MQTTProtocol, socket_options=socket_options), host, port, ssl=ssl,
+                local_addr=socket_options.local_addr)
+        protocol.id_generator = id_generator
+        if protocol_version is not None:
+            protocol.proto_ver = protocol_version
+        return MQTTConnection(transport, protocol, clean_session, keepalive, logger=logger, timer_wheel=timer_wheel)
 
     def _keep_connection(self):
         if self.is_closing() or not self._keepalive:
@@ -40,7 +56,7 @@ class MQTTConnection(object):
         if time_ - self._last_data_out >= 0.8 * self._keepalive or \
                 time_ - self._last_data_in >= 0.8 * self._keepalive:
             self._send_ping_request()
-        self._keep_connection_callback = asyncio.get_event_loop().call_later(self._keepalive / 2, self._keep_connection)
+        self._keep_connection_callback = self._call_later(self._keepalive / 2, self._keep_connection)
 
     def put_package(self, pkg):
         self._last_data_in = time.monotonic()
@@ -57,6 +73,12 @@ class MQTTConnection(object):
 
         self._transport.write(package)
 
+    async def drain(self):
+        await self._protocol.drain()
+
+    def get_extra_info(self, name, default=None):
+        return self._transport.get_extra_info(name, default)
+
     async def auth(self, client_id, username, password, will_message=None, **kwargs):
         await self._protocol.send_auth_package(client_id, username, password, self._clean_session,
                                                self._keepalive, will_message=will_message, **kwargs)
@@ -64,6 +86,9 @@ class MQTTConnection(object):
     def publish(self, message):
         return self._protocol.send_publish(message)
 
+    def publish_many(self, messages):
+        return self._protocol.send_publish_many(messages)
+
     def send_disconnect(self, reason_code=0, **properties):
         self._protocol.send_disconnect(reason_code=reason_code, **properties)
 
@@ -91,6 +116,18 @@ class MQTTConnection(object):
         self._transport.close()
         await self._protocol.closed
 
+    def abort(self):
+        if self._keep_connection_callback:
+            self._keep_connection_callback.cancel()
+        self._transport.abort()
+
+    def pause_reading(self):
+        self._transport.pause_reading()
+
+    def resume_reading(self):
+        if not self._transport.is_closing():
+            self._transport.resume_reading()
+
     def is_closing(self):
         return self._transport.is_closing()
 
@@ -105,4 +142,4 @@ class MQTTConnection(object):
         self._keepalive = value
         if self._keep_connection_callback:
             self._keep_connection_callback.cancel()
-        self._keep_connection_callback = asyncio.get_event_loop().call_later(self._keepalive / 2, self._keep_connection)
+        self._keep_connection_callback = self._call_later(self._keepalive / 2, self._keep_connection)
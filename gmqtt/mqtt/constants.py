@@ -123,4 +123,16 @@ UNLIMITED_RECONNECTS = -1
 DEFAULT_CONFIG = {
     'reconnect_delay': 6,
     'reconnect_retries': UNLIMITED_RECONNECTS,
+    # number of stored messages read from persistent storage at once when resending them after reconnect
+    'resend_chunk_size': 256,
+    # object with delay(attempt, previous) method, e.g. gmqtt.reconnect.ExponentialBackoff;
+    # constant reconnect_delay is used if not set
+    'reconnect_strategy': None,
+    # gmqtt.reconnect.ConnectRateLimiter shared by clients, limits rate of connection attempts
+    'connect_rate_limiter': None,
+    # when several broker endpoints are given, connection attempts to them are started with this delay
+    # one after another, first established connection wins
+    'endpoint_probe_delay': 0.1,
+    # known subscriptions and offline queue are sent right after CONNECT, without waiting for CONNACK
+    'pipelined_session': False,
 }
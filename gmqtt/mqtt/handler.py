@@ -3,13 +3,13 @@ import logging
 import struct
 import time
 from collections import defaultdict
-from copy import deepcopy
 from functools import partial
 
-from .utils import unpack_variable_byte_integer, IdGenerator, run_coroutine_or_function
+from .utils import unpack_variable_byte_integer, IdGenerator, MidBitmap, run_coroutine_or_function, \
+    iscoroutinefunction_or_partial
+from .incoming import IncomingMessage
 from .property import Property
-from .protocol import MQTTProtocol
-from .constants import MQTTCommands, PubRecReasonCode, DEFAULT_CONFIG
+from .constants import MQTTCommands, PubRecReasonCode, ConnAckReasonCode, DEFAULT_CONFIG
 from .constants import MQTTv311, MQTTv50
 
 
@@ -72,8 +72,13 @@ class EventCallback(object):
         self._on_message_callback = _empty_callback
         self._on_subscribe_callback = _empty_callback
         self._on_unsubscribe_callback = _empty_callback
+        self._on_resend_progress_callback = _empty_callback
+        self._on_message_expired_callback = _empty_callback
+        # if set, it gets IncomingMessage views instead of on_message calls
+        self._on_message_view_callback = None
 
-        self._config = deepcopy(DEFAULT_CONFIG)
+        # all config values are immutable, so shallow copy is enough
+        self._config = dict(DEFAULT_CONFIG)
         self._reconnecting_now = False
 
         # this flag should be True after connect and False when disconnect was called
@@ -140,6 +145,19 @@ class EventCallback(object):
             raise ValueError
         self._on_message_callback = cb
 
+    @property
+    def on_message_view(self):
+        return self._on_message_view_callback
+
+    @on_message_view.setter
+    def on_message_view(self, cb):
+        if cb is not None and not callable(cb):
+            raise ValueError
+        # sink and log keep raw packets themselves, received messages never reach on_message_view then
+        if cb is not None and (self._inbound_sink is not None or self._inbound_log is not None):
+            raise ValueError('on_message_view can not be used with inbound_sink or inbound_log')
+        self._on_message_view_callback = cb
+
     @property
     def on_disconnect(self):
         return self._on_disconnected_callback
@@ -160,6 +178,26 @@ class EventCallback(object):
             raise ValueError
         self._on_unsubscribe_callback = cb
 
+    @property
+    def on_resend_progress(self):
+        return self._on_resend_progress_callback
+
+    @on_resend_progress.setter
+    def on_resend_progress(self, cb):
+        if not callable(cb):
+            raise ValueError
+        self._on_resend_progress_callback = cb
+
+    @property
+    def on_message_expired(self):
+        return self._on_message_expired_callback
+
+    @on_message_expired.setter
+    def on_message_expired(self, cb):
+        if not callable(cb):
+            raise ValueError
+        self._on_message_expired_callback = cb
+
 
 class MqttPackageHandler(EventCallback):
     def __init__(self, *args, **kwargs):
@@ -168,7 +206,18 @@ class MqttPackageHandler(EventCallback):
         self._handler_cache = {}
         self._error = None
         self._connection = None
+        # protocol version of next connections, set on connect and lowered if broker does not support MQTT 5.0
+        self._protocol_version = MQTTv50
         self._server_topics_aliases = {}
+        self._inbound_log = None
+        self._inbound_sink = None
+        # set when connection is lost, used to measure failover time
+        self._connection_lost_at = None
+        # mids of received QoS 2 messages: waiting for PUBREL and still being processed by on_message
+        self._inbound_qos2 = MidBitmap()
+        self._inbound_qos2_processing = set()
+        # topic aliases are used by broker only if client set topic_alias_maximum on connect
+        self._topic_alias_maximum = 0
 
         self._id_generator = IdGenerator(max=kwargs.get('receive_maximum', 65535))
 
@@ -188,6 +237,26 @@ class MqttPackageHandler(EventCallback):
     def _remove_message_from_query(self, mid):
         raise NotImplementedError
 
+    def _flush_offline_queue(self):
+        pass
+
+    def _update_connect_metrics(self, result):
+        pass
+
+    def _finish_pipelined_session(self, result):
+        return False
+
+    def _decode_payload(self, payload, properties):
+        return payload
+
+    @property
+    def _decodes_payload(self):
+        # False if _decode_payload returns payload as is
+        return False
+
+    def _handle_server_reference(self, server_reference):
+        pass
+
     def _send_puback(self, mid, reason_code=0):
         self._send_command_with_mid(MQTTCommands.PUBACK, mid, False, reason_code=reason_code)
 
@@ -224,6 +293,15 @@ class MqttPackageHandler(EventCallback):
     def _handle_disconnect_packet(self, cmd, packet):
         # reset server topics on disconnect
         self._clear_topics_aliases()
+        if self._connection_lost_at is None:
+            self._connection_lost_at = time.monotonic()
+
+        # empty packet means that connection was lost, otherwise server sent DISCONNECT with reason code;
+        # server closes connection after redirect, reconnect to referenced server starts then
+        if packet and packet[0] in (ConnAckReasonCode.USE_ANOTHER_SERVER, ConnAckReasonCode.SERVER_MOVED) \
+                and self._handle_redirect(packet[1:]):
+            self.on_disconnect(self, packet)
+            return
 
         future = asyncio.ensure_future(self.reconnect(delay=True))
         future.add_done_callback(self._handle_exception_in_future)
@@ -249,6 +327,15 @@ class MqttPackageHandler(EventCallback):
         properties_dict = dict(properties_dict)
         return properties_dict, left_packet
 
+    def _handle_redirect(self, properties_packet):
+        if self.protocol_version < MQTTv50 or not properties_packet:
+            return False
+        properties, _ = self._parse_properties(properties_packet)
+        if properties and 'server_reference' in properties:
+            self._handle_server_reference(properties['server_reference'][0])
+            return True
+        return False
+
     def _update_keepalive_if_needed(self):
         if not self._connack_properties.get('server_keep_alive'):
             return
@@ -259,22 +346,30 @@ class MqttPackageHandler(EventCallback):
         self._connected.set()
 
         (session_present, result) = struct.unpack("!BB", packet[:2])
-        if session_present:
+        self._update_connect_metrics(result)
+        if self._finish_pipelined_session(result):
+            # messages sent right after CONNECT are the only stored ones, nothing to resend or clear
+            pass
+        elif session_present:
             asyncio.ensure_future(self._resend_qos_messages())
         else:
-            asyncio.ensure_future(self._clear_resend_qos_queue())
+            self._clear_resend_qos_queue()
 
         if result != 0:
             self._logger.warning('[CONNACK] %s', hex(result))
             self.failed_connections += 1
             if result == 1 and self.protocol_version == MQTTv50:
                 self._logger.info('[CONNACK] Downgrading to MQTT 3.1 protocol version')
-                MQTTProtocol.proto_ver = MQTTv311
+                self._protocol_version = MQTTv311
                 future = asyncio.ensure_future(self.reconnect(delay=True))
                 future.add_done_callback(self._handle_exception_in_future)
                 return
             else:
                 self._error = MQTTConnectError(result)
+                if result in (ConnAckReasonCode.USE_ANOTHER_SERVER, ConnAckReasonCode.SERVER_MOVED) \
+                        and self._handle_redirect(packet[2:]):
+                    # server closes connection after CONNACK with error, reconnect starts then
+                    return
                 asyncio.ensure_future(self.reconnect(delay=True))
                 return
         else:
@@ -288,6 +383,13 @@ class MqttPackageHandler(EventCallback):
             self._connack_properties = properties
             self._update_keepalive_if_needed()
 
+        if not session_present:
+            # QoS 2 exchanges from previous session will not be continued by broker
+            self._inbound_qos2.clear()
+            self._inbound_qos2_processing.clear()
+            # otherwise offline queue is flushed after stored messages are resent
+            self._flush_offline_queue()
+
         # TODO: Implement checking for the flags and results
         # see 3.2.2.3 Connect Return code of the http://docs.oasis-open.org/mqtt/mqtt/v3.1.1/os/mqtt-v3.1.1-os.pdf
 
@@ -295,6 +397,9 @@ class MqttPackageHandler(EventCallback):
         self.on_connect(self, session_present, result, self.properties)
 
     def _handle_publish_packet(self, cmd, raw_packet):
+        if self._on_message_view_callback is not None:
+            self._handle_publish_view(cmd, raw_packet)
+            return
         header = cmd
 
         dup = (header & 0x08) >> 3
@@ -316,14 +421,17 @@ class MqttPackageHandler(EventCallback):
         else:
             mid = None
 
+        properties_packet = packet
         properties, packet = self._parse_properties(packet)
-        properties['dup'] = dup
-        properties['retain'] = retain
 
         if packet is None:
             self._logger.critical('[INVALID MESSAGE] skipping: {}'.format(raw_packet))
             return
 
+        raw_properties = properties_packet[:len(properties_packet) - len(packet)]
+        properties['dup'] = dup
+        properties['retain'] = retain
+
         if 'topic_alias' in properties:
             # TODO: need to add validation (topic alias must be greater than 0 and less than topic_alias_maximum)
             topic_alias = properties['topic_alias'][0]
@@ -344,27 +452,150 @@ class MqttPackageHandler(EventCallback):
 
         self._logger.debug('[RECV %s with QoS: %s] %s', print_topic, qos, payload)
 
-        if qos == 0:
-            run_coroutine_or_function(self.on_message, self, print_topic, packet, qos, properties)
+        if qos == 2 and (mid in self._inbound_qos2 or mid in self._inbound_qos2_processing):
+            self._handle_qos_2_duplicate(mid)
+        elif self._inbound_sink is not None:
+            self._handle_sink_publish_packet(mid, header & 0x0F, topic, raw_properties, packet)
+        elif qos == 0:
+            run_coroutine_or_function(self.on_message, self, print_topic, self._decode_payload(packet, properties),
+                                      qos, properties)
+        elif self._inbound_log is not None:
+            # payload is logged as received and decoded when it is processed
+            self._handle_logged_publish_packet(mid, qos, topic, raw_properties, packet, print_topic, properties)
         elif qos == 1:
-            self._handle_qos_1_publish_packet(mid, packet, print_topic, properties)
+            self._handle_qos_1_publish_packet(mid, self._decode_payload(packet, properties), print_topic, properties)
         elif qos == 2:
-            self._handle_qos_2_publish_packet(mid, packet, print_topic, properties)
+            self._handle_qos_2_publish_packet(mid, self._decode_payload(packet, properties), print_topic, properties)
         self._id_generator.free_id(mid)
 
+    def _handle_publish_view(self, header, raw_packet):
+        message = IncomingMessage(self, header & 0x0F, raw_packet, self.protocol_version)
+        mid, qos = message.mid, message.qos
+        topic = message.topic_bytes
+        if message.has_properties and (not topic or self._topic_alias_maximum):
+            topic_alias = message.properties.get('topic_alias')
+            if topic_alias is not None:
+                if topic:
+                    self._server_topics_aliases[topic_alias[0]] = topic
+                else:
+                    topic = message._topic = self._server_topics_aliases.get(topic_alias[0], b'')
+
+        if not topic:
+            self._logger.warning('[MQTT ERR PROTO] topic name is empty (or server has send invalid topic alias)')
+            return
+
+        self._logger.debug('[RECV %s with QoS: %s] %s', topic, qos, message)
+
+        if qos == 0:
+            run_coroutine_or_function(self._on_message_view_callback, self, message)
+        elif qos == 2 and (mid in self._inbound_qos2 or mid in self._inbound_qos2_processing):
+            self._handle_qos_2_duplicate(mid)
+        elif self._optimistic_acknowledgement:
+            if qos == 2:
+                self._inbound_qos2.add(mid)
+                self._send_pubrec(mid)
+            else:
+                self._send_puback(mid)
+            run_coroutine_or_function(self._on_message_view_callback, self, message)
+        else:
+            if qos == 2:
+                self._inbound_qos2_processing.add(mid)
+            run_coroutine_or_function(self._on_message_view_callback, self, message,
+                                      callback=partial(self.__handle_publish_callback, qos=qos, mid=mid))
+        self._id_generator.free_id(mid)
+
+    def _handle_qos_2_duplicate(self, mid):
+        # message was already passed to on_message, it must not be delivered again until PUBREL
+        self._logger.debug('[QoS 2 DUPLICATE] %s', mid)
+        if mid in self._inbound_qos2:
+            self._send_pubrec(mid)
+
     def _handle_qos_2_publish_packet(self, mid, packet, print_topic, properties):
         if self._optimistic_acknowledgement:
+            self._inbound_qos2.add(mid)
             self._send_pubrec(mid)
             run_coroutine_or_function(self.on_message, self, print_topic, packet, 2, properties)
         else:
+            self._inbound_qos2_processing.add(mid)
             run_coroutine_or_function(self.on_message, self, print_topic, packet, 2, properties,
                                       callback=partial(self.__handle_publish_callback, qos=2, mid=mid))
 
+    def _handle_sink_publish_packet(self, mid, flags, topic, raw_properties, packet):
+        # message is acknowledged when it is written to the sink, sink pauses reading while it is full
+        qos = (flags & 0x06) >> 1
+        if qos == 2:
+            self._inbound_qos2_processing.add(mid)
+        self._inbound_sink.push(flags, topic, raw_properties, packet,
+                                callback=partial(self._handle_sink_written, qos=qos, mid=mid) if qos else None)
+
+    def _handle_sink_written(self, qos=None, mid=None):
+        if qos == 2:
+            self._inbound_qos2_processing.discard(mid)
+            self._inbound_qos2.add(mid)
+            self._send_pubrec(mid)
+        else:
+            self._send_puback(mid)
+
+    def _pause_reading(self):
+        if self._connection is not None:
+            self._connection.pause_reading()
+
+    def _resume_reading(self):
+        if self._connection is not None:
+            self._connection.resume_reading()
+
+    def _handle_logged_publish_packet(self, mid, qos, topic, raw_properties, packet, print_topic, properties):
+        # message is acknowledged only after it became durable in the inbound log
+        seq, committed = self._inbound_log.append(topic, qos, raw_properties, packet)
+        if qos == 2:
+            self._inbound_qos2_processing.add(mid)
+        committed.add_done_callback(partial(self._handle_inbound_log_commit, seq=seq, mid=mid,
+                                            message=(print_topic, packet, qos, properties)))
+
+    def _handle_inbound_log_commit(self, f, seq=None, mid=None, message=None):
+        self._inbound_qos2_processing.discard(mid)
+        if f.exception() is not None:
+            # message is not acknowledged, so broker will send it again
+            self._logger.error('[INBOUND LOG] message %s was not written', mid)
+            return
+        (print_topic, packet, qos, properties) = message
+        if qos == 2:
+            self._inbound_qos2.add(mid)
+            self._send_pubrec(mid)
+        else:
+            self._send_puback(mid)
+        self._process_logged_message(seq, print_topic, packet, qos, properties)
+
+    def _process_logged_message(self, seq, print_topic, packet, qos, properties):
+        packet = self._decode_payload(packet, properties)
+        if iscoroutinefunction_or_partial(self.on_message):
+            run_coroutine_or_function(self.on_message, self, print_topic, packet, qos, properties,
+                                      callback=partial(self._handle_logged_message_processed, seq=seq))
+        else:
+            self.on_message(self, print_topic, packet, qos, properties)
+            self._inbound_log.mark_processed(seq)
+
+    def _handle_logged_message_processed(self, f, seq=None):
+        if not f.cancelled() and f.exception() is None:
+            self._inbound_log.mark_processed(seq)
+
+    def replay_inbound_log(self):
+        # calls on_message for every message from inbound log, which was not processed before crash
+        for (seq, topic, qos, raw_properties, payload) in self._inbound_log.replay():
+            properties = self._parse_properties(raw_properties)[0] if raw_properties else {}
+            properties['dup'] = 1
+            properties['retain'] = 0
+            self._process_logged_message(seq, topic.decode('utf-8', errors='replace'), payload, qos, properties)
+
     def __handle_publish_callback(self, f, qos=None, mid=None):
+        if qos == 2:
+            self._inbound_qos2_processing.discard(mid)
         reason_code = f.result()
         if reason_code not in (c.value for c in PubRecReasonCode):
             raise ValueError('Invalid PUBREC reason code {}'.format(reason_code))
         if qos == 2:
+            if reason_code < PubRecReasonCode.UNSPECIFIED_ERROR:
+                self._inbound_qos2.add(mid)
             self._send_pubrec(mid, reason_code=reason_code)
         else:
             self._send_puback(mid, reason_code=reason_code)
@@ -452,6 +683,7 @@ class MqttPackageHandler(EventCallback):
     def _handle_pubrel_packet(self, cmd, packet):
         (mid, ) = struct.unpack("!H", packet[:2])
         self._logger.debug('[RECEIVED PUBREL FOR] %s', mid)
+        self._inbound_qos2.discard(mid)
         self._send_pubcomp(mid, 0)
 
         self._id_generator.free_id(mid)
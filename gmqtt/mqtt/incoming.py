@@ -0,0 +1,123 @@
+import struct
+
+from .constants import MQTTCommands, MQTTv50
+from .utils import pack_variable_byte_integer
+
+
+class IncomingMessage(object):
+    # Lightweight view of received PUBLISH packet, passed to on_message_view instead of on_message arguments.
+    # Only offsets are parsed on receive: topic, properties and payload are decoded (and copied) on first access,
+    # payload_view gives payload without copying. The view keeps received packet until release() is called.
+    __slots__ = ('flags', 'mid', '_packet', '_topic', '_topic_str', '_properties_start', '_payload_start',
+                 '_properties', '_payload', '_handler')
+
+    def __init__(self, handler, flags, packet, protocol_version):
+        self.flags = flags
+        self._handler = handler
+        self._packet = packet
+        self._topic_str = None
+        self._properties = None
+        self._payload = None
+
+        topic_len, = struct.unpack_from('!H', packet)
+        self._topic = packet[2:2 + topic_len]
+        offset = 2 + topic_len
+        if self.qos > 0:
+            self.mid, = struct.unpack_from('!H', packet, offset)
+            offset += 2
+        else:
+            self.mid = None
+        self._properties_start = offset
+
+        if protocol_version >= MQTTv50:
+            # skip properties, they are parsed by demand
+            properties_len, multiplier = 0, 1
+            while True:
+                byte = packet[offset]
+                offset += 1
+                properties_len += (byte & 0x7F) * multiplier
+                multiplier *= 128
+                if byte & 0x80 == 0 or multiplier > 2097152:
+                    break
+            offset += properties_len
+        self._payload_start = offset
+
+    @property
+    def qos(self):
+        return (self.flags & 0x06) >> 1
+
+    @property
+    def dup(self):
+        return bool(self.flags & 0x08)
+
+    @property
+    def retain(self):
+        return bool(self.flags & 0x01)
+
+    @property
+    def topic_bytes(self):
+        return self._topic
+
+    @property
+    def topic(self):
+        if self._topic_str is None:
+            try:
+                self._topic_str = self._topic.decode('utf-8')
+            except UnicodeDecodeError:
+                return self._topic
+        return self._topic_str
+
+    @property
+    def has_properties(self):
+        return self._payload_start - self._properties_start > 1
+
+    @property
+    def properties(self):
+        # dict of lists like properties passed to on_message, without dup and retain
+        if self._properties is None:
+            if self._payload_start == self._properties_start:
+                self._properties = {}
+            else:
+                properties, _ = self._handler._parse_properties(
+                    self._get_packet()[self._properties_start:self._payload_start])
+                if properties is None:
+                    raise ValueError('Invalid properties')
+                self._properties = properties
+        return self._properties
+
+    @property
+    def payload_view(self):
+        # payload as received, without copying, it is valid until release() is called
+        return memoryview(self._get_packet())[self._payload_start:]
+
+    @property
+    def payload(self):
+        # payload bytes, decompressed and deserialized as on_message gets it
+        if self._payload is None:
+            payload = self._get_packet()[self._payload_start:]
+            if self._handler._decodes_payload:
+                payload = self._handler._decode_payload(payload, self.properties)
+            self._payload = payload
+        return self._payload
+
+    @property
+    def raw(self):
+        # packet as received without fixed header (mid and topic alias are the ones set by broker),
+        # transport.writelines([message.fixed_header, message.raw]) forwards it without copying
+        return self._get_packet()
+
+    @property
+    def fixed_header(self):
+        return bytes((MQTTCommands.PUBLISH | self.flags, )) + pack_variable_byte_integer(len(self._get_packet()))
+
+    def release(self):
+        # drops received packet, topic, properties and payload decoded before stay available
+        self._packet = None
+
+    def _get_packet(self):
+        if self._packet is None:
+            raise ValueError('IncomingMessage is released')
+        return self._packet
+
+    def __repr__(self):
+        return '<IncomingMessage topic={!r} qos={} mid={}>'.format(self.topic, self.qos, self.mid)
@@ -4,7 +4,7 @@ from typing import Tuple
 
 from .constants import MQTTCommands, MQTTv50
 from .property import Property
-from .utils import pack_variable_byte_integer, IdGenerator
+from .utils import pack_variable_byte_integer, unpack_variable_byte_integer, IdGenerator
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +21,13 @@ class Packet(object):
 
 
 class PackageFactory(object):
+    # used when protocol has no id generator of its own (clients set theirs on every connection)
     id_generator = IdGenerator()
 
+    @classmethod
+    def _next_id(cls, protocol):
+        return (getattr(protocol, 'id_generator', None) or cls.id_generator).next_id()
+
     @classmethod
     async def parse_package(cls, cmd, package):
         pass
@@ -128,7 +133,7 @@ class UnsubscribePacket(PackageFactory):
         packet = bytearray()
         packet.append(command)
         packet.extend(pack_variable_byte_integer(remaining_length))
-        local_mid = cls.id_generator.next_id()
+        local_mid = cls._next_id(protocol)
         packet.extend(struct.pack("!H", local_mid))
         packet.extend(properties)
         for t in topics:
@@ -175,7 +180,7 @@ class SubscribePacket(PackageFactory):
         packet = bytearray()
         packet.append(command)
         packet.extend(pack_variable_byte_integer(remaining_length))
-        local_mid = cls.id_generator.next_id()
+        local_mid = cls._next_id(protocol)
         packet.extend(struct.pack("!H", local_mid))
         packet.extend(properties)
         for s in subscriptions:
@@ -220,7 +225,7 @@ class PublishPacket(PackageFactory):
 
         if message.qos > 0:
             # For message id
-            mid = cls.id_generator.next_id()
+            mid = cls._next_id(protocol)
             packet.extend(struct.pack("!H", mid))
         else:
             mid = None
@@ -231,6 +236,50 @@ class PublishPacket(PackageFactory):
         return mid, packet
 
 
+    @classmethod
+    def package_size(cls, message, protocol_version):
+        # length of the package build_package returns for message, without building it
+        remaining_length = 2 + len(message.topic) + message.payload_size
+        if message.qos > 0:
+            remaining_length += 2
+        if protocol_version >= MQTTv50:
+            remaining_length += len(cls._build_properties_data(message.properties, protocol_version)) \
+                if message.properties else 1
+        return 1 + len(pack_variable_byte_integer(remaining_length)) + remaining_length
+
+    @classmethod
+    def find_message_expiry(cls, package):
+        # returns (offset, value) of message_expiry_interval property in built MQTT 5.0 PUBLISH package, or None
+        qos = (package[0] & 0x06) >> 1
+        offset = 1
+        while package[offset] & 0x80:
+            offset += 1
+        (topic_len, ) = struct.unpack_from('!H', package, offset + 1)
+        offset += 1 + 2 + topic_len + (2 if qos > 0 else 0)
+
+        properties_len, left_packet = unpack_variable_byte_integer(package[offset:offset + 4])
+        offset += 4 - len(left_packet)
+        end = offset + properties_len
+        while offset < end:
+            property_id = package[offset]
+            if property_id == 2:
+                return offset + 1, struct.unpack_from('!L', package, offset + 1)[0]
+            property_obj = Property.factory(id_=property_id)
+            if property_obj is None:
+                return None
+            _, left_packet = property_obj.loads(bytes(package[offset + 1:end]))
+            offset = end - len(left_packet)
+        return None
+
+    @classmethod
+    def set_dup(cls, package):
+        # marks already built PUBLISH package as redelivery, bytearray packages are changed in place
+        if not isinstance(package, bytearray):
+            package = bytearray(package)
+        package[0] |= 0x08
+        return package
+
+
 class DisconnectPacket(PackageFactory):
     @classmethod
     def build_package(cls, protocol, reason_code=0, **properties):
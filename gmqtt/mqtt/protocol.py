@@ -30,12 +30,13 @@ class _StreamReaderProtocolCompatibilityMixin:
 
 
 class BaseMQTTProtocol(_StreamReaderProtocolCompatibilityMixin, asyncio.StreamReaderProtocol):
-    def __init__(self, buffer_size=2**16, loop=None):
+    def __init__(self, buffer_size=2**16, loop=None, socket_options=None):
         if not loop:
             loop = asyncio.get_event_loop()
 
         self._connection = None
         self._transport = None
+        self._socket_options = socket_options
 
         self._connected = asyncio.Event()
 
@@ -60,6 +61,9 @@ class BaseMQTTProtocol(_StreamReaderProtocolCompatibilityMixin, asyncio.StreamRe
 
         logger.info('[CONNECTION MADE]')
         self._transport = transport
+        sock = transport.get_extra_info('socket')
+        if self._socket_options is not None and sock is not None:
+            self._socket_options.apply(sock)
 
         self._connected.set()
 
@@ -73,6 +77,10 @@ class BaseMQTTProtocol(_StreamReaderProtocolCompatibilityMixin, asyncio.StreamRe
         else:
             logger.warning('[TRYING WRITE TO CLOSED SOCKET]')
 
+    async def drain(self):
+        # waits until transport write buffer drops below its low-water mark
+        await self._drain_helper()
+
     def connection_lost(self, exc):
         self._connected.clear()
         super(BaseMQTTProtocol, self).connection_lost(exc)
@@ -95,7 +103,10 @@ class BaseMQTTProtocol(_StreamReaderProtocolCompatibilityMixin, asyncio.StreamRe
 
 class MQTTProtocol(BaseMQTTProtocol):
     proto_name = b'MQTT'
+    # default, client connections get protocol version of their client
     proto_ver = MQTTv50
+    # packet identifiers are taken from here if set, see PackageFactory.id_generator
+    id_generator = None
 
     def __init__(self, *args, **kwargs):
         super(MQTTProtocol, self).__init__(*args, **kwargs)
@@ -140,6 +151,13 @@ class MQTTProtocol(BaseMQTTProtocol):
 
         return mid, pkg
 
+    def send_publish_many(self, messages):
+        # builds all packages first and writes them to transport at once
+        result = [package.PublishPacket.build_package(message, self) for message in messages]
+        self.write_data(b''.join(pkg for (_, pkg) in result))
+
+        return result
+
     def send_disconnect(self, reason_code=0, **properties):
         pkg = package.DisconnectPacket.build_package(self, reason_code=reason_code, **properties)
 
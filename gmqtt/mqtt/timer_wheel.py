@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle(object):
+    __slots__ = ('_callback', '_args', '_rounds')
+
+    def __init__(self, callback, args, rounds):
+        self._callback = callback
+        self._args = args
+        self._rounds = rounds
+
+    def cancel(self):
+        self._callback = None
+        self._args = None
+
+    def cancelled(self):
+        return self._callback is None
+
+
+class TimerWheel(object):
+    # Hashed timer wheel, can be shared by many connections instead of scheduling a loop timer
+    # per connection. Timers are rounded up to the tick, insertion and cancellation are O(1),
+    # the wheel itself uses one loop timer which exists only while there are scheduled timers.
+    def __init__(self, tick=1.0, slots=512, loop=None):
+        self._tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._count = 0
+        self._loop = loop
+        self._handle = None
+        self._next_tick_at = None
+
+    def __len__(self):
+        return self._count
+
+    def call_later(self, delay, callback, *args):
+        loop = self._loop or asyncio.get_event_loop()
+        if self._handle is None:
+            self._start(loop)
+        # slot is found by the absolute deadline: the next slot fires at _next_tick_at, which may be
+        # less than a tick away, so a timer never fires before its delay is over
+        ticks = max(1, math.ceil((loop.time() + delay - self._next_tick_at) / self._tick - 1e-9) + 1)
+        slot = (self._cursor + ticks) % len(self._slots)
+        handle = TimerHandle(callback, args, (ticks - 1) // len(self._slots))
+        self._slots[slot].append(handle)
+        self._count += 1
+        return handle
+
+    def _start(self, loop):
+        self._next_tick_at = loop.time() + self._tick
+        self._handle = loop.call_at(self._next_tick_at, self._on_tick)
+
+    def _on_tick(self):
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        # from now on it is the time of the next slot, timers scheduled by callbacks are counted from it
+        self._next_tick_at += self._tick
+        bucket = self._slots[self._cursor]
+        self._slots[self._cursor] = []
+        for handle in bucket:
+            if handle._callback is None:
+                self._count -= 1
+            elif handle._rounds > 0:
+                handle._rounds -= 1
+                self._slots[self._cursor].append(handle)
+            else:
+                self._count -= 1
+                callback, args = handle._callback, handle._args
+                handle.cancel()
+                try:
+                    callback(*args)
+                except Exception as exc:
+                    logger.error('[TIMER WHEEL] error in callback %s', callback, exc_info=exc)
+
+        if self._count:
+            # scheduled at absolute time, so ticks do not drift
+            self._handle = (self._loop or asyncio.get_event_loop()).call_at(self._next_tick_at, self._on_tick)
+        else:
+            self._handle = None
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._slots = [[] for _ in self._slots]
+        self._count = 0
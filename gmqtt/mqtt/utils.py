@@ -17,7 +17,8 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-class IdGenerator(object, metaclass=Singleton):
+class IdGenerator(object):
+    # packet identifiers of one client, they are unique only within its session
     def __init__(self, max=65536):
         self._max = max
         self._used_ids = set()
@@ -58,6 +59,40 @@ class IdGenerator(object, metaclass=Singleton):
         return id
 
 
+class MidBitmap(object):
+    # set of packet identifiers (1..65535) kept as 8KB bitmap, allocated on first use
+    __slots__ = ('_bits', '_count')
+
+    def __init__(self, data=None):
+        self._bits = bytearray(data) if data else None
+        self._count = sum(bin(b).count('1') for b in self._bits) if data else 0
+
+    def __contains__(self, mid):
+        return self._bits is not None and bool(self._bits[mid >> 3] & (1 << (mid & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def add(self, mid):
+        if self._bits is None:
+            self._bits = bytearray(8192)
+        if mid not in self:
+            self._bits[mid >> 3] |= 1 << (mid & 7)
+            self._count += 1
+
+    def discard(self, mid):
+        if mid in self:
+            self._bits[mid >> 3] &= ~(1 << (mid & 7)) & 0xFF
+            self._count -= 1
+
+    def clear(self):
+        self._bits = None
+        self._count = 0
+
+    def to_bytes(self):
+        return bytes(self._bits) if self._bits is not None else bytes(8192)
+
+
 def pack_variable_byte_integer(value):
     remaining_bytes = bytearray()
     while True:
@@ -0,0 +1,142 @@
+import asyncio
+import bisect
+import zlib
+
+from .client import Message
+
+
+def _hash(key):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return zlib.crc32(key)
+
+
+class ClientPool(object):
+    # Shards publishes over several connections to the same broker. Messages with the same key
+    # (topic by default) always go through the same client, while it is connected, so their order is kept.
+    # If the client is not connected and rebalance is enabled, its keys temporarily move to the next
+    # connected client on the hash ring; ordering between messages sent before and after the move is not kept.
+    # Subscriptions are made by one client; when it loses connection they move to the next connected client,
+    # for that pool wraps on_connect and on_disconnect callbacks clients have when the pool is created.
+    def __init__(self, clients, replicas=64, rebalance=True):
+        if not clients:
+            raise ValueError('Pool must contain at least one client')
+        self._clients = list(clients)
+        self._rebalance = rebalance
+        self._subscriber = self._clients[0]
+        # former subscribers which may still have subscriptions in their broker session
+        self._stale_subscriptions = {}
+        for client in self._clients:
+            client.on_connect = self._wrap_on_connect(client.on_connect)
+            client.on_disconnect = self._wrap_on_disconnect(client.on_disconnect)
+
+        ring = sorted((_hash('{}#{}'.format(client._client_id, replica)), index)
+                      for index, client in enumerate(self._clients) for replica in range(replicas))
+        self._ring_hashes = [h for (h, _) in ring]
+        self._ring_clients = [index for (_, index) in ring]
+
+        self.rebalanced = 0
+        self.subscriber_moves = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def client_for(self, key):
+        position = bisect.bisect(self._ring_hashes, _hash(key)) % len(self._ring_hashes)
+        primary = self._clients[self._ring_clients[position]]
+        if not self._rebalance or primary.is_connected:
+            return primary
+
+        for i in range(1, len(self._ring_hashes)):
+            client = self._clients[self._ring_clients[(position + i) % len(self._ring_hashes)]]
+            if client.is_connected:
+                self.rebalanced += 1
+                return client
+        # nobody is connected, primary client will queue or fail the message itself
+        return primary
+
+    def publish(self, message_or_topic, payload=None, qos=0, retain=False, key=None, **kwargs):
+        if not isinstance(message_or_topic, Message):
+            message_or_topic = Message(message_or_topic, payload, qos=qos, retain=retain, **kwargs)
+        client = self.client_for(key if key is not None else message_or_topic.topic)
+        return client.publish(message_or_topic)
+
+    @property
+    def subscriber(self):
+        return self._subscriber
+
+    def subscribe(self, *args, **kwargs):
+        # subscribes one client only, otherwise every message would be received by each connection
+        if not self._subscriber.is_connected:
+            self._move_subscriptions()
+        return self._subscriber.subscribe(*args, **kwargs)
+
+    def unsubscribe(self, *args, **kwargs):
+        return self._subscriber.unsubscribe(*args, **kwargs)
+
+    def _move_subscriptions(self):
+        # messages published while subscriptions move may be lost, QoS > 0 ones stay in old client session
+        client = next((client for client in self._clients if client.is_connected), None)
+        if client is None or client is self._subscriber:
+            return
+        previous, self._subscriber = self._subscriber, client
+        self._stale_subscriptions.pop(client, None)
+        if not previous.subscriptions:
+            return
+        client.subscriptions, previous.subscriptions = previous.subscriptions, []
+        self._stale_subscriptions[previous] = [subscription.topic for subscription in client.subscriptions]
+        client._send_subscriptions()
+        self.subscriber_moves += 1
+
+    def _wrap_on_disconnect(self, callback):
+        def on_disconnect(client, packet, *args, **kwargs):
+            # nothing to move when client is disconnected on purpose
+            if client is self._subscriber and client._is_active:
+                self._move_subscriptions()
+            return callback(client, packet, *args, **kwargs)
+        return on_disconnect
+
+    def _wrap_on_connect(self, callback):
+        def on_connect(client, session_present, result, properties):
+            if result == 0:
+                topics = self._stale_subscriptions.pop(client, None)
+                if client is self._subscriber:
+                    # broker has lost the session, pipelined session has sent subscriptions already
+                    if not session_present and not client._config['pipelined_session']:
+                        client._send_subscriptions()
+                elif topics and session_present:
+                    client.unsubscribe(topics)
+                if not self._subscriber.is_connected:
+                    self._move_subscriptions()
+            return callback(client, session_present, result, properties)
+        return on_connect
+
+    async def connect(self, *args, **kwargs):
+        await asyncio.gather(*(client.connect(*args, **kwargs) for client in self._clients))
+
+    async def disconnect(self, *args, **kwargs):
+        await asyncio.gather(*(client.disconnect(*args, **kwargs) for client in self._clients
+                               if client._connection is not None))
+
+    @property
+    def metrics(self):
+        members = []
+        for client in self._clients:
+            offline_queue = client._offline_queue
+            members.append({
+                'client_id': client._client_id,
+                'connected': client.is_connected,
+                'in_flight': client._persistent_storage.size_hint(),
+                'queued': len(offline_queue) if offline_queue is not None else 0,
+            })
+        return {
+            'connected': sum(1 for member in members if member['connected']),
+            'in_flight': sum(member['in_flight'] or 0 for member in members),
+            'queued': sum(member['queued'] for member in members),
+            'rebalanced': self.rebalanced,
+            'subscriber_moves': self.subscriber_moves,
+            'members': members,
+        }
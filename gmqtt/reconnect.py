@@ -0,0 +1,76 @@
+import asyncio
+import random
+import threading
+import time
+
+JITTER_NONE = 'none'
+JITTER_FULL = 'full'
+JITTER_DECORRELATED = 'decorrelated'
+
+
+class ExponentialBackoff(object):
+    # Reconnect delay strategy, keeps no state so one instance may be shared by all clients.
+    # attempt is the number of failed connection attempts in a row (0 for the first reconnect),
+    # previous is the delay used before the current one (None for the first reconnect).
+    #   none:         min(cap, base * 2 ** attempt)
+    #   full:         random(0, min(cap, base * 2 ** attempt))
+    #   decorrelated: min(cap, random(base, previous * 3))
+    def __init__(self, base=1.0, cap=60.0, jitter=JITTER_FULL):
+        if jitter not in (JITTER_NONE, JITTER_FULL, JITTER_DECORRELATED):
+            raise ValueError('Unknown jitter {}'.format(jitter))
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+
+    def delay(self, attempt, previous=None):
+        if self.jitter == JITTER_DECORRELATED:
+            return min(self.cap, random.uniform(self.base, (previous or self.base) * 3))
+        # 2 ** attempt overflows float for very long outages
+        delay = min(self.cap, self.base * 2 ** min(attempt, 64))
+        if self.jitter == JITTER_FULL:
+            return random.uniform(0, delay)
+        return delay
+
+
+class ConnectRateLimiter(object):
+    # Token bucket limiting rate of new connections, share one instance between clients (it may be
+    # used from several event loops and threads) to spread reconnects after broker restart.
+    def __init__(self, rate, burst=None):
+        self._rate = float(rate)
+        self._burst = burst if burst is not None else max(1.0, self._rate)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.acquired = 0
+        self.delayed = 0
+        self.wait_time = 0.0
+
+    def reserve(self):
+        # takes a token and returns how long the caller must wait before using it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            self.acquired += 1
+            if self._tokens >= 0:
+                return 0
+            delay = -self._tokens / self._rate
+            self.delayed += 1
+            self.wait_time += delay
+            return delay
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    @property
+    def metrics(self):
+        return {
+            'acquired': self.acquired,
+            'delayed': self.delayed,
+            'wait_time': self.wait_time,
+        }
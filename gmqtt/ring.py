@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import struct
+import sys
+import time
+from collections import defaultdict, deque, namedtuple
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python < 3.8
+    shared_memory = None
+
+from .mqtt.property import Property
+from .mqtt.utils import unpack_variable_byte_integer
+
+logger = logging.getLogger(__name__)
+
+InboundRecord = namedtuple('InboundRecord', ['topic', 'payload', 'qos', 'retain', 'dup', 'raw_properties'])
+
+
+def unpack_properties(raw_properties):
+    # parses MQTT 5.0 properties block (with its length prefix) to the dict on_message receives
+    if not raw_properties:
+        return {}
+    properties_len, packet = unpack_variable_byte_integer(raw_properties)
+    packet = packet[:properties_len]
+    properties = defaultdict(list)
+    while packet:
+        property_obj = Property.factory(id_=packet[0])
+        if property_obj is None:
+            raise ValueError('Invalid property id {}'.format(packet[0]))
+        result, packet = property_obj.loads(packet[1:])
+        for k, v in result.items():
+            properties[k].append(v)
+    return dict(properties)
+
+
+class SharedRing(object):
+    # Single producer ring buffer of received messages in multiprocessing shared memory.
+    # Head (written by producer) and tail (written by consumers) are byte counters which only grow,
+    # they are kept on separate cache lines. Consumers in several processes must share a lock.
+    # layout: head, tail, capacity; data starts at _data_offset
+    _head = struct.Struct('<Q')
+    _tail_offset = 64
+    _capacity = struct.Struct('<Q')
+    _capacity_offset = 72
+    _data_offset = 128
+    # record header: record size (with padding), payload length, properties length, topic length,
+    # fixed header flags of PUBLISH (dup, qos, retain); record size 0 means "continue from the ring start"
+    _record = struct.Struct('<IIIHBx')
+    _align = 8
+
+    def __init__(self, name=None, size=16 * 1024 * 1024, create=True, lock=None):
+        if shared_memory is None:
+            raise RuntimeError('SharedRing requires multiprocessing.shared_memory (python 3.8+)')
+        if create:
+            size -= size % self._align
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=self._data_offset + size)
+            self._capacity.pack_into(self._shm.buf, self._capacity_offset, size)
+        else:
+            kwargs = {'track': False} if sys.version_info >= (3, 13) else {}
+            self._shm = shared_memory.SharedMemory(name=name, **kwargs)
+        self._buf = self._shm.buf
+        self._size = self._capacity.unpack_from(self._buf, self._capacity_offset)[0]
+        self._lock = lock
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return self._size
+
+    def _load(self, offset):
+        return self._head.unpack_from(self._buf, offset)[0]
+
+    def _store(self, offset, value):
+        self._head.pack_into(self._buf, offset, value)
+
+    def __len__(self):
+        # used bytes
+        return self._load(0) - self._load(self._tail_offset)
+
+    def record_size(self, topic, raw_properties, payload):
+        size = self._record.size + len(topic) + len(raw_properties) + len(payload)
+        return size + (-size % self._align)
+
+    def write(self, flags, topic, raw_properties, payload):
+        # returns False if there is no space for the record, nothing is written in this case
+        size = self.record_size(topic, raw_properties, payload)
+        if size > self._size:
+            raise ValueError('Record of {} bytes does not fit into ring of {} bytes'.format(size, self._size))
+        head = self._load(0)
+        position = head % self._size
+        skip = self._size - position if position + size > self._size else 0
+        if self._size - (head - self._load(self._tail_offset)) < skip + size:
+            return False
+
+        buf = self._buf
+        if skip:
+            if skip >= self._record.size:
+                self._record.pack_into(buf, self._data_offset + position, 0, 0, 0, 0, 0)
+            position = 0
+        offset = self._data_offset + position
+        self._record.pack_into(buf, offset, size, len(payload), len(raw_properties), len(topic), flags)
+        offset += self._record.size
+        buf[offset:offset + len(topic)] = topic
+        offset += len(topic)
+        buf[offset:offset + len(raw_properties)] = raw_properties
+        offset += len(raw_properties)
+        buf[offset:offset + len(payload)] = payload
+        # record becomes visible to consumers only when head is moved
+        self._store(0, head + skip + size)
+        return True
+
+    def _load_size(self, position):
+        return self._record.unpack_from(self._buf, self._data_offset + position)[0]
+
+    def _read(self):
+        tail = self._load(self._tail_offset)
+        if tail == self._load(0):
+            return None
+        buf = self._buf
+        position = tail % self._size
+        # too short tail of the ring has no room even for the wrap marker and is skipped too
+        if self._size - position < self._record.size or not self._load_size(position):
+            tail += self._size - position
+            position = 0
+        offset = self._data_offset + position
+        size, payload_len, properties_len, topic_len, flags = self._record.unpack_from(buf, offset)
+        offset += self._record.size
+        topic = bytes(buf[offset:offset + topic_len])
+        offset += topic_len
+        raw_properties = bytes(buf[offset:offset + properties_len])
+        offset += properties_len
+        payload = bytes(buf[offset:offset + payload_len])
+        self._store(self._tail_offset, tail + size)
+        return InboundRecord(topic.decode('utf-8', errors='replace'), payload, (flags >> 1) & 0x03, flags & 0x01,
+                             (flags >> 3) & 0x01, raw_properties)
+
+    def read(self):
+        # returns InboundRecord or None if ring is empty
+        if self._lock is None:
+            return self._read()
+        with self._lock:
+            return self._read()
+
+    def get(self, timeout=None, poll_interval=0.0005):
+        # blocking read for consumer processes, returns None on timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            record = self.read()
+            if record is not None:
+                return record
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+class RingSink(object):
+    # Inbound sink of the client: received messages are written to the shared ring instead of on_message
+    # and acknowledged once written. When the ring is full, messages wait in memory and reading from the
+    # socket is paused until consumers free enough space.
+    def __init__(self, ring, poll_interval=0.001):
+        self._ring = ring
+        self._poll_interval = poll_interval
+        self._pending = deque()
+        self._poll_handle = None
+        self._pause_reading = None
+        self._resume_reading = None
+
+        self.records_written = 0
+        self.bytes_written = 0
+        self.pauses = 0
+
+    @property
+    def ring(self):
+        return self._ring
+
+    def set_flow_control(self, pause_reading, resume_reading):
+        self._pause_reading = pause_reading
+        self._resume_reading = resume_reading
+
+    @property
+    def metrics(self):
+        return {
+            'records_written': self.records_written,
+            'bytes_written': self.bytes_written,
+            'records_pending': len(self._pending),
+            'pauses': self.pauses,
+        }
+
+    def push(self, flags, topic, raw_properties, payload, callback=None):
+        # callback is called when the record is written to the ring
+        if not self._pending and self._write(flags, topic, raw_properties, payload, callback):
+            return
+        self._pending.append((flags, topic, raw_properties, payload, callback))
+        if self._poll_handle is None:
+            self.pauses += 1
+            if self._pause_reading is not None:
+                self._pause_reading()
+            self._poll_handle = asyncio.get_event_loop().call_later(self._poll_interval, self._flush)
+
+    def _write(self, flags, topic, raw_properties, payload, callback):
+        if not self._ring.write(flags, topic, raw_properties, payload):
+            return False
+        self.records_written += 1
+        self.bytes_written += len(payload)
+        if callback is not None:
+            callback()
+        return True
+
+    def _flush(self):
+        self._poll_handle = None
+        while self._pending:
+            if not self._write(*self._pending[0]):
+                self._poll_handle = asyncio.get_event_loop().call_later(self._poll_interval, self._flush)
+                return
+            self._pending.popleft()
+        logger.debug('[RING SINK] consumers caught up, resume reading')
+        if self._resume_reading is not None:
+            self._resume_reading()
+
+    def close(self):
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+        self._pending.clear()
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from .client import Client
+from .mqtt.utils import iscoroutinefunction_or_partial
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_worker(index, settings, stop_event, metrics_queue):
+    counters = {'received': 0, 'errors': 0}
+    pending = set()
+    on_message = settings['on_message']
+
+    def handle_done(task):
+        pending.discard(task)
+        if task.cancelled() or task.exception() is not None:
+            counters['errors'] += 1
+
+    def handle_message(client, topic, payload, qos, properties):
+        counters['received'] += 1
+        if iscoroutinefunction_or_partial(on_message):
+            task = asyncio.ensure_future(on_message(client, topic, payload, qos, properties))
+            pending.add(task)
+            task.add_done_callback(handle_done)
+            return 0
+        try:
+            return on_message(client, topic, payload, qos, properties)
+        except Exception as exc:
+            counters['errors'] += 1
+            logger.error('[WORKER %s] error in on_message', index, exc_info=exc)
+
+    def report():
+        metrics = dict(counters, in_progress=len(pending), connected=client.is_connected)
+        metrics.update(client.metrics)
+        metrics_queue.put((index, os.getpid(), metrics))
+
+    client = Client('{}-{}'.format(settings['client_id_prefix'], index), **settings['client_kwargs'])
+    client.on_message = handle_message
+    shared_topic = '$share/{}/{}'.format(settings['group'], settings['topic'])
+
+    await client.connect(*settings['connect_args'], **settings['connect_kwargs'])
+    client.subscribe(shared_topic, qos=settings['qos'])
+
+    while not stop_event.is_set():
+        await asyncio.sleep(settings['metrics_interval'])
+        report()
+
+    # graceful shutdown: stop receiving new messages, let started handlers finish, then disconnect
+    client.unsubscribe(shared_topic)
+    if pending:
+        await asyncio.wait(pending, timeout=settings['drain_timeout'])
+    report()
+    await client.disconnect()
+
+
+def _worker_main(index, settings, stop_event, metrics_queue):
+    # parent process decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, settings, stop_event, metrics_queue))
+
+
+class SharedSubscriptionRunner(object):
+    # Runs shared subscription consumer in N worker processes, each with its own event loop and client
+    # joined to the same $share group. on_message must be picklable (module level function).
+    def __init__(self, group, topic, on_message, connect_args, connect_kwargs=None, workers=None, qos=1,
+                 client_id_prefix=None, client_kwargs=None, metrics_interval=1.0, drain_timeout=10.0,
+                 restart_delay=1.0, mp_context=None):
+        self._settings = {
+            'group': group,
+            'topic': topic,
+            'on_message': on_message,
+            'qos': qos,
+            'connect_args': tuple(connect_args),
+            'connect_kwargs': connect_kwargs or {},
+            'client_id_prefix': client_id_prefix or 'gmqtt-{}-{}'.format(group, os.getpid()),
+            'client_kwargs': client_kwargs or {},
+            'metrics_interval': metrics_interval,
+            'drain_timeout': drain_timeout,
+        }
+        self._workers_count = workers or os.cpu_count()
+        self._restart_delay = restart_delay
+        self._context = mp_context or multiprocessing.get_context()
+
+        self._stop_event = self._context.Event()
+        self._metrics_queue = self._context.Queue()
+        self._workers = {}
+        self._worker_metrics = {}
+        self._stopping = False
+
+        self.restarts = 0
+
+    def _spawn(self, index):
+        process = self._context.Process(target=_worker_main, name='gmqtt-worker-{}'.format(index),
+                                        args=(index, self._settings, self._stop_event, self._metrics_queue))
+        process.start()
+        self._workers[index] = process
+        logger.info('[RUNNER] worker %s started, pid %s', index, process.pid)
+
+    def start(self):
+        for index in range(self._workers_count):
+            self._spawn(index)
+
+    def _collect_metrics(self):
+        while True:
+            try:
+                index, pid, metrics = self._metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._worker_metrics[index] = dict(metrics, pid=pid)
+
+    def poll(self):
+        # collects worker metrics and restarts crashed workers
+        self._collect_metrics()
+        if self._stopping:
+            return
+        for index, process in list(self._workers.items()):
+            if not process.is_alive():
+                logger.warning('[RUNNER] worker %s (pid %s) exited with code %s, restarting',
+                               index, process.pid, process.exitcode)
+                self.restarts += 1
+                self._spawn(index)
+
+    @property
+    def metrics(self):
+        self._collect_metrics()
+        total = {}
+        for metrics in self._worker_metrics.values():
+            for key, value in metrics.items():
+                if key != 'pid' and isinstance(value, (int, float)):
+                    total[key] = total.get(key, 0) + value
+        total['workers_alive'] = sum(1 for process in self._workers.values() if process.is_alive())
+        total['restarts'] = self.restarts
+        total['workers'] = dict(self._worker_metrics)
+        return total
+
+    def stop(self):
+        # can be called from signal handler
+        self._stopping = True
+        self._stop_event.set()
+
+    def shutdown(self, timeout=None):
+        self.stop()
+        timeout = timeout if timeout is not None else self._settings['drain_timeout'] + 5
+        deadline = time.monotonic() + timeout
+        for process in self._workers.values():
+            # worker does not exit until its metrics are flushed to the queue pipe, so queue is drained meanwhile
+            while process.is_alive() and time.monotonic() < deadline:
+                self._collect_metrics()
+                process.join(min(0.05, max(0, deadline - time.monotonic())))
+            if process.is_alive():
+                logger.warning('[RUNNER] worker pid %s did not stop in time, terminating', process.pid)
+                process.terminate()
+                process.join()
+        self._collect_metrics()
+
+    def run(self):
+        # blocks until SIGINT/SIGTERM or stop() call
+        previous = {sig: signal.signal(sig, lambda *args: self.stop()) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            self.start()
+            while not self._stopping:
+                time.sleep(self._restart_delay)
+                self.poll()
+        finally:
+            self.shutdown()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
@@ -0,0 +1,91 @@
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Serializers turn lists, tuples and dicts published as payload into bytes (dumps) and received payloads
+# back into objects (loads), they are selected by name on publish and by content_type on receive.
+_serializers = {}
+_serializers_by_content_type = {}
+
+
+class JsonSerializer(object):
+    name = 'json'
+    content_type = 'application/json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer(object):
+    # produces utf-8 bytes in one pass, but serializes tuples as lists and accepts only str keys
+    name = 'orjson'
+    content_type = 'application/json'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackSerializer(object):
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class StructSerializer(object):
+    # fixed binary layout, e.g. StructSerializer('sensor', '<Iff', 'application/x-sensor') publishes
+    # (timestamp, temperature, humidity) tuples as 12 bytes
+    def __init__(self, name, fmt, content_type='application/octet-stream'):
+        self.name = name
+        self.content_type = content_type
+        self._struct = struct.Struct(fmt)
+
+    def dumps(self, obj):
+        return self._struct.pack(*obj)
+
+    def loads(self, data):
+        return self._struct.unpack(data)
+
+
+def register_serializer(serializer, receive=True):
+    # with receive=True payloads with serializer content_type are decoded by it
+    _serializers[serializer.name] = serializer
+    if receive:
+        _serializers_by_content_type[serializer.content_type] = serializer
+
+
+def get_serializer(name):
+    try:
+        return _serializers[name]
+    except KeyError:
+        raise ValueError('Unknown serializer {}'.format(name))
+
+
+def get_deserializer(content_type):
+    return _serializers_by_content_type.get(content_type)
+
+
+register_serializer(JsonSerializer())
+if orjson is not None:
+    register_serializer(OrjsonSerializer())
+if msgpack is not None:
+    register_serializer(MsgpackSerializer())
@@ -0,0 +1,304 @@
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import sys
+import threading
+import zlib
+
+from .client import Client
+from .mqtt.utils import iscoroutinefunction_or_partial
+
+logger = logging.getLogger(__name__)
+
+MODE_THREAD = 'thread'
+MODE_PROCESS = 'process'
+
+
+def _default_mode():
+    # threads scale with cores only on free-threaded builds
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return MODE_THREAD if is_gil_enabled is not None and not is_gil_enabled() else MODE_PROCESS
+
+
+def _merge_metrics(total, metrics):
+    # counters are summed; values of the last event (like failover_time_last) are not, the largest one is kept
+    for key, value in metrics.items():
+        if key.endswith('_last'):
+            total[key] = max(total.get(key, value), value)
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+class _ShardState(object):
+    # Lives inside shard event loop, owns its clients and executes commands sent by handles.
+    def __init__(self, index, client_class):
+        self.index = index
+        self.client_class = client_class
+        self.clients = {}
+
+    async def execute(self, op, client_id, args, kwargs):
+        if op == 'metrics':
+            return self.metrics
+        if op == 'add':
+            callbacks = kwargs.pop('callbacks', None) or {}
+            client = self.client_class(client_id, **kwargs)
+            for name, callback in callbacks.items():
+                setattr(client, name, callback)
+            self.clients[client_id] = client
+            return None
+
+        client = self.clients[client_id]
+        if op == 'connect':
+            return await client.connect(*args, **kwargs)
+        elif op == 'disconnect':
+            return await client.disconnect(*args, **kwargs)
+        elif op == 'call':
+            func, args = args[0], args[1:]
+            if iscoroutinefunction_or_partial(func):
+                return await func(client, *args, **kwargs)
+            return func(client, *args, **kwargs)
+        elif op in ('publish', 'subscribe', 'unsubscribe'):
+            return getattr(client, op)(*args, **kwargs)
+        raise ValueError('Unknown shard command {}'.format(op))
+
+    async def close(self):
+        await asyncio.gather(*(client.disconnect() for client in self.clients.values()
+                               if client._connection is not None), return_exceptions=True)
+        self.clients.clear()
+
+    @property
+    def metrics(self):
+        metrics = {'clients': len(self.clients), 'connected': 0}
+        for client in self.clients.values():
+            metrics['connected'] += client.is_connected
+            _merge_metrics(metrics, client.metrics)
+        return metrics
+
+
+class _ThreadShard(object):
+    def __init__(self, index, client_class):
+        self.index = index
+        self._state = _ShardState(index, client_class)
+        self._loop = asyncio.new_event_loop()
+        self._running = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='gmqtt-shard-{}'.format(index), daemon=True)
+
+    def _run(self):
+        self._loop.call_soon(self._running.set)
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, op, client_id=None, args=(), kwargs=None):
+        return asyncio.run_coroutine_threadsafe(self._state.execute(op, client_id, args, kwargs or {}), self._loop)
+
+    def stop(self, timeout=None):
+        if self._thread.is_alive():
+            # right after start() loop may not run yet, stopping it then would be lost
+            self._running.wait(timeout)
+            try:
+                asyncio.run_coroutine_threadsafe(self._state.close(), self._loop).result(timeout)
+            except concurrent.futures.TimeoutError:
+                logger.warning('[SHARD %s] clients did not disconnect in time', self.index)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._loop.close()
+
+
+async def _serve_process_shard(state, commands, results):
+    loop = asyncio.get_running_loop()
+
+    async def execute(request_id, op, client_id, args, kwargs):
+        try:
+            results.put((request_id, True, await state.execute(op, client_id, args, kwargs)))
+        except Exception as exc:
+            results.put((request_id, False, exc))
+
+    tasks = set()
+    while True:
+        command = await loop.run_in_executor(None, commands.get)
+        if command is None:
+            break
+        task = loop.create_task(execute(*command))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    await state.close()
+
+
+def _process_shard_main(index, client_class, commands, results):
+    asyncio.run(_serve_process_shard(_ShardState(index, client_class), commands, results))
+
+
+class _ProcessShard(object):
+    # Clients live in a subprocess; commands and results are pickled through multiprocessing queues,
+    # so arguments, return values and callbacks must be picklable.
+    def __init__(self, index, client_class, context):
+        self.index = index
+        self._commands = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(target=_process_shard_main, name='gmqtt-shard-{}'.format(index),
+                                        args=(index, client_class, self._commands, self._results), daemon=True)
+        self._futures = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_results, name='gmqtt-shard-{}-results'.format(index),
+                                        daemon=True)
+
+    def start(self):
+        self._process.start()
+        self._reader.start()
+
+    def _read_results(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            request_id, ok, value = result
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def submit(self, op, client_id=None, args=(), kwargs=None):
+        future = concurrent.futures.Future()
+        with self._lock:
+            request_id = next(self._request_ids)
+            self._futures[request_id] = future
+        self._commands.put((request_id, op, client_id, args, kwargs or {}))
+        return future
+
+    def stop(self, timeout=None):
+        self._commands.put(None)
+        self._process.join(timeout)
+        if self._process.is_alive():
+            logger.warning('[SHARD %s] process did not stop in time, terminating', self.index)
+            self._process.terminate()
+            self._process.join()
+        self._results.put(None)
+        self._reader.join(timeout)
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+
+class ClientHandle(object):
+    # Thread-safe proxy to a client living on one of the runtime shards. Every method returns
+    # concurrent.futures.Future, use asyncio.wrap_future to await it from another event loop.
+    def __init__(self, shard, client_id):
+        self._shard = shard
+        self.client_id = client_id
+
+    @property
+    def shard(self):
+        return self._shard.index
+
+    def connect(self, *args, **kwargs):
+        return self._shard.submit('connect', self.client_id, args, kwargs)
+
+    def disconnect(self, *args, **kwargs):
+        return self._shard.submit('disconnect', self.client_id, args, kwargs)
+
+    def publish(self, *args, **kwargs):
+        return self._shard.submit('publish', self.client_id, args, kwargs)
+
+    def subscribe(self, *args, **kwargs):
+        return self._shard.submit('subscribe', self.client_id, args, kwargs)
+
+    def unsubscribe(self, *args, **kwargs):
+        return self._shard.submit('unsubscribe', self.client_id, args, kwargs)
+
+    def call(self, func, *args, **kwargs):
+        # runs func(client, *args, **kwargs) on the client event loop, func may be a coroutine function
+        return self._shard.submit('call', self.client_id, (func, ) + args, kwargs)
+
+
+class ShardedRuntime(object):
+    # Owns K event loops (threads or subprocesses) and places clients on them by hash of client id.
+    # Thread mode is meant for free-threaded builds, with GIL all shards share one core. Clients keep
+    # no state shared between them (packet ids and protocol version are per client), so they may run
+    # on different threads.
+    def __init__(self, shards=None, mode=None, client_class=Client, mp_context=None):
+        self._mode = mode or _default_mode()
+        if self._mode not in (MODE_THREAD, MODE_PROCESS):
+            raise ValueError('Unknown runtime mode {}'.format(self._mode))
+
+        count = shards or multiprocessing.cpu_count()
+        if self._mode == MODE_THREAD:
+            self._shards = [_ThreadShard(index, client_class) for index in range(count)]
+        else:
+            context = mp_context or multiprocessing.get_context()
+            self._shards = [_ProcessShard(index, client_class, context) for index in range(count)]
+        self._handles = {}
+        self._started = False
+
+        self.metrics_timeout = 5
+
+    @property
+    def mode(self):
+        return self._mode
+
+    def __len__(self):
+        return len(self._shards)
+
+    def start(self):
+        if not self._started:
+            for shard in self._shards:
+                shard.start()
+            self._started = True
+
+    def stop(self, timeout=10):
+        if self._started:
+            for shard in self._shards:
+                shard.stop(timeout)
+            self._started = False
+        self._handles.clear()
+
+    def shard_for(self, client_id):
+        return zlib.crc32(client_id.encode('utf-8')) % len(self._shards)
+
+    def add_client(self, client_id, callbacks=None, **client_kwargs):
+        # creates client on its shard; callbacks is a dict like {'on_message': func}, callbacks are called
+        # in the shard event loop
+        if client_id in self._handles:
+            raise ValueError('Client {} is already added'.format(client_id))
+        self.start()
+        shard = self._shards[self.shard_for(client_id)]
+        shard.submit('add', client_id, kwargs=dict(client_kwargs, callbacks=callbacks)).result()
+        handle = self._handles[client_id] = ClientHandle(shard, client_id)
+        return handle
+
+    def get_client(self, client_id):
+        return self._handles[client_id]
+
+    def __iter__(self):
+        return iter(self._handles.values())
+
+    @property
+    def metrics(self):
+        # blocks until every shard reports, must not be called from a shard event loop
+        futures = [shard.submit('metrics') for shard in self._shards]
+        shards = [future.result(self.metrics_timeout) for future in futures]
+        total = {}
+        for metrics in shards:
+            _merge_metrics(total, metrics)
+        total['shards'] = shards
+        return total
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
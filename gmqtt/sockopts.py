@@ -0,0 +1,56 @@
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+# macOS names idle time option TCP_KEEPALIVE
+_TCP_KEEPIDLE = getattr(socket, 'TCP_KEEPIDLE', getattr(socket, 'TCP_KEEPALIVE', None))
+
+
+class SocketOptions(object):
+    # Options applied to the client socket when connection is made, None leaves system (or asyncio) default.
+    #   nodelay: TCP_NODELAY, asyncio enables it by default, False turns Nagle's algorithm on again
+    #   send_buffer, receive_buffer: SO_SNDBUF, SO_RCVBUF in bytes
+    #   keepalive_idle, keepalive_interval, keepalive_count: TCP keepalive probes (seconds), turns SO_KEEPALIVE on
+    #   user_timeout: TCP_USER_TIMEOUT (seconds), connection is dropped when sent data stays unacknowledged longer
+    #   local_addr: (host, port) to bind the socket to before connecting
+    def __init__(self, nodelay=None, send_buffer=None, receive_buffer=None, keepalive_idle=None,
+                 keepalive_interval=None, keepalive_count=None, user_timeout=None, local_addr=None):
+        self.nodelay = nodelay
+        self.send_buffer = send_buffer
+        self.receive_buffer = receive_buffer
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.user_timeout = user_timeout
+        self.local_addr = local_addr
+
+    def _options(self):
+        options = []
+        if self.nodelay is not None:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay), 'TCP_NODELAY'))
+        if self.send_buffer is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer, 'SO_SNDBUF'))
+        if self.receive_buffer is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer, 'SO_RCVBUF'))
+        keepalive = [(_TCP_KEEPIDLE, self.keepalive_idle, 'TCP_KEEPIDLE'),
+                     (getattr(socket, 'TCP_KEEPINTVL', None), self.keepalive_interval, 'TCP_KEEPINTVL'),
+                     (getattr(socket, 'TCP_KEEPCNT', None), self.keepalive_count, 'TCP_KEEPCNT')]
+        if any(value is not None for _, value, _ in keepalive):
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1, 'SO_KEEPALIVE'))
+            options.extend((socket.IPPROTO_TCP, option, int(value), name)
+                           for option, value, name in keepalive if value is not None)
+        if self.user_timeout is not None:
+            options.append((socket.IPPROTO_TCP, getattr(socket, 'TCP_USER_TIMEOUT', None),
+                            int(self.user_timeout * 1000), 'TCP_USER_TIMEOUT'))
+        return options
+
+    def apply(self, sock):
+        for level, option, value, name in self._options():
+            if option is None:
+                logger.warning('[SOCKET OPTIONS] %s is not supported on this platform', name)
+                continue
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError as exc:
+                logger.warning('[SOCKET OPTIONS] failed to set %s: %s', name, exc)
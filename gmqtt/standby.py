@@ -0,0 +1,81 @@
+import asyncio
+import struct
+
+from .mqtt.connection import MQTTConnection
+from .mqtt.constants import MQTTCommands
+from .mqtt.handler import MQTTConnectError
+
+
+class StandbyConnection(object):
+    # Second connection of the client: established and authenticated in advance on alternate endpoint
+    # or with alternate client id, it only keeps itself alive until the client takes it over.
+    def __init__(self, client, host, port, client_id):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.session_present = False
+        self.connack_properties = {}
+
+        self._client = client
+        self._connection = None
+        self._connack = None
+
+    @property
+    def ready(self):
+        return self._connection is not None and self._connack.done() and not self._connack.exception() \
+            and not self._connection.is_closing()
+
+    async def open(self, timeout=10):
+        client = self._client
+        self._connack = asyncio.get_event_loop().create_future()
+        self._connection = await MQTTConnection.create_connection(
+            self.host, self.port, client._ssl, client._clean_session, client._keepalive, logger=client._logger,
+            timer_wheel=client._timer_wheel, socket_options=client._socket_options,
+            transport=client._transport_factory, id_generator=client._id_generator,
+            protocol_version=client._protocol_version)
+        self._connection.set_handler(self)
+        await self._connection.auth(self.client_id, client._username, client._password, **client._connect_properties)
+        await asyncio.wait_for(asyncio.shield(self._connack), timeout)
+
+    def __call__(self, cmd, packet):
+        cmd_type = cmd & 0xF0
+        if cmd_type == MQTTCommands.CONNACK:
+            (session_present, result) = struct.unpack('!BB', packet[:2])
+            if result != 0:
+                self._connack.set_exception(MQTTConnectError(result))
+                return
+            self.session_present = bool(session_present)
+            if len(packet) > 2:
+                self.connack_properties = self._client._parse_properties(packet[2:])[0] or {}
+            self._connack.set_result(None)
+        elif cmd_type == MQTTCommands.DISCONNECT:
+            if not self._connack.done():
+                self._connack.set_exception(ConnectionResetError('Standby connection was closed'))
+            if self._connection is not None:
+                self._connection = None
+                self._client._handle_standby_lost(self)
+        elif cmd_type == MQTTCommands.PUBLISH:
+            # standby does not subscribe, but session of its client id may still have subscriptions; their
+            # messages are acknowledged and dropped, otherwise they would hold broker in-flight window
+            qos = (cmd & 0x06) >> 1
+            if qos and self._connection is not None:
+                (topic_len, ) = struct.unpack_from('!H', packet)
+                (mid, ) = struct.unpack_from('!H', packet, 2 + topic_len)
+                self._connection.send_command_with_mid(MQTTCommands.PUBACK if qos == 1 else MQTTCommands.PUBREC,
+                                                       mid, False)
+            self._client._metrics['standby_dropped_messages'] += 1
+        elif cmd_type == MQTTCommands.PUBREL and self._connection is not None:
+            (mid, ) = struct.unpack_from('!H', packet)
+            self._connection.send_command_with_mid(MQTTCommands.PUBCOMP, mid, False)
+        # PINGRESP and other packets are ignored
+
+    def detach(self):
+        # hands the connection over to the client
+        connection, self._connection = self._connection, None
+        return connection
+
+    async def close(self):
+        connection = self.detach()
+        if connection is not None and not connection.is_closing():
+            connection.send_disconnect()
+            await connection.close()
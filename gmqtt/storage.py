@@ -1,15 +1,53 @@
 import asyncio
-from typing import Callable, Tuple, Set
+import itertools
+import logging
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Callable, Tuple, Set, Optional
 
 import heapq
 
+from .mqtt.utils import MidBitmap
+
+logger = logging.getLogger(__name__)
+
+
+class StorageFullError(Exception):
+    pass
+
 
 class BasePersistentStorage(object):
+    # check_capacity is called only by storages which set it, so others do not pay for package sizing
+    has_capacity_limit = False
+    # client sets it to free packet id of a message the storage drops itself (e.g. on overflow)
+    on_drop = None
+
     async def push_message(self, mid, raw_package):
         raise NotImplementedError
 
-    def push_message_nowait(self, mid, raw_package) -> asyncio.Future:
-        return asyncio.ensure_future(self.push_message(mid, raw_package))
+    def push_message_nowait(self, mid, raw_package, **kwargs) -> asyncio.Future:
+        return asyncio.ensure_future(self.push_message(mid, raw_package, **kwargs))
+
+    # Synchronous fast path used by client on every QoS>0 publish and acknowledgement.
+    # In-memory storages override these methods and return None, storages doing real I/O
+    # may keep default implementations, which schedule async methods as tasks.
+    def push_nowait(self, mid, raw_package, **kwargs) -> Optional[asyncio.Future]:
+        return self.push_message_nowait(mid, raw_package, **kwargs)
+
+    def remove_nowait(self, mid) -> Optional[asyncio.Future]:
+        return asyncio.ensure_future(self.remove_message_by_mid(mid))
+
+    def clear_nowait(self) -> Optional[asyncio.Future]:
+        return asyncio.ensure_future(self.clear())
+
+    def check_capacity(self, size):
+        # if has_capacity_limit is set, called synchronously before a QoS>0 message is sent with the size of its
+        # package (see PublishPacket.package_size); raise StorageFullError to refuse it
+        pass
 
     async def pop_message(self) -> Tuple[int, bytes]:
         raise NotImplementedError
@@ -32,6 +70,19 @@ class BasePersistentStorage(object):
     async def get_all(self):
         raise NotImplementedError
 
+    def size_hint(self) -> Optional[int]:
+        # number of stored messages if it can be obtained cheaply, used for progress reporting only
+        return None
+
+    async def iter_chunks(self, chunk_size):
+        # yields stored (enqueue time, mid, raw_package) tuples, oldest first, without removing them;
+        # enqueue time is the wall clock time (time.time()) of push_message call, it is used for message expiry,
+        # so storages persisted across processes must keep it;
+        # storages which can read their data partially should override this
+        messages = sorted(await self.get_all(), key=itemgetter(0))
+        for i in range(0, len(messages), chunk_size):
+            yield messages[i:i + chunk_size]
+
 
 class HeapPersistentStorage(BasePersistentStorage):
     def __init__(self):
@@ -46,22 +97,34 @@ class HeapPersistentStorage(BasePersistentStorage):
         if not self._queue:
             self._notify_waiters(self._empty_waiters, lambda waiter: waiter.set_result(None))
 
-    async def push_message(self, mid, raw_package):
-        tm = asyncio.get_event_loop().time()
+    def push_nowait(self, mid, raw_package, **kwargs):
+        # priority and other hints of bounded storages are ignored here
+        tm = time.time()
         heapq.heappush(self._queue, (tm, mid, raw_package))
 
+    async def push_message(self, mid, raw_package, **kwargs):
+        self.push_nowait(mid, raw_package)
+
     async def pop_message(self):
         (tm, mid, raw_package) = heapq.heappop(self._queue)
 
         self._check_empty()
         return mid, raw_package
 
-    async def remove_message_by_mid(self, mid):
+    def remove_nowait(self, mid):
+        if self._queue and self._queue[0][1] == mid:
+            # acknowledgements usually come in the publish order
+            heapq.heappop(self._queue)
+            self._check_empty()
+            return
         message = next(filter(lambda x: x[1] == mid, self._queue), None)
         if message:
             self._queue.remove(message)
+            heapq.heapify(self._queue)
             self._check_empty()
-        heapq.heapify(self._queue)
+
+    async def remove_message_by_mid(self, mid):
+        self.remove_nowait(mid)
 
     @property
     async def is_empty(self):
@@ -73,9 +136,376 @@ class HeapPersistentStorage(BasePersistentStorage):
             self._empty_waiters.add(waiter)
             await waiter
 
-    async def clear(self):
+    def clear_nowait(self):
         self._queue = []
         self._notify_waiters(self._empty_waiters, lambda waiter: waiter.set_result(None))
 
+    async def clear(self):
+        self.clear_nowait()
+
+    async def get_all(self):
+        return self._queue
+
+    def size_hint(self):
+        return len(self._queue)
+
+
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_PRIORITY = 'drop_priority'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_DROP_NEW = 'drop_new'
+
+
+class BoundedPersistentStorage(HeapPersistentStorage):
+    # spilled record header: enqueue time, mid, priority, package length
+    _record = struct.Struct('!dHiI')
+
+    def __init__(self, max_bytes=None, max_messages=None, policy=OVERFLOW_DROP_OLDEST, spill_path=None):
+        super(BoundedPersistentStorage, self).__init__()
+        if policy not in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_PRIORITY, OVERFLOW_SPILL):
+            raise ValueError('Unknown overflow policy {}'.format(policy))
+        self._max_bytes = max_bytes
+        self._max_messages = max_messages
+        self._policy = policy
+        self._priorities = {}
+
+        self._spill_path = spill_path
+        self._spill_file = None
+        # mid -> (offset, size) of live records in the spill file
+        self._spilled = {}
+
+        self.bytes_held = 0
+        self.bytes_spilled = 0
+        self.bytes_dropped = 0
+        self.messages_dropped = 0
+
+    @property
+    def has_capacity_limit(self):
+        # only rejecting storage refuses messages, others make room for them
+        return self._policy == OVERFLOW_REJECT and (self._max_bytes is not None or self._max_messages is not None)
+
+    @property
+    def metrics(self):
+        return {
+            'messages_held': len(self._queue),
+            'bytes_held': self.bytes_held,
+            'messages_spilled': len(self._spilled),
+            'bytes_spilled': self.bytes_spilled,
+            'messages_dropped': self.messages_dropped,
+            'bytes_dropped': self.bytes_dropped,
+        }
+
+    def _fits(self, size):
+        if self._max_bytes is not None and self.bytes_held + size > self._max_bytes:
+            return False
+        if self._max_messages is not None and len(self._queue) + 1 > self._max_messages:
+            return False
+        return True
+
+    def _check_empty(self):
+        if not self._queue and not self._spilled:
+            self._notify_waiters(self._empty_waiters, lambda waiter: waiter.set_result(None))
+
+    def check_capacity(self, size):
+        if self._policy == OVERFLOW_REJECT and not self._fits(size):
+            raise StorageFullError('Persistent storage is full: {} messages, {} bytes'.format(
+                len(self._queue), self.bytes_held))
+
+    def _drop(self, mid, raw_package):
+        logger.debug('[STORAGE OVERFLOW] dropping message %s', mid)
+        self._priorities.pop(mid, None)
+        self.messages_dropped += 1
+        self.bytes_dropped += len(raw_package)
+        if self.on_drop is not None:
+            self.on_drop(mid)
+
+    def _take(self, message):
+        # removes message from the memory queue, heap invariant must be restored by caller if needed
+        self._queue.remove(message)
+        self.bytes_held -= len(message[2])
+
+    def _make_room(self, tm, mid, raw_package, priority):
+        # returns False if the new message itself has to be dropped (or was spilled)
+        if self._policy == OVERFLOW_REJECT:
+            raise StorageFullError('Persistent storage is full')
+
+        if self._policy == OVERFLOW_DROP_PRIORITY and self._queue:
+            victim = min(self._queue, key=lambda x: (self._priorities.get(x[1], 0), x[0]))
+            if priority < self._priorities.get(victim[1], 0):
+                self._drop(mid, raw_package)
+                return False
+            self._take(victim)
+            heapq.heapify(self._queue)
+            self._drop(victim[1], victim[2])
+            return True
+
+        if not self._queue:
+            # message is bigger than the whole memory budget
+            if self._policy == OVERFLOW_SPILL:
+                self._spill(tm, mid, raw_package, priority)
+            else:
+                self._drop(mid, raw_package)
+            return False
+
+        (old_tm, old_mid, old_package) = heapq.heappop(self._queue)
+        self.bytes_held -= len(old_package)
+        if self._policy == OVERFLOW_SPILL:
+            self._spill(old_tm, old_mid, old_package, self._priorities.pop(old_mid, 0))
+        else:
+            self._drop(old_mid, old_package)
+        return True
+
+    def _spill(self, tm, mid, raw_package, priority):
+        if self._spill_file is None:
+            self._spill_file = open(self._spill_path, 'w+b') if self._spill_path else tempfile.TemporaryFile()
+        self._spill_file.seek(0, 2)
+        offset = self._spill_file.tell()
+        self._spill_file.write(self._record.pack(tm, mid, priority, len(raw_package)))
+        self._spill_file.write(raw_package)
+        self._spilled[mid] = (offset, len(raw_package))
+        self.bytes_spilled += len(raw_package)
+
+    def _load_spilled(self):
+        # reads spilled messages back into memory, memory budget is not applied here
+        if not self._spilled:
+            return
+        self._spill_file.flush()
+        self._spill_file.seek(0)
+        data = self._spill_file.read()
+        offset = 0
+        while offset < len(data):
+            tm, mid, priority, size = self._record.unpack_from(data, offset)
+            start = offset + self._record.size
+            if self._spilled.get(mid, (None, None))[0] == offset:
+                raw_package = bytearray(data[start:start + size])
+                self._queue.append((tm, mid, raw_package))
+                self.bytes_held += size
+                if priority:
+                    self._priorities[mid] = priority
+            offset = start + size
+        heapq.heapify(self._queue)
+        self._truncate_spill()
+
+    def _truncate_spill(self):
+        if self._spill_file is not None:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+        self._spilled = {}
+        self.bytes_spilled = 0
+
+    def push_nowait(self, mid, raw_package, priority=0):
+        tm = time.time()
+        while not self._fits(len(raw_package)):
+            if not self._make_room(tm, mid, raw_package, priority):
+                return
+        if priority:
+            self._priorities[mid] = priority
+        heapq.heappush(self._queue, (tm, mid, raw_package))
+        self.bytes_held += len(raw_package)
+
+    async def push_message(self, mid, raw_package, priority=0):
+        self.push_nowait(mid, raw_package, priority=priority)
+
+    async def pop_message(self):
+        # spilled messages may be older than the ones in memory, the heap merges them by enqueue time
+        self._load_spilled()
+        (tm, mid, raw_package) = heapq.heappop(self._queue)
+        self.bytes_held -= len(raw_package)
+        self._priorities.pop(mid, None)
+
+        self._check_empty()
+        return mid, raw_package
+
+    def remove_nowait(self, mid):
+        if self._queue and self._queue[0][1] == mid:
+            self.bytes_held -= len(heapq.heappop(self._queue)[2])
+        elif mid in self._spilled:
+            _, size = self._spilled.pop(mid)
+            self.bytes_spilled -= size
+            if not self._spilled:
+                self._truncate_spill()
+        else:
+            message = next(filter(lambda x: x[1] == mid, self._queue), None)
+            if message:
+                self._take(message)
+                heapq.heapify(self._queue)
+        self._priorities.pop(mid, None)
+        self._check_empty()
+
+    async def remove_message_by_mid(self, mid):
+        self.remove_nowait(mid)
+
+    @property
+    async def is_empty(self):
+        return not self._queue and not self._spilled
+
+    async def wait_empty(self) -> None:
+        if self._queue or self._spilled:
+            waiter = asyncio.get_running_loop().create_future()
+            self._empty_waiters.add(waiter)
+            await waiter
+
+    def clear_nowait(self):
+        self.bytes_held = 0
+        self._priorities = {}
+        self._truncate_spill()
+        super(BoundedPersistentStorage, self).clear_nowait()
+
     async def get_all(self):
-        return self._queue
\ No newline at end of file
+        self._load_spilled()
+        return self._queue
+
+    def size_hint(self):
+        return len(self._queue) + len(self._spilled)
+
+    def _read_spilled(self, offset, end, chunk_size):
+        chunk = []
+        while offset < end and len(chunk) < chunk_size:
+            self._spill_file.seek(offset)
+            header = self._spill_file.read(self._record.size)
+            if len(header) < self._record.size:
+                # spill file was truncated meanwhile
+                return chunk, end
+            tm, mid, priority, size = self._record.unpack(header)
+            if self._spilled.get(mid) == (offset, size):
+                chunk.append((tm, mid, bytearray(self._spill_file.read(size))))
+            offset += self._record.size + size
+        return chunk, offset
+
+    async def iter_chunks(self, chunk_size):
+        # spilled messages are always older than the ones in memory, so they go first;
+        # they are streamed from the segment file and stay there until acknowledged
+        if self._spilled:
+            self._spill_file.flush()
+            offset, end = 0, self._spill_file.seek(0, 2)
+            while offset < end:
+                chunk, offset = self._read_spilled(offset, end, chunk_size)
+                if chunk:
+                    yield chunk
+        messages = sorted(self._queue, key=itemgetter(0))
+        for i in range(0, len(messages), chunk_size):
+            yield messages[i:i + chunk_size]
+
+
+class OfflineQueue(object):
+    # keeps messages published while client is disconnected, they are sent right after CONNACK
+    def __init__(self, capacity=1000, policy=OVERFLOW_DROP_OLDEST, conflate=False):
+        if policy not in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEW):
+            raise ValueError('Unknown overflow policy {}'.format(policy))
+        self._capacity = capacity
+        self._policy = policy
+        # with conflation only the latest message per topic is kept
+        self._conflate = conflate
+        self._messages = OrderedDict()
+        self._counter = itertools.count()
+
+        self.messages_dropped = 0
+        self.messages_conflated = 0
+        self.messages_expired = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def metrics(self):
+        return {
+            'messages_queued': len(self._messages),
+            'messages_dropped': self.messages_dropped,
+            'messages_conflated': self.messages_conflated,
+            'messages_expired': self.messages_expired,
+        }
+
+    def put(self, message):
+        key = message.topic if self._conflate else next(self._counter)
+        if key in self._messages:
+            # the latest value goes to the tail, so it is not the first one to drop on overflow
+            self._messages[key] = (time.monotonic(), message)
+            self._messages.move_to_end(key)
+            self.messages_conflated += 1
+            return
+
+        if len(self._messages) >= self._capacity:
+            if self._policy == OVERFLOW_REJECT:
+                raise StorageFullError('Offline queue is full: {} messages'.format(len(self._messages)))
+            self.messages_dropped += 1
+            if self._policy == OVERFLOW_DROP_NEW:
+                logger.debug('[OFFLINE QUEUE OVERFLOW] dropping new message')
+                return
+            logger.debug('[OFFLINE QUEUE OVERFLOW] dropping oldest message')
+            self._messages.popitem(last=False)
+
+        self._messages[key] = (time.monotonic(), message)
+
+    def take_all(self):
+        # returns queued messages in publish order, expired ones are dropped,
+        # message_expiry_interval of the rest is decreased by time spent in queue
+        now = time.monotonic()
+        messages = []
+        for (tm, message) in self._messages.values():
+            interval = message.properties.get('message_expiry_interval')
+            if interval is not None:
+                elapsed = int(now - tm)
+                if elapsed >= interval:
+                    self.messages_expired += 1
+                    continue
+                if message.frozen:
+                    message = message.copy()
+                message.properties = dict(message.properties, message_expiry_interval=interval - elapsed)
+            messages.append(message)
+        self._messages = OrderedDict()
+        return messages
+
+    def requeue(self, messages):
+        # puts messages returned by take_all back to the head of the queue, e.g. when they were not delivered
+        now = time.monotonic()
+        messages = OrderedDict(((message.topic if self._conflate else next(self._counter)), (now, message))
+                               for message in messages)
+        # newer message published meanwhile replaces requeued one with the same topic
+        for key in self._messages:
+            messages.pop(key, None)
+        messages.update(self._messages)
+        self._messages = messages
+
+
+class InboundQos2State(object):
+    # mids of received QoS 2 messages which were acknowledged by PUBREC and wait for PUBREL;
+    # with path set the state is saved to file, so it survives restarts of the process
+    def __init__(self, path=None):
+        self._path = path
+        self._save_handle = None
+        data = None
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        self._mids = MidBitmap(data)
+
+    def __contains__(self, mid):
+        return mid in self._mids
+
+    def __len__(self):
+        return len(self._mids)
+
+    def add(self, mid):
+        self._mids.add(mid)
+        self._schedule_save()
+
+    def discard(self, mid):
+        self._mids.discard(mid)
+        self._schedule_save()
+
+    def clear(self):
+        self._mids.clear()
+        self._schedule_save()
+
+    def _schedule_save(self):
+        # changes made within one loop iteration are saved at once
+        if self._path and self._save_handle is None:
+            self._save_handle = asyncio.get_event_loop().call_soon(self.save)
+
+    def save(self):
+        self._save_handle = None
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._mids.to_bytes())
+        os.replace(tmp_path, self._path)
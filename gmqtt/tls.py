@@ -0,0 +1,55 @@
+import ssl
+import threading
+import time
+
+_default_context = None
+_default_context_lock = threading.Lock()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    # Client SSLContext resuming TLS sessions: session saved after successful connection to a host is
+    # offered in the next handshake with it, so the broker may skip certificate exchange and key agreement.
+    # One context may be shared by many clients, sessions are kept per server hostname.
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super(ResumingSSLContext, cls).__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        super(ResumingSSLContext, self).__init__()
+        self.sessions = {}
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        ssl_object = super(ResumingSSLContext, self).wrap_bio(
+            incoming, outgoing, server_side=server_side, server_hostname=server_hostname, session=session)
+        # asyncio wraps BIO right after TCP connection is established
+        ssl_object.handshake_started = time.monotonic()
+        return ssl_object
+
+    def save_session(self, ssl_object):
+        # with TLS 1.3 session ticket arrives after handshake, so save it when the first packet is received
+        session = ssl_object.session
+        if session is not None:
+            self.sessions[ssl_object.server_hostname] = session
+
+    def clear_sessions(self):
+        self.sessions.clear()
+
+
+def create_default_context(cafile=None, capath=None, cadata=None):
+    # the same settings as ssl.create_default_context for client side
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if cafile or capath or cadata:
+        context.load_verify_locations(cafile, capath, cadata)
+    else:
+        context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    return context
+
+
+def default_context():
+    # shared by all clients connecting with ssl=True, certificates are loaded once
+    global _default_context
+    with _default_context_lock:
+        if _default_context is None:
+            _default_context = create_default_context()
+        return _default_context
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+
+# Transport factories create the connection MQTTProtocol works over:
+#   await factory.create_connection(loop, protocol_factory, host, port, ssl=None, local_addr=None)
+# must return (transport, protocol) like loop.create_connection does.
+
+_memory_servers = {}
+
+
+class TCPTransport(object):
+    async def create_connection(self, loop, protocol_factory, host, port, ssl=None, local_addr=None):
+        return await loop.create_connection(protocol_factory, host, port, ssl=ssl, local_addr=local_addr)
+
+
+class UnixTransport(object):
+    # Unix domain socket, host is the socket path unless path is given
+    def __init__(self, path=None, server_hostname=None):
+        self.path = path
+        # TLS over unix socket needs the name to check broker certificate against
+        self.server_hostname = server_hostname
+
+    async def create_connection(self, loop, protocol_factory, host, port, ssl=None, local_addr=None):
+        return await loop.create_unix_connection(protocol_factory, self.path or host, ssl=ssl,
+                                                 server_hostname=self.server_hostname if ssl else None)
+
+
+class MemoryTransport(object):
+    # connects to MemoryServer of the same process registered with host as its name
+    async def create_connection(self, loop, protocol_factory, host, port, ssl=None, local_addr=None):
+        if ssl:
+            raise ValueError('TLS is not supported by memory transport')
+        server = _memory_servers.get(host)
+        if server is None:
+            raise ConnectionRefusedError('No memory server {}'.format(host))
+        protocol = protocol_factory()
+        return server.accept(loop, protocol), protocol
+
+
+class MemoryServer(object):
+    # In-process server for tests and benchmarks without network, e.g.
+    # MemoryServer('broker', BrokerProtocol) and client.connect('broker', transport=MemoryTransport())
+    def __init__(self, name, protocol_factory):
+        if name in _memory_servers:
+            raise ValueError('Memory server {} already exists'.format(name))
+        self.name = name
+        self._protocol_factory = protocol_factory
+        _memory_servers[name] = self
+
+    def accept(self, loop, client_protocol):
+        server_protocol = self._protocol_factory()
+        client = _MemoryStream(loop, client_protocol, self.name)
+        server = _MemoryStream(loop, server_protocol, self.name)
+        client._peer, server._peer = server, client
+        server_protocol.connection_made(server)
+        client_protocol.connection_made(client)
+        return client
+
+    def close(self):
+        if _memory_servers.get(self.name) is self:
+            del _memory_servers[self.name]
+
+
+class _MemoryStream(asyncio.Transport):
+    # one side of in-memory connection, written data is handed to the peer protocol on the next loop iteration
+    def __init__(self, loop, protocol, name):
+        super(_MemoryStream, self).__init__(extra={'peername': name, 'sockname': name})
+        self._loop = loop
+        self._protocol = protocol
+        self._peer = None
+        self._incoming = collections.deque()
+        self._flush_handle = None
+        self._paused = False
+        self._closing = False
+        self._lost = False
+
+    def get_protocol(self):
+        return self._protocol
+
+    def set_protocol(self, protocol):
+        self._protocol = protocol
+
+    def is_closing(self):
+        return self._closing
+
+    def write(self, data):
+        if self._closing or not data:
+            return
+        self._peer._feed(bytes(data))
+
+    def writelines(self, list_of_data):
+        self.write(b''.join(list_of_data))
+
+    def can_write_eof(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def get_write_buffer_limits(self):
+        return 0, 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def _feed(self, data):
+        if self._lost:
+            return
+        self._incoming.append(data)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._paused and self._flush_handle is None and self._incoming:
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        if self._paused or self._lost or not self._incoming:
+            return
+        # like TCP, everything written meanwhile arrives as one chunk
+        data = b''.join(self._incoming)
+        self._incoming.clear()
+        self._protocol.data_received(data)
+
+    def is_reading(self):
+        return not self._paused
+
+    def pause_reading(self):
+        self._paused = True
+
+    def resume_reading(self):
+        self._paused = False
+        self._schedule_flush()
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        # data already written is delivered to the peer before it learns that connection is closed
+        self._loop.call_soon(self._connection_lost)
+        self._peer._closing = True
+        self._loop.call_soon(self._peer._connection_lost)
+
+    def abort(self):
+        self._incoming.clear()
+        self.close()
+
+    def _connection_lost(self):
+        if self._lost:
+            return
+        self._flush()
+        self._lost = True
+        self._protocol.connection_lost(None)
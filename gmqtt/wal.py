@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import struct
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RECORD_ENTRY = 1
+RECORD_PROCESSED = 2
+
+
+class InboundLog(object):
+    # Append-only log of received QoS 1/2 messages. Client sends PUBACK/PUBREC for a message only after
+    # its record was fsynced, one fsync is shared by all messages received meanwhile (group commit).
+    # Message is marked as processed after on_message returns, unprocessed ones can be replayed after crash.
+    # record header: record type, sequence number, body length
+    _header = struct.Struct('!BQI')
+    # entry body header: qos, topic length, properties length
+    _entry = struct.Struct('!BHI')
+
+    def __init__(self, path, commit_interval=0.002, max_batch=1024, compact_size=16 * 1024 * 1024, executor=None):
+        self._path = path
+        self._commit_interval = commit_interval
+        self._max_batch = max_batch
+        self._compact_size = compact_size
+        self._executor = executor
+
+        self._file = open(path, 'a+b')
+        self._pending = OrderedDict()
+        self._next_seq = 1
+        self._size = self._recover()
+
+        self._batch = []
+        self._waiters = []
+        self._commit_handle = None
+        self._committing = False
+        self._closing = False
+
+        self.entries_written = 0
+        self.commits = 0
+
+    @property
+    def metrics(self):
+        return {
+            'entries_written': self.entries_written,
+            'entries_pending': len(self._pending),
+            'commits': self.commits,
+            'log_size': self._size,
+        }
+
+    def _recover(self):
+        self._file.seek(0)
+        data = self._file.read()
+        offset = 0
+        while offset + self._header.size <= len(data):
+            record_type, seq, size = self._header.unpack_from(data, offset)
+            start = offset + self._header.size
+            if start + size > len(data):
+                break
+            if record_type == RECORD_ENTRY:
+                self._pending[seq] = self._unpack_entry(data[start:start + size])
+            else:
+                self._pending.pop(seq, None)
+            self._next_seq = max(self._next_seq, seq + 1)
+            offset = start + size
+        if offset != len(data):
+            logger.warning('[INBOUND LOG] dropping %s bytes of incomplete record', len(data) - offset)
+            self._file.truncate(offset)
+        return offset
+
+    def _unpack_entry(self, body):
+        qos, topic_len, properties_len = self._entry.unpack_from(body)
+        offset = self._entry.size
+        topic = body[offset:offset + topic_len]
+        offset += topic_len
+        raw_properties = body[offset:offset + properties_len]
+        return topic, qos, raw_properties, body[offset + properties_len:]
+
+    def append(self, topic, qos, raw_properties, payload):
+        # returns sequence number of the entry and future which is done when the entry is durable
+        seq = self._next_seq
+        self._next_seq += 1
+        self._batch.append(self._pack_entry(seq, topic, qos, raw_properties, payload))
+        self._pending[seq] = (topic, qos, raw_properties, payload)
+        self.entries_written += 1
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        self._schedule_commit()
+        return seq, waiter
+
+    def _pack_entry(self, seq, topic, qos, raw_properties, payload):
+        body_size = self._entry.size + len(topic) + len(raw_properties) + len(payload)
+        return b''.join((self._header.pack(RECORD_ENTRY, seq, body_size),
+                         self._entry.pack(qos, len(topic), len(raw_properties)),
+                         topic, raw_properties, payload))
+
+    def mark_processed(self, seq):
+        if self._pending.pop(seq, None) is None:
+            return
+        # processed marks are not waited for, they are written with the next commit
+        self._batch.append(self._header.pack(RECORD_PROCESSED, seq, 0))
+        self._schedule_commit()
+
+    def replay(self):
+        # returns unprocessed entries as (seq, topic, qos, raw_properties, payload) tuples
+        return [(seq, ) + entry for seq, entry in self._pending.items()]
+
+    def _schedule_commit(self):
+        if self._committing:
+            return
+        if len(self._batch) >= self._max_batch:
+            if self._commit_handle is not None:
+                self._commit_handle.cancel()
+            self._commit()
+        elif self._commit_handle is None:
+            self._commit_handle = asyncio.get_event_loop().call_later(self._commit_interval, self._commit)
+
+    def _write(self, batch, compact):
+        if compact:
+            # log is rewritten to a new file which replaces it atomically, so a crash can't lose pending entries
+            with open(self._path + '.compact', 'wb') as f:
+                f.write(b''.join(batch))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self._path + '.compact', self._path)
+            self._file.close()
+            self._file = open(self._path, 'a+b')
+            return
+        self._file.write(b''.join(batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _commit(self):
+        self._commit_handle = None
+        if not self._batch:
+            return
+        batch, waiters = self._batch, self._waiters
+        self._batch, self._waiters = [], []
+
+        # big log is compacted: only pending entries are kept, processed ones and their marks are thrown away
+        compact = self._size >= self._compact_size
+        if compact:
+            self._size = 0
+            batch = [self._pack_entry(seq, *entry) for seq, entry in self._pending.items()]
+        self._size += sum(len(record) for record in batch)
+
+        self._committing = True
+        future = asyncio.get_event_loop().run_in_executor(self._executor, self._write, batch, compact)
+        future.add_done_callback(lambda f: self._committed(f, waiters))
+
+    def _committed(self, future, waiters):
+        self._committing = False
+        self.commits += 1
+        exc = future.exception()
+        if exc is not None:
+            logger.error('[INBOUND LOG] commit failed', exc_info=exc)
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is not None:
+                waiter.set_exception(exc)
+            else:
+                waiter.set_result(None)
+        if self._closing:
+            self._close()
+        elif self._batch:
+            self._schedule_commit()
+
+    def close(self):
+        # commit running in executor is finished first, the rest of the batch is written after it
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        self._closing = True
+        if not self._committing:
+            self._close()
+
+    def _close(self):
+        if self._batch:
+            batch, waiters = self._batch, self._waiters
+            self._batch, self._waiters = [], []
+            try:
+                self._write(batch, False)
+            except OSError as exc:
+                logger.error('[INBOUND LOG] commit failed', exc_info=exc)
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(exc)
+            else:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+        self._file.close()
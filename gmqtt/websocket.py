@@ -0,0 +1,489 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import logging
+import os
+import struct
+import zlib
+
+from .transports import TCPTransport
+
+logger = logging.getLogger(__name__)
+
+# MQTT over WebSocket (RFC 6455) with permessage-deflate extension (RFC 7692). MQTT stream is carried in
+# binary messages: one write of MQTT protocol is sent as one message (optionally split into several frames),
+# received messages are fed to MQTT protocol as a byte stream, so packets may span messages and one
+# message may hold several packets.
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED_DATA = 1003
+CLOSE_TOO_BIG = 1009
+
+_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# permessage-deflate strips the end of sync flush block from every message
+_DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+Frame = collections.namedtuple('Frame', ['fin', 'rsv1', 'opcode', 'payload'])
+
+
+class WebSocketError(ConnectionError):
+    pass
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + _GUID).digest()).decode('ascii')
+
+
+def apply_mask(data, mask):
+    # xor of the whole payload as one big integer is much faster than byte by byte loop
+    size = len(data)
+    if not size:
+        return b''
+    mask = (mask * (size // 4 + 1))[:size]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(size, 'big')
+
+
+def encode_frame(opcode, payload, fin=True, rsv1=False, mask=True):
+    # frames sent by client must be masked, frames sent by server must not
+    head = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+    size = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if size < 126:
+        header = struct.pack('!BB', head, mask_bit | size)
+    elif size < 65536:
+        header = struct.pack('!BBH', head, mask_bit | 126, size)
+    else:
+        header = struct.pack('!BBQ', head, mask_bit | 127, size)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + apply_mask(payload, key)
+
+
+class FrameParser(object):
+    def __init__(self, max_size=2 ** 28):
+        self._buffer = bytearray()
+        self._max_size = max_size
+
+    def feed(self, data):
+        # returns complete frames, the rest of data waits for the next call
+        self._buffer += data
+        frames = []
+        buf = self._buffer
+        offset = 0
+        while len(buf) - offset >= 2:
+            head, size = buf[offset], buf[offset + 1]
+            masked, size = size & 0x80, size & 0x7F
+            header_size = 2
+            if size == 126:
+                if len(buf) - offset < 4:
+                    break
+                (size, ) = struct.unpack_from('!H', buf, offset + 2)
+                header_size = 4
+            elif size == 127:
+                if len(buf) - offset < 10:
+                    break
+                (size, ) = struct.unpack_from('!Q', buf, offset + 2)
+                header_size = 10
+            if size > self._max_size:
+                raise WebSocketError('Frame of {} bytes is too big'.format(size))
+            start = offset + header_size + (4 if masked else 0)
+            if len(buf) < start + size:
+                break
+            payload = bytes(buf[start:start + size])
+            if masked:
+                payload = apply_mask(payload, bytes(buf[start - 4:start]))
+            frames.append(Frame(bool(head & 0x80), bool(head & 0x40), head & 0x0F, payload))
+            offset = start + size
+        del buf[:offset]
+        return frames
+
+
+class PerMessageDeflate(object):
+    # Compression state of one side of connection. With context takeover (default) the compression window
+    # is kept between messages, which is what makes small similar messages like JSON telemetry compress well.
+    def __init__(self, compress_window_bits=15, decompress_window_bits=15, compress_no_context_takeover=False,
+                 decompress_no_context_takeover=False, level=6, threshold=64, max_size=2 ** 28):
+        self.compress_window_bits = compress_window_bits
+        self.decompress_window_bits = decompress_window_bits
+        self.compress_no_context_takeover = compress_no_context_takeover
+        self.decompress_no_context_takeover = decompress_no_context_takeover
+        self.level = level
+        # smaller messages (e.g. PINGREQ) are sent uncompressed, extension allows it per message
+        self.threshold = threshold
+        self._max_size = max_size
+        self._compressor = None
+        self._decompressor = None
+
+    def compress(self, data):
+        # returns None if the message should be sent uncompressed
+        if len(data) < self.threshold:
+            return None
+        if self._compressor is None or self.compress_no_context_takeover:
+            self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, -self.compress_window_bits)
+        data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data[:-4] if data.endswith(_DEFLATE_TAIL) else data
+
+    def decompress(self, data):
+        if self._decompressor is None or self.decompress_no_context_takeover:
+            self._decompressor = zlib.decompressobj(-self.decompress_window_bits)
+        data = self._decompressor.decompress(data + _DEFLATE_TAIL, self._max_size)
+        if self._decompressor.unconsumed_tail:
+            raise WebSocketError('Decompressed message exceeds {} bytes'.format(self._max_size))
+        return data
+
+
+def parse_extensions(header):
+    # 'permessage-deflate; client_max_window_bits=10, x-ext' -> [('permessage-deflate', {...}), ('x-ext', {})]
+    extensions = []
+    for item in header.split(','):
+        parts = [part.strip() for part in item.split(';')]
+        if not parts[0]:
+            continue
+        params = {}
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            params[name.strip().lower()] = value.strip().strip('"') or None
+        extensions.append((parts[0].lower(), params))
+    return extensions
+
+
+def _deflate_from_params(params, is_client, level, threshold, max_size):
+    # parameters are named after the side: client_* describe what client sends, server_* what server sends
+    own, peer = ('client', 'server') if is_client else ('server', 'client')
+    compress_bits = params.get(own + '_max_window_bits')
+    decompress_bits = params.get(peer + '_max_window_bits')
+    return PerMessageDeflate(
+        # zlib does not support raw deflate with 8 bits window
+        compress_window_bits=max(9, int(compress_bits)) if compress_bits else 15,
+        decompress_window_bits=int(decompress_bits) if decompress_bits else 15,
+        compress_no_context_takeover=own + '_no_context_takeover' in params,
+        decompress_no_context_takeover=peer + '_no_context_takeover' in params,
+        level=level, threshold=threshold, max_size=max_size)
+
+
+def _parse_http_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        headers[name] = headers[name] + ', ' + value.strip() if name in headers else value.strip()
+    return lines[0], headers
+
+
+class WebSocketProtocol(asyncio.Protocol):
+    # Raw side of WebSocket connection: makes the opening handshake and then translates between frames
+    # and the byte stream of the application protocol, which sees WebSocketStream as its transport.
+    # Works as client (WebSocketTransport uses it) and as server (for tests and stand-in brokers).
+    def __init__(self, protocol_factory, is_client=True, host='localhost', path='/mqtt', headers=None,
+                 compression=True, compression_level=6, compression_threshold=64, max_frame_size=None,
+                 max_message_size=2 ** 28, handshake=None):
+        self._protocol_factory = protocol_factory
+        self.is_client = is_client
+        self._host = host
+        self._path = path
+        self._headers = headers or {}
+        self._compression = compression
+        self._compression_level = compression_level
+        self._compression_threshold = compression_threshold
+        self._max_frame_size = max_frame_size
+        self._max_message_size = max_message_size
+        self._handshake = handshake
+
+        self.raw_transport = None
+        self.stream = None
+        self.protocol = None
+        self.deflate = None
+        self._key = None
+        self._head = b''
+        self._parser = FrameParser(max_message_size)
+        self._fragments = []
+        self._fragments_compressed = False
+        self._close_sent = False
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.payload_bytes_sent = 0
+        self.payload_bytes_received = 0
+
+    @property
+    def metrics(self):
+        return {
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'payload_bytes_sent': self.payload_bytes_sent,
+            'payload_bytes_received': self.payload_bytes_received,
+        }
+
+    def connection_made(self, transport):
+        self.raw_transport = transport
+        if self.is_client:
+            self._key = base64.b64encode(os.urandom(16)).decode('ascii')
+            headers = [('Host', self._host), ('Upgrade', 'websocket'), ('Connection', 'Upgrade'),
+                       ('Sec-WebSocket-Key', self._key), ('Sec-WebSocket-Version', '13'),
+                       ('Sec-WebSocket-Protocol', 'mqtt')]
+            if self._compression:
+                headers.append(('Sec-WebSocket-Extensions', 'permessage-deflate; client_max_window_bits'))
+            headers.extend(self._headers.items())
+            self._write_raw('GET {} HTTP/1.1\r\n{}\r\n\r\n'.format(
+                self._path, '\r\n'.join('{}: {}'.format(*header) for header in headers)).encode('latin-1'))
+
+    def _write_raw(self, data):
+        self.bytes_sent += len(data)
+        self.raw_transport.write(data)
+
+    def _fail_handshake(self, message):
+        logger.warning('[WEBSOCKET] handshake failed: %s', message)
+        if self._handshake is not None and not self._handshake.done():
+            self._handshake.set_exception(WebSocketError(message))
+        self.raw_transport.close()
+
+    def _open(self, deflate_params):
+        if deflate_params is not None:
+            self.deflate = _deflate_from_params(deflate_params, self.is_client, self._compression_level,
+                                                self._compression_threshold, self._max_message_size)
+        self.stream = WebSocketStream(self)
+        self.protocol = self._protocol_factory()
+        self.protocol.connection_made(self.stream)
+        if self._handshake is not None and not self._handshake.done():
+            self._handshake.set_result(None)
+
+    def _deflate_offer(self, headers):
+        for name, params in parse_extensions(headers.get('sec-websocket-extensions', '')):
+            if name == 'permessage-deflate':
+                return params
+        return None
+
+    def _handle_response(self, status, headers):
+        if status.split(' ')[1:2] != ['101']:
+            return self._fail_handshake('unexpected response "{}"'.format(status))
+        if headers.get('upgrade', '').lower() != 'websocket' or \
+                headers.get('sec-websocket-accept') != accept_key(self._key):
+            return self._fail_handshake('invalid upgrade response')
+        if headers.get('sec-websocket-protocol', 'mqtt') != 'mqtt':
+            return self._fail_handshake('server selected subprotocol {}'.format(headers['sec-websocket-protocol']))
+        params = self._deflate_offer(headers)
+        if params is not None and not self._compression:
+            return self._fail_handshake('server enabled compression which was not offered')
+        self._open(params)
+
+    def _handle_request(self, request, headers):
+        key = headers.get('sec-websocket-key')
+        if not request.startswith('GET ') or headers.get('upgrade', '').lower() != 'websocket' or not key:
+            self._write_raw(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return self._fail_handshake('invalid upgrade request')
+        response = ['HTTP/1.1 101 Switching Protocols', 'Upgrade: websocket', 'Connection: Upgrade',
+                    'Sec-WebSocket-Accept: ' + accept_key(key)]
+        if 'mqtt' in [protocol.strip() for protocol in headers.get('sec-websocket-protocol', '').split(',')]:
+            response.append('Sec-WebSocket-Protocol: mqtt')
+        params = self._deflate_offer(headers) if self._compression else None
+        if params is not None:
+            # client window is left as client asked, server uses the default one
+            params = {name: value for name, value in params.items() if name != 'client_max_window_bits'}
+            response.append('Sec-WebSocket-Extensions: ' + '; '.join(
+                ['permessage-deflate'] + [name if value is None else '{}={}'.format(name, value)
+                                          for name, value in params.items()]))
+        self._write_raw(('\r\n'.join(response) + '\r\n\r\n').encode('latin-1'))
+        self._open(params)
+
+    def data_received(self, data):
+        self.bytes_received += len(data)
+        if self.stream is None:
+            self._head += data
+            if b'\r\n\r\n' not in self._head:
+                if len(self._head) > 65536:
+                    self._fail_handshake('too long HTTP head')
+                return
+            head, data = self._head.split(b'\r\n\r\n', 1)
+            self._head = b''
+            first_line, headers = _parse_http_head(head)
+            if self.is_client:
+                self._handle_response(first_line, headers)
+            else:
+                self._handle_request(first_line, headers)
+            if self.stream is None or not data:
+                return
+        try:
+            frames = self._parser.feed(data)
+        except WebSocketError as exc:
+            return self.fail(CLOSE_TOO_BIG, str(exc))
+        for frame in frames:
+            self._handle_frame(frame)
+
+    def _handle_frame(self, frame):
+        if frame.opcode >= OP_CLOSE:
+            if frame.opcode == OP_PING:
+                self._send_frame(OP_PONG, frame.payload)
+            elif frame.opcode == OP_CLOSE:
+                if not self._close_sent:
+                    self._send_frame(OP_CLOSE, frame.payload[:2])
+                    self._close_sent = True
+                self.raw_transport.close()
+            return
+        if frame.opcode == OP_CONTINUATION:
+            if not self._fragments:
+                return self.fail(CLOSE_PROTOCOL_ERROR, 'unexpected continuation frame')
+        elif frame.opcode != OP_BINARY:
+            # MQTT must be carried in binary messages only
+            return self.fail(CLOSE_UNSUPPORTED_DATA, 'unexpected frame opcode {}'.format(frame.opcode))
+        elif self._fragments:
+            return self.fail(CLOSE_PROTOCOL_ERROR, 'new message started before previous one was finished')
+        else:
+            self._fragments_compressed = frame.rsv1
+            if frame.rsv1 and self.deflate is None:
+                return self.fail(CLOSE_PROTOCOL_ERROR, 'compressed frame without negotiated extension')
+        self._fragments.append(frame.payload)
+        if not frame.fin:
+            return
+
+        message = b''.join(self._fragments) if len(self._fragments) > 1 else self._fragments[0]
+        self._fragments = []
+        if self._fragments_compressed:
+            try:
+                message = self.deflate.decompress(message)
+            except (zlib.error, WebSocketError) as exc:
+                return self.fail(CLOSE_TOO_BIG, 'could not decompress message: {}'.format(exc))
+        self.payload_bytes_received += len(message)
+        if message and not self.stream.is_closing():
+            self.protocol.data_received(message)
+
+    def _send_frame(self, opcode, payload, fin=True, rsv1=False):
+        self._write_raw(encode_frame(opcode, payload, fin=fin, rsv1=rsv1, mask=self.is_client))
+
+    def send_message(self, data):
+        self.payload_bytes_sent += len(data)
+        compressed = self.deflate.compress(data) if self.deflate is not None else None
+        if compressed is not None:
+            data = compressed
+        if not self._max_frame_size or len(data) <= self._max_frame_size:
+            return self._send_frame(OP_BINARY, data, rsv1=compressed is not None)
+        step = self._max_frame_size
+        chunks = [data[i:i + step] for i in range(0, len(data), step)]
+        for i, chunk in enumerate(chunks):
+            self._send_frame(OP_BINARY if i == 0 else OP_CONTINUATION, chunk, fin=i == len(chunks) - 1,
+                             rsv1=i == 0 and compressed is not None)
+
+    def close(self, code=CLOSE_NORMAL, reason=''):
+        if not self._close_sent and not self.raw_transport.is_closing():
+            self._send_frame(OP_CLOSE, struct.pack('!H', code) + reason.encode('utf-8')[:123])
+            self._close_sent = True
+        self.raw_transport.close()
+
+    def fail(self, code, reason):
+        logger.warning('[WEBSOCKET] closing connection: %s', reason)
+        self.close(code, reason)
+
+    def pause_writing(self):
+        if self.protocol is not None:
+            self.protocol.pause_writing()
+
+    def resume_writing(self):
+        if self.protocol is not None:
+            self.protocol.resume_writing()
+
+    def connection_lost(self, exc):
+        if self._handshake is not None and not self._handshake.done():
+            self._handshake.set_exception(exc or WebSocketError('Connection closed during handshake'))
+        if self.protocol is not None:
+            self.stream._closing = True
+            self.protocol.connection_lost(exc)
+
+
+class WebSocketStream(asyncio.Transport):
+    # transport given to the application protocol, every write is sent as one binary message
+    def __init__(self, websocket):
+        super(WebSocketStream, self).__init__()
+        self._websocket = websocket
+        self._closing = False
+
+    def get_extra_info(self, name, default=None):
+        if name == 'websocket':
+            return self._websocket
+        return self._websocket.raw_transport.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self._closing or self._websocket.raw_transport.is_closing()
+
+    def write(self, data):
+        if data and not self.is_closing():
+            self._websocket.send_message(bytes(data))
+
+    def writelines(self, list_of_data):
+        self.write(b''.join(list_of_data))
+
+    def can_write_eof(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return self._websocket.raw_transport.get_write_buffer_size()
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self._websocket.raw_transport.set_write_buffer_limits(high, low)
+
+    def is_reading(self):
+        return self._websocket.raw_transport.is_reading()
+
+    def pause_reading(self):
+        self._websocket.raw_transport.pause_reading()
+
+    def resume_reading(self):
+        self._websocket.raw_transport.resume_reading()
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._websocket.close()
+
+    def abort(self):
+        self._closing = True
+        self._websocket.raw_transport.abort()
+
+
+class WebSocketTransport(object):
+    # Transport factory for Client.connect: MQTT over WebSocket on top of another transport (TCP by default),
+    # with ssl it is "wss". permessage-deflate is offered unless compression is False.
+    def __init__(self, path='/mqtt', headers=None, compression=True, compression_level=6, compression_threshold=64,
+                 max_frame_size=None, handshake_timeout=10, transport=None):
+        self.path = path
+        self.headers = headers
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threshold = compression_threshold
+        self.max_frame_size = max_frame_size
+        self.handshake_timeout = handshake_timeout
+        self._transport = transport or TCPTransport()
+
+    async def create_connection(self, loop, protocol_factory, host, port, ssl=None, local_addr=None):
+        handshake = loop.create_future()
+        host_header = '[{}]'.format(host) if ':' in host else host
+        if port:
+            host_header += ':{}'.format(port)
+
+        def websocket_factory():
+            return WebSocketProtocol(
+                protocol_factory, is_client=True, host=host_header, path=self.path,
+                headers=self.headers, compression=self.compression, compression_level=self.compression_level,
+                compression_threshold=self.compression_threshold, max_frame_size=self.max_frame_size,
+                handshake=handshake)
+
+        raw_transport, websocket = await self._transport.create_connection(
+            loop, websocket_factory, host, port, ssl=ssl, local_addr=local_addr)
+        try:
+            await asyncio.wait_for(handshake, self.handshake_timeout)
+        except asyncio.TimeoutError:
+            raw_transport.abort()
+            raise WebSocketError('No handshake response in {} seconds'.format(self.handshake_timeout))
+        except OSError:
+            raw_transport.abort()
+            raise
+        return websocket.stream, websocket.protocol
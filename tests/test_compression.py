@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import zlib
+
+import pytest
+
+import gmqtt
+from gmqtt.compression import PayloadCompression, ZlibCodec, TAG_CONTENT_TYPE
+from gmqtt.mqtt.constants import MQTTCommands
+from gmqtt.mqtt.package import PublishPacket
+from gmqtt.mqtt.protocol import MQTTProtocol
+from gmqtt.mqtt.utils import unpack_variable_byte_integer
+from gmqtt.storage import BoundedPersistentStorage, StorageFullError, OVERFLOW_REJECT
+
+from tests.test_reconnect import PipelineConnection
+
+TELEMETRY = json.dumps([{'device': 'sensor-{}'.format(i), 'temperature': 21.5, 'status': 'ok'} for i in range(50)])
+
+
+def test_compress_and_tag():
+    compression = PayloadCompression(threshold=100)
+    original = gmqtt.Message('t', TELEMETRY, user_property=('a', 'b'))
+    message = compression.compress(original)
+    # message of the caller is not changed
+    assert original.payload == TELEMETRY.encode() and original.properties == {'user_property': ('a', 'b')}
+    assert message.properties['user_property'] == [('a', 'b'), ('content-encoding', 'deflate')]
+    assert zlib.decompress(message.payload) == TELEMETRY.encode()
+    assert compression.metrics['bytes_after'] * 5 < compression.metrics['bytes_before']
+
+    # random bytes do not compress, they are sent as is
+    message = gmqtt.Message('t', os.urandom(512))
+    assert compression.compress(message) is message
+    assert 'user_property' not in message.properties
+
+    compression = PayloadCompression(threshold=100, tag=TAG_CONTENT_TYPE)
+    message = compression.compress(gmqtt.Message('t', TELEMETRY, content_type='application/json'))
+    assert message.properties['content_type'] == ZlibCodec.content_type
+    assert compression.decompress(message.payload, {'content_type': [ZlibCodec.content_type]}) == TELEMETRY.encode()
+
+
+@pytest.mark.asyncio
+async def test_offloaded_compression_keeps_order():
+    client = gmqtt.Client('compression', payload_compression=PayloadCompression(threshold=100,
+                                                                               offload_threshold=1000))
+    connection = client._connection = PipelineConnection()
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+    sent = []
+    client._store_message = lambda message, mid, package: sent.append(message.payload)
+
+    large = gmqtt.Message('t', TELEMETRY * 10)
+    client.publish(large)
+    client.publish('t', 'small')
+    assert sent == []
+    await asyncio.sleep(0.1)
+    assert sent[1] == b'small' and zlib.decompress(sent[0]) == TELEMETRY.encode() * 10
+    assert client.metrics['compression_messages_offloaded'] == 1
+    assert large.payload == TELEMETRY.encode() * 10 and large.properties == {}
+
+
+@pytest.mark.asyncio
+async def test_received_payload_decompressed():
+    received = []
+    client = gmqtt.Client('compression', payload_compression=PayloadCompression())
+    client.on_message = lambda client, topic, payload, qos, properties: received.append(payload)
+    client._connection = PipelineConnection()
+
+    message = gmqtt.Message('t', zlib.compress(TELEMETRY.encode()), user_property=('content-encoding', 'deflate'))
+    _, package = PublishPacket.build_package(message, MQTTProtocol)
+    _, packet = unpack_variable_byte_integer(bytes(package[1:]))
+    client(MQTTCommands.PUBLISH, packet)
+    await asyncio.sleep(0)
+    assert received == [TELEMETRY.encode()]
+    assert client.metrics['compression_messages_decompressed'] == 1
+
+
+def test_decompressed_size_limited():
+    codec = ZlibCodec(max_size=1024)
+    assert codec.decompress(zlib.compress(b'x' * 1024)) == b'x' * 1024
+    with pytest.raises(ValueError):
+        codec.decompress(zlib.compress(b'x' * 1025))
+    with pytest.raises(ValueError):
+        codec.decompress(zlib.compress(b'x' * 1024)[:-4])
+
+    received = []
+    client = gmqtt.Client('compression', payload_compression=PayloadCompression(codec=codec))
+    client.on_message = lambda client, topic, payload, qos, properties: received.append(payload)
+    client._connection = PipelineConnection()
+    bomb = zlib.compress(bytes(10 * 1024 * 1024))
+    message = gmqtt.Message('t', bomb, user_property=('content-encoding', 'deflate'))
+    _, package = PublishPacket.build_package(message, MQTTProtocol)
+    _, packet = unpack_variable_byte_integer(bytes(package[1:]))
+    client(MQTTCommands.PUBLISH, packet)
+    # payload is not expanded, on_message gets it as received
+    assert received == [bomb]
+    assert client.metrics['compression_messages_decompressed'] == 0
+
+
+def test_published_message_not_changed():
+    client = gmqtt.Client('compression', payload_compression=PayloadCompression(threshold=100))
+    connection = client._connection = PipelineConnection()
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+    sent = []
+    client._store_message = lambda message, mid, package: sent.append(message)
+
+    message = gmqtt.Message('t', TELEMETRY, qos=1)
+    client.publish(message)
+    client.publish(message)
+    assert len(sent) == 2 and all(zlib.decompress(m.payload) == TELEMETRY.encode() for m in sent)
+    assert sent[0] is not message and message.payload == TELEMETRY.encode() and message.properties == {}
+
+
+def test_full_storage_rejects_compressed_publish():
+    storage = BoundedPersistentStorage(max_messages=1, policy=OVERFLOW_REJECT)
+    client = gmqtt.Client('compression', payload_compression=PayloadCompression(threshold=100),
+                          persistent_storage=storage)
+    connection = client._connection = PipelineConnection()
+    connection.id_generator = client._id_generator
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+
+    client.publish('t', TELEMETRY, qos=1)
+    with pytest.raises(StorageFullError):
+        client.publish('t', TELEMETRY, qos=1)
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from gmqtt.fleet import ClientFleet
+from gmqtt.mqtt.timer_wheel import TimerWheel
+from gmqtt.transports import MemoryServer, MemoryTransport
+
+from tests.test_transports import AckingBroker
+
+
+@pytest.mark.asyncio
+async def test_fleet_connect_publish_disconnect():
+    server = MemoryServer('fleet-broker', AckingBroker)
+    fleet = ClientFleet(['device-{}'.format(i) for i in range(20)], connect_rate=1000,
+                        config={'reconnect_delay': 30, 'backoff': {'base': 1}})
+    await fleet.connect('fleet-broker', transport=MemoryTransport())
+    assert fleet.metrics['connected'] == 20 and fleet.metrics['connect_failed'] == 0
+
+    clients = list(fleet)
+    # every client allocates its own packet identifiers
+    assert clients[0]._id_generator is not clients[1]._id_generator
+    for client in clients:
+        fleet.publish(client._client_id, 't', b'x', qos=1)
+    await asyncio.wait_for(asyncio.gather(*(client._persistent_storage.wait_empty() for client in clients)), 5)
+
+    assert all(client._config['reconnect_delay'] == 30 for client in clients)
+    assert clients[0]._config['backoff'] is not clients[1]._config['backoff']
+    assert fleet.storage('device-3') is fleet['device-3']._persistent_storage
+
+    await fleet.disconnect()
+    assert fleet._timer_wheel._handle is None
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_fleet_leaves_shared_timer_wheel_running():
+    server = MemoryServer('fleet-wheel-broker', AckingBroker)
+    wheel = TimerWheel(tick=0.01)
+    fired = []
+    wheel.call_later(0.05, fired.append, True)
+    fleet = ClientFleet(['a', 'b'], timer_wheel=wheel)
+    await fleet.connect('fleet-wheel-broker', transport=MemoryTransport())
+    await fleet.disconnect()
+    await asyncio.sleep(0.1)
+    assert fired == [True]
+    server.close()
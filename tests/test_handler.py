@@ -0,0 +1,50 @@
+import struct
+
+import pytest
+
+import gmqtt
+from gmqtt.mqtt.constants import MQTTCommands
+from gmqtt.storage import InboundQos2State
+
+
+def publish_packet(topic, payload, qos, mid, dup=False):
+    cmd = MQTTCommands.PUBLISH | (dup << 3) | (qos << 1)
+    packet = struct.pack('!H', len(topic)) + topic + struct.pack('!H', mid) + b'\x00' + payload
+    return cmd, packet
+
+
+@pytest.fixture
+def client():
+    client = gmqtt.Client('handler-test')
+    client.messages = []
+    client.sent = []
+    client.on_message = lambda cl, topic, payload, qos, properties: client.messages.append((topic, payload, qos))
+    client._send_command_with_mid = lambda cmd, mid, dup, reason_code=0: client.sent.append((cmd & 0xF0, mid))
+    return client
+
+
+def test_qos2_duplicates_suppressed_until_pubrel(client):
+    client(*publish_packet(b'a', b'1', 2, 10))
+    client(*publish_packet(b'a', b'1', 2, 10, dup=True))
+    assert client.messages == [('a', b'1', 2)]
+    assert client.sent == [(MQTTCommands.PUBREC, 10), (MQTTCommands.PUBREC, 10)]
+
+    client(MQTTCommands.PUBREL | 2, struct.pack('!HB', 10, 0))
+    assert 10 not in client._inbound_qos2
+    client(*publish_packet(b'a', b'2', 2, 10))
+    assert client.messages == [('a', b'1', 2), ('a', b'2', 2)]
+
+
+@pytest.mark.asyncio
+async def test_qos2_state_persistence(tmp_path):
+    path = str(tmp_path / 'qos2')
+    state = InboundQos2State(path)
+    state.add(1)
+    state.add(65535)
+    state.add(300)
+    state.discard(300)
+    state.save()
+
+    state = InboundQos2State(path)
+    assert 1 in state and 65535 in state and 300 not in state
+    assert len(state) == 2
@@ -0,0 +1,99 @@
+import asyncio
+import zlib
+
+import pytest
+
+import gmqtt
+from gmqtt.compression import PayloadCompression
+from gmqtt.mqtt.constants import MQTTCommands
+from gmqtt.mqtt.package import PublishPacket
+from gmqtt.mqtt.protocol import MQTTProtocol
+from gmqtt.mqtt.utils import unpack_variable_byte_integer
+from gmqtt.wal import InboundLog
+
+
+def received(message):
+    _, package = PublishPacket.build_package(message, MQTTProtocol)
+    _, packet = unpack_variable_byte_integer(bytes(package[1:]))
+    return package[0], packet, bytes(package)
+
+
+def view_client(**kwargs):
+    client = gmqtt.Client('incoming', **kwargs)
+    client.views = []
+    client.sent = []
+    client.on_message = lambda *args: pytest.fail('on_message must not be called')
+    client.on_message_view = lambda client, message: client.views.append(message)
+    client._send_command_with_mid = lambda cmd, mid, dup, reason_code=0: client.sent.append((cmd & 0xF0, mid))
+    return client
+
+
+def test_message_view_is_lazy():
+    client = view_client()
+    cmd, packet, frame = received(gmqtt.Message('site/1', b'payload', qos=1, retain=True, content_type='text/plain'))
+    client(cmd, packet)
+
+    message, = client.views
+    assert client.sent == [(MQTTCommands.PUBACK, message.mid)]
+    assert message._properties is None and message._payload is None
+    assert (message.qos, message.retain, message.dup) == (1, True, False)
+    assert bytes(message.payload_view) == b'payload'
+    assert message._payload is None
+    assert message.topic == 'site/1' and message.properties == {'content_type': ['text/plain']}
+    assert message.payload == b'payload'
+
+    # received packet is forwarded as is
+    assert message.fixed_header + message.raw == frame
+    message.release()
+    assert message.payload == b'payload'
+    with pytest.raises(ValueError):
+        message.raw
+
+
+def test_message_view_topic_alias_and_duplicates():
+    client = view_client(topic_alias_maximum=10)
+    qos2 = received(gmqtt.Message('site/1', b'1', qos=2, topic_alias=3))[:2]
+    client(*qos2)
+    cmd, packet, _ = received(gmqtt.Message('', b'2', topic_alias=3))
+    client(cmd, packet)
+    assert [(m.topic, m.payload) for m in client.views] == [('site/1', b'1'), ('site/1', b'2')]
+
+    # QoS 2 message is not delivered again until PUBREL
+    mid = client.views[0].mid
+    client(*qos2)
+    assert len(client.views) == 2
+    assert client.sent == [(MQTTCommands.PUBREC, mid), (MQTTCommands.PUBREC, mid)]
+
+
+@pytest.mark.asyncio
+async def test_message_view_decodes_payload():
+    client = view_client(payload_compression=PayloadCompression())
+    messages = []
+
+    async def on_message_view(client, message):
+        messages.append(message.payload)
+
+    client.on_message_view = on_message_view
+    client(*received(gmqtt.Message('t', zlib.compress(b'x' * 100), user_property=('content-encoding', 'deflate')))[:2])
+    await asyncio.sleep(0)
+    assert messages == [b'x' * 100]
+
+
+def test_message_view_not_used_with_inbound_log(tmp_path):
+    log = InboundLog(str(tmp_path / 'inbound.log'))
+    client = gmqtt.Client('view-log', inbound_log=log)
+    with pytest.raises(ValueError):
+        client.on_message_view = lambda client, message: 0
+    assert client.on_message_view is None
+    client.on_message_view = None
+    log.close()
+
+
+def test_message_view_not_used_with_inbound_sink():
+    class Sink:
+        def set_flow_control(self, pause, resume):
+            pass
+
+    client = gmqtt.Client('view-sink', inbound_sink=Sink())
+    with pytest.raises(ValueError):
+        client.on_message_view = lambda client, message: 0
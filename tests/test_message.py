@@ -0,0 +1,52 @@
+import array
+import pickle
+
+import pytest
+
+import gmqtt
+from gmqtt.mqtt.package import PublishPacket
+from gmqtt.mqtt.protocol import MQTTProtocol
+from gmqtt.storage import OfflineQueue
+
+
+def test_message_is_compact():
+    first = gmqtt.Message('site/1/telemetry', b'1')
+    second = gmqtt.Message('site/1/telemetry', b'2')
+    assert first.topic is second.topic
+    assert not hasattr(first, '__dict__')
+    assert not hasattr(gmqtt.Subscription('a/#'), '__dict__')
+
+
+def test_buffer_payload_is_not_copied():
+    buffer = bytearray(b'abcd')
+    message = gmqtt.Message('t', buffer)
+    assert isinstance(message.payload, memoryview)
+    buffer[0] = ord('x')
+    _, package = PublishPacket.build_package(message, MQTTProtocol)
+    assert package.endswith(b'xbcd')
+
+    message = gmqtt.Message('t', array.array('H', [1, 2]))
+    assert message.payload_size == 4 and message.payload.format == 'B'
+
+    restored = pickle.loads(pickle.dumps(message))
+    assert restored.payload == message.payload and restored.topic == b't'
+
+
+def test_frozen_message():
+    message = gmqtt.FrozenMessage('t', {'value': 1}, qos=1, serializer='json', message_expiry_interval=60)
+    assert message.payload == b'{"value": 1}'
+    with pytest.raises(AttributeError):
+        message.qos = 2
+    with pytest.raises(TypeError):
+        message.properties['content_type'] = 'text/plain'
+    assert pickle.loads(pickle.dumps(message)).frozen
+
+    copy = message.copy()
+    copy.qos = 2
+    assert not copy.frozen and copy.payload is message.payload and message.qos == 1
+
+    # offline queue decreases expiry interval of the copy, the frozen message stays as is
+    queue = OfflineQueue()
+    queue.put(message)
+    taken, = queue.take_all()
+    assert taken is not message and taken.properties['message_expiry_interval'] == 60
@@ -0,0 +1,128 @@
+import asyncio
+import struct
+
+import pytest
+
+import gmqtt
+from gmqtt.pool import ClientPool
+from gmqtt.transports import MemoryServer, MemoryTransport
+
+from tests.test_transports import AckingBroker
+
+
+class FakeClient:
+    # routing needs only client id, connection state and publish
+    def __init__(self, client_id):
+        self._client_id = client_id
+        self.connected = True
+        self.published = []
+        self.on_connect = self.on_disconnect = None
+
+    @property
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, message):
+        self.published.append(message)
+
+
+class SubscribingBroker(AckingBroker):
+    # also answers SUBSCRIBE and UNSUBSCRIBE, keeps topics by client transport
+    topics = {}
+
+    def data_received(self, data):
+        rest = data
+        while rest:
+            cmd, length, offset = rest[0], 0, 1
+            while True:
+                length += (rest[offset] & 0x7F) << (7 * (offset - 1))
+                offset += 1
+                if not rest[offset - 1] & 0x80:
+                    break
+            packet, rest = rest[offset:offset + length], rest[offset + length:]
+            if cmd in (0x82, 0xA2):
+                # packet identifier and empty properties
+                position = 3
+                while position < len(packet):
+                    (topic_len, ) = struct.unpack_from('!H', packet, position)
+                    topic = packet[position + 2:position + 2 + topic_len].decode()
+                    position += 2 + topic_len + (1 if cmd == 0x82 else 0)
+                    self.topics.setdefault(self.transport._peer, []).append((cmd, topic))
+                ack = 0x90 if cmd == 0x82 else 0xB0
+                self.transport.write(bytes([ack, 4]) + packet[:2] + b'\x00\x00')
+        super(SubscribingBroker, self).data_received(data)
+
+
+def broker_topics(client):
+    return SubscribingBroker.topics.get(client._connection._transport, [])
+
+
+async def wait_for(condition, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_pool_routes_by_key():
+    clients = [FakeClient('publisher-{}'.format(i)) for i in range(4)]
+    pool = ClientPool(clients)
+
+    client = pool.client_for('device-1')
+    assert all(pool.client_for('device-1') is client for _ in range(10))
+    assert len({pool.client_for('device-{}'.format(i)) for i in range(100)}) == 4
+
+    pool.publish('telemetry', b'x', qos=1, key='device-1')
+    assert [message.topic for message in client.published] == [b'telemetry']
+
+    # keys of disconnected client move to the next connected one, and back when it is connected again
+    client.connected = False
+    other = pool.client_for('device-1')
+    assert other is not client and other.is_connected
+    assert pool.rebalanced == 1
+    pool.publish('telemetry', b'y', qos=1, key='device-1')
+    assert len(other.published) == 1
+    client.connected = True
+    assert pool.client_for('device-1') is client
+
+    assert ClientPool(clients, rebalance=False).client_for('device-1') is client
+    with pytest.raises(ValueError):
+        ClientPool([])
+
+
+@pytest.mark.asyncio
+async def test_pool_moves_subscriptions_on_connection_loss():
+    server = MemoryServer('pool-sub-broker', SubscribingBroker)
+    connects = []
+    clients = [gmqtt.Client('subscriber-{}'.format(i)) for i in range(3)]
+    clients[0].on_connect = lambda client, flags, rc, properties: connects.append(client)
+    clients[0].set_config({'reconnect_delay': 0})
+    pool = ClientPool(clients)
+    await pool.connect('pool-sub-broker', transport=MemoryTransport())
+    assert connects == [clients[0]]
+
+    pool.subscribe('commands/#', qos=1)
+    await wait_for(lambda: broker_topics(clients[0]))
+    assert pool.subscriber is clients[0]
+
+    # connection is lost, client reconnects, but subscriptions are moved already
+    clients[0]._connection._transport.close()
+    await wait_for(lambda: broker_topics(clients[1]))
+    assert pool.subscriber is clients[1]
+    assert [s.topic for s in clients[1].subscriptions] == ['commands/#'] and clients[0].subscriptions == []
+    assert pool.metrics['subscriber_moves'] == 1
+
+    await wait_for(lambda: len(connects) == 2)
+    # broker kept no session, so old subscriber does not receive anything
+    assert broker_topics(clients[0]) == [] and clients[0] not in pool._stale_subscriptions
+    assert broker_topics(clients[2]) == []
+
+    # broker kept the session of former subscriber: it unsubscribes
+    pool._stale_subscriptions[clients[0]] = ['commands/#']
+    clients[0].on_connect(clients[0], 1, 0, {})
+    await wait_for(lambda: broker_topics(clients[0]))
+    assert broker_topics(clients[0]) == [(0xA2, 'commands/#')]
+
+    await pool.disconnect()
+    assert pool.subscriber is clients[1]
+    server.close()
@@ -0,0 +1,363 @@
+import asyncio
+import struct
+import time
+
+import pytest
+
+import gmqtt
+from gmqtt.client import _parse_endpoints
+from gmqtt.mqtt.constants import MQTTCommands, ConnAckReasonCode
+from gmqtt.mqtt.package import PublishPacket, SubscribePacket, CommandWithMidPacket
+from gmqtt.mqtt.protocol import MQTTProtocol
+from gmqtt.standby import StandbyConnection
+from gmqtt.storage import OfflineQueue
+from gmqtt.reconnect import ExponentialBackoff, ConnectRateLimiter, JITTER_NONE, JITTER_FULL, JITTER_DECORRELATED
+
+
+def test_exponential_backoff():
+    backoff = ExponentialBackoff(base=0.5, cap=10, jitter=JITTER_NONE)
+    assert [backoff.delay(attempt) for attempt in range(7)] == [0.5, 1, 2, 4, 8, 10, 10]
+    assert backoff.delay(10 ** 6) == 10
+
+    backoff = ExponentialBackoff(base=0.5, cap=10, jitter=JITTER_FULL)
+    assert all(0 <= backoff.delay(3) <= 4 for _ in range(100))
+
+    backoff = ExponentialBackoff(base=0.5, cap=10, jitter=JITTER_DECORRELATED)
+    previous = None
+    for _ in range(100):
+        delay = backoff.delay(0, previous)
+        assert 0.5 <= delay <= min(10, (previous or 0.5) * 3)
+        previous = delay
+
+    with pytest.raises(ValueError):
+        ExponentialBackoff(jitter='unknown')
+
+
+def test_connect_rate_limiter():
+    limiter = ConnectRateLimiter(rate=100, burst=2)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.01, abs=0.002)
+    assert limiter.reserve() == pytest.approx(0.02, abs=0.002)
+    time.sleep(0.05)
+    assert limiter.reserve() == 0
+    assert limiter.metrics['acquired'] == 5
+    assert limiter.metrics['delayed'] == 2
+
+
+def test_client_reconnect_delay():
+    client = gmqtt.Client('reconnect-test')
+    client.reconnect_delay = 3
+    assert client._next_reconnect_delay() == 3
+
+    client.set_config({'reconnect_strategy': ExponentialBackoff(base=1, cap=30, jitter=JITTER_NONE)})
+    client.failed_connections = 4
+    assert client._next_reconnect_delay() == 16
+    assert client.metrics['reconnect_delay_last'] == 16
+    assert client.metrics['reconnect_delay_total'] == 19
+
+    client._update_connect_metrics(0)
+    assert client.metrics['connect_success'] == 1
+    assert client._previous_reconnect_delay is None
+
+
+def test_parse_endpoints():
+    assert _parse_endpoints('broker', 1883) == [('broker', 1883)]
+    assert _parse_endpoints(['a:1884', ('b', 1885), '::1', '[::1]:1886'], 1883) == \
+        [('a', 1884), ('b', 1885), ('::1', 1883), ('::1', 1886)]
+    assert _parse_endpoints(('b', 1885), 1883) == [('b', 1885)]
+    assert _parse_endpoints((('a', 1884), ('b', 1885)), 1883) == [('a', 1884), ('b', 1885)]
+    assert _parse_endpoints(('a', 'b:1885'), 1883) == [('a', 1883), ('b', 1885)]
+
+
+def test_failover_without_delay_once_per_endpoint():
+    client = gmqtt.Client('failover-test')
+    client._endpoints = [('a', 1883), ('b', 1883), ('c', 1883)]
+    client._host, client._port = 'a', 1883
+    # every broker accepts connection and drops it, so failed_connections stays 0
+    skipped = [client._skip_reconnect_delay() for _ in range(6)]
+    assert skipped == [True, True, False, True, True, False]
+    assert client.metrics['failovers'] == 4
+    assert client.endpoint == ('b', 1883)
+
+    client.failed_connections = 1
+    assert not client._skip_reconnect_delay()
+
+
+@pytest.mark.asyncio
+async def test_probe_endpoints_first_alive_wins():
+    server = await asyncio.get_running_loop().create_server(asyncio.Protocol, '127.0.0.1', 0)
+    alive = server.sockets[0].getsockname()[1]
+    # nothing listens on the port of closed server
+    closed = await asyncio.get_running_loop().create_server(asyncio.Protocol, '127.0.0.1', 0)
+    refused = closed.sockets[0].getsockname()[1]
+    closed.close()
+    await closed.wait_closed()
+
+    client = gmqtt.Client('probe-test')
+    client.set_config({'endpoint_probe_delay': 0.01})
+    client._endpoints = [('127.0.0.1', refused), ('127.0.0.1', alive)]
+    connection, endpoint = await client._probe_endpoints(False, True, 60)
+    assert endpoint == ('127.0.0.1', alive)
+    await connection.close()
+
+    client._endpoints = [('127.0.0.1', refused)] * 2
+    with pytest.raises(OSError):
+        await client._probe_endpoints(False, True, 60)
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_connack_redirect():
+    client = gmqtt.Client('redirect-test')
+    reconnects = []
+
+    async def reconnect(delay=False):
+        reconnects.append((delay, client._skip_reconnect_delay()))
+
+    client.reconnect = reconnect
+    client._endpoints = [('a', 1883)]
+    client._host, client._port = 'a', 1883
+    reference = b'b:1884 c'
+    properties = b'\x1c' + struct.pack('!H', len(reference)) + reference
+    client(MQTTCommands.CONNACK, bytes([0, ConnAckReasonCode.USE_ANOTHER_SERVER, len(properties)]) + properties)
+    # broker closes connection after CONNACK with error
+    client(MQTTCommands.DISCONNECT, b'')
+    await asyncio.sleep(0)
+
+    assert client._endpoints == [('b', 1884), ('c', 1883), ('a', 1883)]
+    assert client.endpoint == ('b', 1884)
+    assert reconnects == [(True, True)]
+    assert client.metrics['redirects'] == 1
+
+
+@pytest.mark.asyncio
+async def test_disconnect_redirect_calls_on_disconnect():
+    client = gmqtt.Client('redirect-disconnect-test')
+    disconnects, reconnects = [], []
+
+    async def reconnect(delay=False):
+        reconnects.append((delay, client._skip_reconnect_delay()))
+
+    client.reconnect = reconnect
+    client.on_disconnect = lambda client, packet, exc=None: disconnects.append(packet)
+    client._endpoints = [('a', 1883)]
+    client._host, client._port = 'a', 1883
+    reference = b'b:1884'
+    properties = b'\x1c' + struct.pack('!H', len(reference)) + reference
+    client(MQTTCommands.DISCONNECT, bytes([ConnAckReasonCode.SERVER_MOVED, len(properties)]) + properties)
+    assert len(disconnects) == 1 and disconnects[0][0] == ConnAckReasonCode.SERVER_MOVED
+    assert client.endpoint == ('b', 1884)
+    # server closes connection after DISCONNECT
+    client(MQTTCommands.DISCONNECT, b'')
+    await asyncio.sleep(0)
+    assert reconnects == [(True, True)]
+    assert disconnects[1] == b''
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+        self.aborted = False
+        self.handler = None
+        self._protocol = MQTTProtocol
+
+    def set_handler(self, handler):
+        self.handler = handler
+
+    def abort(self):
+        self.aborted = True
+
+    def is_closing(self):
+        return self.aborted
+
+    def send_package(self, package):
+        self.sent.append(bytes(package))
+
+    def send_command_with_mid(self, cmd, mid, dup, reason_code=0):
+        self.sent.append(CommandWithMidPacket.build_package(cmd, mid, dup, reason_code, self._protocol.proto_ver))
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    async def drain(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_standby_takeover():
+    client = gmqtt.Client('primary', standby_client_id='standby')
+    client._host, client._port, client._is_active = 'broker', 1883, True
+    lost = client._connection = FakeConnection()
+    client._persistent_storage.push_nowait(1, b'\x32\x08\x00\x01t\x00\x01\x00pl')
+
+    standby = client._standby = StandbyConnection(client, 'broker', 1883, 'standby')
+    standby._connection = FakeConnection()
+    standby._connack = asyncio.get_running_loop().create_future()
+    standby._connack.set_result(None)
+    assert standby.ready
+
+    connected = []
+    client.on_connect = lambda cl, flags, rc, properties: connected.append(flags)
+    client(MQTTCommands.DISCONNECT, b'')
+    await asyncio.sleep(0.01)
+    client._standby_task.cancel()
+
+    assert lost.aborted
+    assert client._connection.handler is client
+    assert client._client_id == 'standby' and client._standby_client_id == 'primary'
+    assert connected == [0]
+    # stored message was resent over the standby connection with DUP flag
+    assert client._connection.sent == [b'\x3a\x08\x00\x01t\x00\x01\x00pl']
+    assert client.metrics['standby_takeovers'] == 1
+
+
+class PipelineConnection(FakeConnection):
+    proto_ver = 5
+
+    def subscribe(self, subscriptions, **kwargs):
+        mid, package = SubscribePacket.build_package(subscriptions, self, **kwargs)
+        self.sent.append(package)
+        return mid
+
+    def publish_many(self, messages):
+        packages = [PublishPacket.build_package(message, self) for message in messages]
+        self.sent.extend(package for _, package in packages)
+        return packages
+
+
+def ready_standby(client, connection, session_present=False):
+    standby = client._standby = StandbyConnection(client, 'broker', 1883, 'standby')
+    standby._connection = connection
+    standby._connack = asyncio.get_running_loop().create_future()
+    standby._connack.set_result(None)
+    standby.session_present = session_present
+    return standby
+
+
+@pytest.mark.asyncio
+async def test_standby_takeover_resubscribes_without_session():
+    for session_present in (False, True):
+        client = gmqtt.Client('primary', standby_client_id='standby')
+        client._host, client._port, client._is_active = 'broker', 1883, True
+        client._connection = FakeConnection()
+        client.subscriptions = [gmqtt.Subscription('a/#', qos=1)]
+        standby = ready_standby(client, PipelineConnection(), session_present)
+
+        client(MQTTCommands.DISCONNECT, b'')
+        await asyncio.sleep(0.01)
+        client._standby_task.cancel()
+        assert client._connection.handler is client and client._client_id == standby.client_id
+        subscribes = [package for package in client._connection.sent if package[0] & 0xF0 == MQTTCommands.SUBSCRIBE]
+        assert len(subscribes) == (0 if session_present else 1)
+
+
+@pytest.mark.asyncio
+async def test_standby_never_shares_client_id():
+    with pytest.raises(ValueError):
+        gmqtt.Client('primary', standby_client_id='primary')
+
+    client = gmqtt.Client('primary', standby_endpoint='broker-2:1883')
+    client._host, client._port = 'broker', 1883
+    client._start_standby()
+    client._standby_task.cancel()
+    assert client._standby_client_id == 'primary-standby'
+
+
+@pytest.mark.asyncio
+async def test_standby_acknowledges_received_messages():
+    client = gmqtt.Client('primary', standby_client_id='standby')
+    connection = FakeConnection()
+    standby = ready_standby(client, connection)
+    standby(MQTTCommands.PUBLISH | 0x02, struct.pack('!H', 1) + b't' + struct.pack('!H', 7) + b'\x00p')
+    standby(MQTTCommands.PUBLISH | 0x04, struct.pack('!H', 1) + b't' + struct.pack('!H', 8) + b'\x00p')
+    standby(MQTTCommands.PUBREL, struct.pack('!H', 8))
+    standby(MQTTCommands.PUBLISH, struct.pack('!H', 1) + b't\x00p')
+    assert [(package[0] & 0xF0, struct.unpack_from('!H', package, 2)[0]) for package in connection.sent] == \
+        [(MQTTCommands.PUBACK, 7), (MQTTCommands.PUBREC, 8), (MQTTCommands.PUBCOMP, 8)]
+    assert client.metrics['standby_dropped_messages'] == 3
+
+
+@pytest.mark.asyncio
+async def test_pipelined_session_rollback():
+    client = gmqtt.Client('pipeline-test', offline_queue=OfflineQueue())
+    client.set_config({'pipelined_session': True})
+    client._connection = PipelineConnection()
+    client.subscriptions = [gmqtt.Subscription('a/#', qos=1)]
+    client.publish('t', b'1', qos=1)
+    client.publish('t', b'2', qos=0)
+
+    await client._pipeline_session()
+    assert len(client._connection.sent) == 3
+    assert client._persistent_storage.size_hint() == 1
+
+    client._connection.aborted = True
+    client(MQTTCommands.CONNACK, bytes([0, ConnAckReasonCode.NOT_AUTHORIZED]))
+    await asyncio.sleep(0)
+    # rejected session: messages are queued again in the same order, nothing waits for ack
+    assert client._persistent_storage.size_hint() == 0
+    assert [m.payload for m in client._offline_queue.take_all()] == [b'1', b'2']
+    assert client.metrics['pipelined_messages'] == 2
+    assert client.metrics['pipeline_rollbacks'] == 1
+
+
+@pytest.mark.asyncio
+async def test_resend_drops_expired_messages():
+    client = gmqtt.Client('expiry-test')
+    client._connection = connection = PipelineConnection()
+    expired = []
+    client.on_message_expired = lambda client, mid, package: expired.append(mid)
+    storage = client._persistent_storage
+    for interval in (10, 100, None):
+        properties = {'message_expiry_interval': interval} if interval else {}
+        mid, package = PublishPacket.build_package(gmqtt.Message('t', b'x', qos=1, **properties), connection)
+        storage.push_nowait(mid, package)
+    # enqueue time is wall clock time, so it is valid for storages persisted by another process
+    storage._queue = [(tm - 50, mid, package) for (tm, mid, package) in storage._queue]
+    mids = [mid for (_, mid, _) in sorted(storage._queue)]
+
+    client._connected.set()
+    await client._resend_qos_messages()
+    assert expired == [mids[0]]
+    assert client.metrics['expired_messages'] == 1
+    assert storage.size_hint() == 2
+    assert len(connection.sent) == 2
+    assert PublishPacket.find_message_expiry(connection.sent[0])[1] == 50
+    assert PublishPacket.find_message_expiry(connection.sent[1]) is None
+    # stored package keeps the original interval
+    assert PublishPacket.find_message_expiry(storage._queue[0][2])[1] == 100
+
+
+@pytest.mark.asyncio
+async def test_resend_respects_receive_maximum():
+    client = gmqtt.Client('resend-window-test')
+    client._connection = connection = PipelineConnection()
+    client.set_config({'resend_chunk_size': 4})
+    progress = []
+    client.on_resend_progress = lambda client, sent, total: progress.append((sent, total))
+    for i in range(10):
+        mid, package = PublishPacket.build_package(gmqtt.Message('t', str(i), qos=1), connection)
+        client._persistent_storage.push_nowait(mid, package)
+    mids = [mid for (_, mid, _) in sorted(client._persistent_storage._queue)]
+    client._connack_properties = {'receive_maximum': [3]}
+    client._connected.set()
+
+    def sent_mids():
+        return [struct.unpack_from('!H', package, 5)[0] for package in connection.sent]
+
+    task = asyncio.ensure_future(client._resend_qos_messages())
+    await asyncio.sleep(0.01)
+    # broker accepts at most receive_maximum unacknowledged messages
+    assert sent_mids() == mids[:3]
+    assert progress == []
+
+    for count, mid in enumerate(mids, start=4):
+        client(MQTTCommands.PUBACK, struct.pack('!H', mid))
+        await asyncio.sleep(0.01)
+        assert sent_mids() == mids[:min(count, 10)]
+    await asyncio.wait_for(task, 1)
+
+    assert all(package[0] & 0x08 for package in connection.sent)
+    assert progress == [(4, 10), (8, 10), (10, 10)]
+    assert client.metrics['resend_sent'] == 10 and client._resend_inflight == set()
+
@@ -0,0 +1,66 @@
+import asyncio
+import struct
+
+import pytest
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+import gmqtt
+from gmqtt.mqtt.constants import MQTTCommands
+from gmqtt.ring import SharedRing, RingSink, unpack_properties
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(size=256)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def test_ring_wraps_around(ring):
+    reader = SharedRing(ring.name, create=False)
+    for i in range(20):
+        assert ring.write(0x02, b'topic/1', b'\x00', b'x' * (i * 3))
+        record = reader.read()
+        assert record.topic == 'topic/1'
+        assert record.payload == b'x' * (i * 3)
+        assert record.qos == 1 and not record.retain and not record.dup
+        assert unpack_properties(record.raw_properties) == {}
+        assert reader.read() is None
+    reader.close()
+
+
+def test_ring_full(ring):
+    written = 0
+    while ring.write(0x00, b't', b'', b'y' * 40):
+        written += 1
+    assert written == 4
+    assert ring.read().payload == b'y' * 40
+    assert ring.write(0x00, b't', b'', b'z' * 40)
+    assert [ring.read().payload for _ in range(4)] == [b'y' * 40] * 3 + [b'z' * 40]
+    with pytest.raises(ValueError):
+        ring.write(0x00, b't', b'', b'x' * 300)
+
+
+@pytest.mark.asyncio
+async def test_ring_sink_backpressure(ring):
+    sink = RingSink(ring, poll_interval=0.001)
+    client = gmqtt.Client('ring-test', inbound_sink=sink)
+    sent, flow = [], []
+    client._send_command_with_mid = lambda cmd, mid, dup, reason_code=0: sent.append((cmd & 0xF0, mid))
+    client._pause_reading = lambda: flow.append('pause')
+    client._resume_reading = lambda: flow.append('resume')
+    sink.set_flow_control(client._pause_reading, client._resume_reading)
+
+    for mid in range(1, 7):
+        client(MQTTCommands.PUBLISH | 0x02, struct.pack('!H', 1) + b't' + struct.pack('!HB', mid, 0) + b'p' * 40)
+    assert sent == [(MQTTCommands.PUBACK, mid) for mid in range(1, 5)]
+    assert flow == ['pause']
+    assert sink.metrics['records_pending'] == 2
+
+    assert [ring.read().payload for _ in range(3)] == [b'p' * 40] * 3
+    await asyncio.sleep(0.01)
+    assert sent == [(MQTTCommands.PUBACK, mid) for mid in range(1, 7)]
+    assert flow == ['pause', 'resume']
+    assert sink.metrics['records_written'] == 6
@@ -0,0 +1,68 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from gmqtt.runner import SharedSubscriptionRunner
+
+from tests.test_transports import AckingBroker
+
+
+def on_message(client, topic, payload, qos, properties):
+    return 0
+
+
+def refused_port():
+    # nothing listens on the port of closed socket
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def broker_port():
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(AckingBroker, '127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.close()
+
+
+def test_runner_shutdown_drains_metrics_queue(broker_port):
+    # workers report much more than queue pipe can hold, while nobody reads it
+    runner = SharedSubscriptionRunner('workers', 'jobs/#', on_message, ('127.0.0.1', broker_port),
+                                      workers=2, metrics_interval=0.001, drain_timeout=1)
+    runner.start()
+    time.sleep(1)
+    started = time.monotonic()
+    runner.shutdown(timeout=5)
+    assert time.monotonic() - started < 4
+    # not terminated
+    assert [process.exitcode for process in runner._workers.values()] == [0, 0]
+
+    metrics = runner.metrics
+    assert metrics['workers_alive'] == 0
+    assert sorted(metrics['workers']) == [0, 1]
+    assert metrics['received'] == 0 and metrics['errors'] == 0
+
+
+def test_runner_restarts_crashed_worker():
+    # worker can't connect, so it exits with error and is started again
+    runner = SharedSubscriptionRunner('workers', 'jobs/#', on_message, ('127.0.0.1', refused_port()),
+                                      workers=1, drain_timeout=1)
+    runner.start()
+    crashed = runner._workers[0]
+    crashed.join(10)
+    assert crashed.exitcode != 0
+    runner.poll()
+    assert runner.restarts == 1 and runner._workers[0] is not crashed
+    runner.shutdown(timeout=5)
+    assert runner.metrics['workers_alive'] == 0 and runner.metrics['restarts'] == 1
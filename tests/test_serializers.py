@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import gmqtt
+from gmqtt.mqtt.constants import MQTTCommands
+from gmqtt.mqtt.package import PublishPacket
+from gmqtt.mqtt.protocol import MQTTProtocol
+from gmqtt.mqtt.utils import unpack_variable_byte_integer
+from gmqtt.serializers import StructSerializer, JsonSerializer, get_serializer, register_serializer
+from gmqtt.storage import OfflineQueue
+
+from tests.test_reconnect import PipelineConnection
+
+
+class CountingSerializer(JsonSerializer):
+    name = 'counting'
+
+    def __init__(self):
+        self.calls = 0
+
+    def dumps(self, obj):
+        self.calls += 1
+        return super().dumps(obj)
+
+
+def test_payload_serialized_lazily():
+    serializer = CountingSerializer()
+    queue = OfflineQueue(conflate=True)
+    queue.put(gmqtt.Message('a', {'value': 1}, serializer=serializer))
+    queue.put(gmqtt.Message('a', {'value': 2}, serializer=serializer))
+    assert serializer.calls == 0
+
+    message, = queue.take_all()
+    assert message.properties['content_type'] == 'application/json'
+    _, package = PublishPacket.build_package(message, MQTTProtocol)
+    assert package.endswith(b'{"value": 2}')
+    assert serializer.calls == 1
+
+    # default json serializer keeps payload untagged, as before
+    message = gmqtt.Message('a', [1, 'ü'])
+    assert message.payload == '[1, "ü"]'.encode() and 'content_type' not in message.properties
+
+    with pytest.raises(ValueError):
+        gmqtt.Message('a', {}, serializer='unknown')
+
+    # payload object is not copied: changes made before the packet is built are sent, frozen message keeps a snapshot
+    payload = {'value': 1}
+    message, frozen = gmqtt.Message('a', payload), gmqtt.FrozenMessage('a', payload)
+    payload['value'] = 3
+    assert message.payload == b'{"value": 3}' and frozen.payload == b'{"value": 1}'
+
+
+def test_struct_serializer():
+    serializer = StructSerializer('sensor', '<Iff', 'application/x-sensor')
+    message = gmqtt.Message('t', (1700000000, 21.5, 40.0), serializer=serializer)
+    assert message.payload_size == 12
+    assert serializer.loads(message.payload) == (1700000000, 21.5, 40.0)
+    assert message.properties['content_type'] == 'application/x-sensor'
+
+
+@pytest.mark.asyncio
+async def test_client_serializer_and_deserialize():
+    register_serializer(StructSerializer('pair', '<HH', 'application/x-pair'))
+    received = []
+    client = gmqtt.Client('serializers', serializer='pair', deserialize=True)
+    client.on_message = lambda client, topic, payload, qos, properties: received.append(payload)
+    client._connection = connection = PipelineConnection()
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+    packages = []
+    client._store_message = lambda message, mid, package: packages.append(package)
+
+    client.publish('t', (1, 2))
+    client.publish('t', {'a': 1}, serializer='json')
+    assert len(packages) == 2
+
+    broken = gmqtt.Message('t', b'{broken', content_type='application/json')
+    for package in packages + [PublishPacket.build_package(broken, MQTTProtocol)[1]]:
+        _, packet = unpack_variable_byte_integer(bytes(package[1:]))
+        client(MQTTCommands.PUBLISH, packet)
+    await asyncio.sleep(0)
+    assert received == [(1, 2), {'a': 1}, b'{broken']
+    assert get_serializer('pair').content_type == 'application/x-pair'
+
+
+@pytest.mark.asyncio
+async def test_unserializable_queued_payload_dropped():
+    client = gmqtt.Client('serializer-test', offline_queue=OfflineQueue())
+    connected = []
+    client.on_connect = lambda client, flags, rc, properties: connected.append(rc)
+    client.publish('t', {'value': 1}, qos=1)
+    client.publish('t', {'value': {1, 2}}, qos=1)
+    client.publish('t', {'value': 3}, qos=1)
+
+    client._connection = connection = PipelineConnection()
+    connection.id_generator = client._id_generator
+    client(MQTTCommands.CONNACK, b'\x00\x00')
+    await asyncio.sleep(0.01)
+    assert connected == [0]
+    assert [bytes(package[-12:]) for package in connection.sent] == [b'{"value": 1}', b'{"value": 3}']
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+import gmqtt
+from gmqtt.mqtt.constants import MQTTv311, MQTTv50
+from gmqtt.sharded import ShardedRuntime, MODE_PROCESS, MODE_THREAD, _merge_metrics
+from gmqtt.transports import MemoryServer, MemoryTransport
+
+from tests.test_transports import AckingBroker
+
+
+def _client_thread(client):
+    return client._client_id, threading.current_thread().name
+
+
+def test_sharded_runtime_places_clients_by_hash():
+    with ShardedRuntime(shards=3, mode=MODE_THREAD) as runtime:
+        handles = [runtime.add_client('client-{}'.format(i)) for i in range(9)]
+        for handle in handles:
+            client_id, thread_name = handle.call(_client_thread).result(5)
+            assert client_id == handle.client_id
+            assert handle.shard == runtime.shard_for(handle.client_id)
+            assert thread_name == 'gmqtt-shard-{}'.format(handle.shard)
+
+        metrics = runtime.metrics
+        assert metrics['clients'] == 9
+        assert metrics['connected'] == 0
+        assert sum(shard['clients'] for shard in metrics['shards']) == 9
+
+        with pytest.raises(ValueError):
+            runtime.add_client('client-0')
+
+
+def test_metrics_sum_counters_only():
+    total = {}
+    _merge_metrics(total, {'publish_sent': 2, 'failover_time_last': 0.5})
+    _merge_metrics(total, {'publish_sent': 3, 'failover_time_last': 0.25})
+    assert total == {'publish_sent': 5, 'failover_time_last': 0.5}
+
+
+def _client_state(client):
+    return client.protocol_version, client._id_generator.next_id()
+
+
+def test_sharded_thread_clients_do_not_share_state():
+    with ShardedRuntime(shards=2, mode=MODE_THREAD) as runtime:
+        handles = [runtime.add_client('client-{}'.format(i)) for i in range(4)]
+        # every client allocates its own packet ids
+        assert [handle.call(_client_state).result(5) for handle in handles] == [(5, 1)] * 4
+
+
+def test_sharded_runtime_in_processes():
+    runtime = ShardedRuntime(shards=2, mode=MODE_PROCESS)
+    runtime.start()
+    try:
+        handles = [runtime.add_client('client-{}'.format(i)) for i in range(4)]
+        assert [handle.call(_client_state).result(10) for handle in handles] == [(5, 1)] * 4
+        metrics = runtime.metrics
+        assert metrics['clients'] == 4 and len(metrics['shards']) == 2
+    finally:
+        runtime.stop(timeout=10)
+    assert not any(shard._process.is_alive() for shard in runtime._shards)
+
+
+def test_thread_shard_stopped_right_after_start():
+    for _ in range(20):
+        runtime = ShardedRuntime(shards=2, mode=MODE_THREAD)
+        runtime.start()
+        runtime.stop(timeout=5)
+        assert all(shard._loop.is_closed() and not shard._thread.is_alive() for shard in runtime._shards)
+
+
+@pytest.mark.asyncio
+async def test_protocol_version_is_per_connection():
+    server = MemoryServer('version-broker', AckingBroker)
+    old, new = gmqtt.Client('old'), gmqtt.Client('new')
+    await old.connect('version-broker', version=MQTTv311, transport=MemoryTransport())
+    await new.connect('version-broker', transport=MemoryTransport())
+    assert old._connection._protocol.proto_ver == old.protocol_version == MQTTv311
+    assert new._connection._protocol.proto_ver == new.protocol_version == MQTTv50
+    await old.disconnect()
+    await new.disconnect()
+    server.close()
@@ -0,0 +1,48 @@
+import asyncio
+import socket
+
+import pytest
+
+import gmqtt
+from gmqtt.sockopts import SocketOptions
+
+
+class ConnackProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if data[0] == 0x10:
+            self.transport.write(b'\x20\x03\x00\x00\x00')
+
+
+@pytest.mark.asyncio
+async def test_socket_options_applied():
+    server = await asyncio.get_running_loop().create_server(ConnackProtocol, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    client = gmqtt.Client('sockopts')
+    options = {'nodelay': False, 'send_buffer': 64 * 1024, 'keepalive_idle': 30, 'keepalive_interval': 5,
+               'keepalive_count': 3, 'local_addr': ('127.0.0.1', 0)}
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        options['user_timeout'] = 20
+    await client.connect('127.0.0.1', port, socket_options=options)
+
+    sock = client._connection.get_extra_info('socket')
+    assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) == 0
+    # linux doubles requested buffer size for bookkeeping
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 64 * 1024
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 1
+    assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT) == 3
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT) == 20000
+    await client.disconnect()
+    server.close()
+
+
+def test_unsupported_option_skipped(caplog):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    SocketOptions(nodelay=True, receive_buffer=32 * 1024).apply(sock)
+    assert 'failed to set TCP_NODELAY' in caplog.text
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 32 * 1024
+    sock.close()
@@ -0,0 +1,320 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+import gmqtt
+from gmqtt import Message
+from gmqtt.mqtt.package import PublishPacket
+from gmqtt.mqtt.constants import MQTTCommands
+from gmqtt.storage import BasePersistentStorage, HeapPersistentStorage, BoundedPersistentStorage, OfflineQueue, StorageFullError, OVERFLOW_REJECT, \
+    OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_PRIORITY, OVERFLOW_SPILL
+from gmqtt.wal import InboundLog
+
+from tests.test_reconnect import PipelineConnection
+
+
+def _mids(storage_queue):
+    return sorted(mid for (_, mid, _) in storage_queue)
+
+
+@pytest.mark.asyncio
+async def test_bounded_storage_reject():
+    storage = BoundedPersistentStorage(max_messages=2, policy=OVERFLOW_REJECT)
+    storage.check_capacity(10)
+    await storage.push_message(1, b'a' * 10)
+    await storage.push_message(2, b'b' * 10)
+    with pytest.raises(StorageFullError):
+        storage.check_capacity(10)
+    assert storage.metrics['bytes_held'] == 20
+
+
+@pytest.mark.asyncio
+async def test_bounded_storage_drop_oldest():
+    storage = BoundedPersistentStorage(max_bytes=25, policy=OVERFLOW_DROP_OLDEST)
+    for mid in range(1, 5):
+        await storage.push_message(mid, b'x' * 10)
+    assert _mids(await storage.get_all()) == [3, 4]
+    assert storage.messages_dropped == 2
+    assert storage.bytes_dropped == 20
+    assert storage.bytes_held == 20
+
+
+@pytest.mark.asyncio
+async def test_bounded_storage_drop_priority():
+    storage = BoundedPersistentStorage(max_messages=2, policy=OVERFLOW_DROP_PRIORITY)
+    await storage.push_message(1, b'x', priority=5)
+    await storage.push_message(2, b'x', priority=1)
+    await storage.push_message(3, b'x', priority=3)
+    assert _mids(await storage.get_all()) == [1, 3]
+    # lower priority than everything stored - new message is dropped
+    await storage.push_message(4, b'x', priority=0)
+    assert _mids(await storage.get_all()) == [1, 3]
+    assert storage.messages_dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_bounded_storage_spill(tmp_path):
+    storage = BoundedPersistentStorage(max_messages=2, policy=OVERFLOW_SPILL, spill_path=str(tmp_path / 'spill'))
+    for mid in range(1, 6):
+        await storage.push_message(mid, bytearray(b'%d' % mid))
+    assert storage.metrics['messages_spilled'] == 3
+    assert storage.bytes_held == 2
+
+    await storage.remove_message_by_mid(2)
+    assert not await storage.is_empty
+
+    messages = await storage.get_all()
+    assert _mids(messages) == [1, 3, 4, 5]
+    assert {mid: bytes(pkg) for (_, mid, pkg) in messages}[3] == b'3'
+    assert storage.bytes_spilled == 0
+    assert storage.messages_dropped == 0
+
+    await storage.clear()
+    assert await storage.is_empty
+
+
+@pytest.mark.asyncio
+async def test_bounded_storage_pop_merges_spilled(tmp_path):
+    storage = BoundedPersistentStorage(max_messages=2, policy=OVERFLOW_SPILL, spill_path=str(tmp_path / 'spill'))
+    for mid in range(1, 5):
+        await storage.push_message(mid, bytearray(b'%d' % mid))
+    assert storage.metrics['messages_spilled'] == 2
+    assert [(await storage.pop_message())[0] for _ in range(4)] == [1, 2, 3, 4]
+    assert await storage.is_empty
+
+
+@pytest.mark.asyncio
+async def test_capacity_check_uses_package_size():
+    connection = PipelineConnection()
+    messages = [Message('t', b'x' * 200, qos=1), Message('topic', b'', qos=0),
+                Message('t', b'x' * 10, qos=2, content_type='text/plain', user_property=('a', 'b'))]
+    for message in messages:
+        for connection.proto_ver in (4, 5):
+            _, package = PublishPacket.build_package(message, connection)
+            assert PublishPacket.package_size(message, connection.proto_ver) == len(package)
+
+    # message passing the check fits into storage
+    _, package = PublishPacket.build_package(messages[0], connection)
+    storage = BoundedPersistentStorage(max_bytes=len(package), policy=OVERFLOW_REJECT)
+    storage.check_capacity(PublishPacket.package_size(messages[0], connection.proto_ver))
+    storage.push_nowait(1, package)
+    assert storage.bytes_held == len(package) and storage.messages_dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_capacity_checked_only_by_limited_storage():
+    assert not HeapPersistentStorage().has_capacity_limit
+    assert not BoundedPersistentStorage(max_messages=2, policy=OVERFLOW_DROP_OLDEST).has_capacity_limit
+    assert not BoundedPersistentStorage(policy=OVERFLOW_REJECT).has_capacity_limit
+
+    storage = BoundedPersistentStorage(max_messages=1, policy=OVERFLOW_REJECT)
+    assert storage.has_capacity_limit
+    checked = []
+    storage.check_capacity = checked.append
+    for storage in (storage, HeapPersistentStorage()):
+        client = gmqtt.Client('capacity-test', persistent_storage=storage)
+        client._connection = connection = PipelineConnection()
+        connection.publish = lambda message: PublishPacket.build_package(message, connection)
+        client.publish('t', b'x', qos=1)
+    assert len(checked) == 1
+
+
+@pytest.mark.asyncio
+async def test_dropped_messages_free_packet_ids():
+    # ids of messages dropped on overflow are never acknowledged, they must not run out during long outage
+    storage = BoundedPersistentStorage(max_messages=100, policy=OVERFLOW_DROP_OLDEST)
+    client = gmqtt.Client('drop-test', persistent_storage=storage)
+    client._connection = connection = PipelineConnection()
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+    connection.send_package = lambda package: None
+    # like connections created by the client
+    connection.id_generator = client._id_generator
+    message = Message('t', b'x', qos=1)
+    for _ in range(70000):
+        client.publish(message)
+    assert storage.size_hint() == 100 and storage.messages_dropped == 69900
+    assert len(client._id_generator._used_ids) == 100
+    assert sorted(client._id_generator._used_ids) == _mids(await storage.get_all())
+
+
+@pytest.mark.asyncio
+async def test_default_storage_accepts_priority():
+    client = gmqtt.Client('priority-test')
+    client._connection = connection = PipelineConnection()
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+    client.publish(Message('t', b'x', qos=1, priority=5))
+    assert client._persistent_storage.size_hint() == 1
+    await client._persistent_storage.push_message(2, b'x', priority=1)
+    assert client._persistent_storage.size_hint() == 2
+
+
+@pytest.mark.asyncio
+async def test_bounded_storage_iter_chunks_streams_spilled(tmp_path):
+    storage = BoundedPersistentStorage(max_messages=3, policy=OVERFLOW_SPILL, spill_path=str(tmp_path / 'spill'))
+    for mid in range(1, 11):
+        await storage.push_message(mid, bytearray(b'%d' % mid))
+    await storage.remove_message_by_mid(4)
+
+    chunks = [chunk async for chunk in storage.iter_chunks(4)]
+    assert [mid for chunk in chunks for (_, mid, _) in chunk] == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+    assert all(len(chunk) <= 4 for chunk in chunks)
+    # streaming does not load spilled messages into memory
+    assert storage.metrics['messages_spilled'] == 6
+    assert storage.size_hint() == 9
+
+
+def test_offline_queue_overflow_and_conflation():
+    queue = OfflineQueue(capacity=2, policy=OVERFLOW_DROP_OLDEST, conflate=True)
+    queue.put(Message('a', 1))
+    queue.put(Message('b', 1))
+    queue.put(Message('a', 2))
+    queue.put(Message('c', 1))
+    # conflated update moved to the tail, so the older message to b is dropped
+    assert [(m.topic, m.payload) for m in queue.take_all()] == [(b'a', b'2'), (b'c', b'1')]
+    assert queue.metrics['messages_conflated'] == 1
+    assert queue.metrics['messages_dropped'] == 1
+    assert len(queue) == 0
+
+    queue = OfflineQueue(capacity=1, policy=OVERFLOW_REJECT)
+    queue.put(Message('a', 1))
+    with pytest.raises(StorageFullError):
+        queue.put(Message('a', 2))
+
+
+def test_offline_queue_requeue():
+    queue = OfflineQueue(conflate=True)
+    queue.put(Message('a', 1))
+    queue.put(Message('b', 1))
+    taken = queue.take_all()
+    queue.put(Message('b', 2))
+    queue.put(Message('c', 1))
+    queue.requeue(taken)
+    assert [(m.topic, m.payload) for m in queue.take_all()] == [(b'a', b'1'), (b'b', b'2'), (b'c', b'1')]
+
+
+def test_offline_queue_expiry():
+    queue = OfflineQueue()
+    queue.put(Message('a', 1, message_expiry_interval=0))
+    queue.put(Message('b', 1, message_expiry_interval=60))
+    messages = queue.take_all()
+    assert [m.topic for m in messages] == [b'b']
+    assert queue.messages_expired == 1
+
+
+@pytest.mark.asyncio
+async def test_inbound_log_group_commit_and_replay(tmp_path):
+    path = str(tmp_path / 'inbound.log')
+    log = InboundLog(path)
+    committed = [log.append(b'topic/%d' % i, 1, b'\x00', b'payload') for i in range(10)]
+    await asyncio.gather(*(future for (_, future) in committed))
+    assert log.commits == 1
+
+    for (seq, _) in committed[:8]:
+        log.mark_processed(seq)
+    log.close()
+
+    log = InboundLog(path)
+    assert [(seq, topic) for (seq, topic, _, _, _) in log.replay()] == [(9, b'topic/8'), (10, b'topic/9')]
+    seq, future = log.append(b'topic/10', 2, b'', b'')
+    assert seq == 11
+    await future
+    log.close()
+
+
+
+@pytest.mark.asyncio
+async def test_inbound_log_close_waits_for_commit(tmp_path):
+    path = str(tmp_path / 'inbound.log')
+    log = InboundLog(path)
+    release = threading.Event()
+    write = log._write
+    log._write = lambda batch, compact: release.wait() and write(batch, compact)
+
+    seq, first = log.append(b'a', 1, b'', b'1')
+    await asyncio.sleep(0.01)
+    assert log._committing
+    _, second = log.append(b'b', 1, b'', b'2')
+    log.close()
+    assert not log._file.closed
+    release.set()
+    await asyncio.gather(first, second)
+    assert log._file.closed
+
+    log = InboundLog(path)
+    assert [topic for (_, topic, _, _, _) in log.replay()] == [b'a', b'b']
+    log.close()
+
+
+@pytest.mark.asyncio
+async def test_inbound_log_compaction(tmp_path):
+    path = str(tmp_path / 'inbound.log')
+    log = InboundLog(path, compact_size=1)
+    committed = [log.append(b't', 1, b'', b'%d' % i) for i in range(3)]
+    await asyncio.gather(*(future for (_, future) in committed))
+    size = os.path.getsize(path)
+    log.mark_processed(committed[0][0])
+    log.mark_processed(committed[1][0])
+    await asyncio.sleep(0.01)
+    # only the pending entry is left
+    assert os.path.getsize(path) == size // 3
+    log.close()
+
+    log = InboundLog(path)
+    assert [(seq, payload) for (seq, _, _, _, payload) in log.replay()] == [(3, b'2')]
+    log.close()
+
+class AsyncStorage(BasePersistentStorage):
+    # storage doing "I/O": only async methods, default push_nowait/remove_nowait/clear_nowait schedule them
+    def __init__(self):
+        self.messages = {}
+
+    async def push_message(self, mid, raw_package, **kwargs):
+        await asyncio.sleep(0)
+        self.messages[mid] = raw_package
+
+    async def remove_message_by_mid(self, mid):
+        await asyncio.sleep(0)
+        self.messages.pop(mid, None)
+
+    async def clear(self):
+        self.messages = {}
+
+
+@pytest.mark.asyncio
+async def test_storage_fast_path_sync_and_async():
+    storage = HeapPersistentStorage()
+    for mid in range(1, 4):
+        assert storage.push_nowait(mid, b'x') is None
+    assert storage.remove_nowait(1) is None
+    # acknowledgement out of publish order
+    storage.remove_nowait(3)
+    assert _mids(storage._queue) == [2]
+    assert storage.clear_nowait() is None
+    assert await storage.is_empty
+
+    storage = AsyncStorage()
+    future = storage.push_nowait(1, b'x', priority=1)
+    assert isinstance(future, asyncio.Future) and not storage.messages
+    await future
+    assert storage.messages == {1: b'x'}
+    await storage.remove_nowait(1)
+    assert storage.messages == {}
+    storage.messages[2] = b'x'
+    await storage.clear_nowait()
+    assert storage.messages == {}
+
+
+@pytest.mark.asyncio
+async def test_storage_cleared_on_connack_before_new_publishes():
+    client = gmqtt.Client('clear-test')
+    client._connection = connection = PipelineConnection()
+    connection.publish = lambda message: PublishPacket.build_package(message, connection)
+    client.publish('t', b'old', qos=1)
+
+    # CONNACK without session: old messages are removed at once, message published right after it stays
+    client(MQTTCommands.CONNACK, b'\x00\x00')
+    client.publish('t', b'new', qos=1)
+    await asyncio.sleep(0)
+    assert [bytes(package).endswith(b'new') for (_, _, package) in client._persistent_storage._queue] == [True]
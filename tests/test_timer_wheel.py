@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from gmqtt.mqtt.timer_wheel import TimerWheel
+
+
+@pytest.mark.asyncio
+async def test_timers_fire_in_order():
+    wheel = TimerWheel(tick=0.01, slots=4)
+    fired = []
+    for delay in (0.05, 0.01, 0.03, 0.12):
+        wheel.call_later(delay, fired.append, delay)
+    assert len(wheel) == 4
+    await asyncio.sleep(0.2)
+    assert fired == [0.01, 0.03, 0.05, 0.12]
+    # wheel timer exists only while there are scheduled timers
+    assert len(wheel) == 0 and wheel._handle is None
+
+
+@pytest.mark.asyncio
+async def test_cancelled_timer_does_not_fire():
+    wheel = TimerWheel(tick=0.01)
+    fired = []
+    handle = wheel.call_later(0.02, fired.append, 1)
+    wheel.call_later(0.03, fired.append, 2)
+    handle.cancel()
+    assert handle.cancelled()
+    await asyncio.sleep(0.06)
+    assert fired == [2]
+    assert len(wheel) == 0
+
+    wheel.call_later(0.01, fired.append, 3)
+    wheel.close()
+    await asyncio.sleep(0.03)
+    assert fired == [2]
+
+
+@pytest.mark.asyncio
+async def test_timer_scheduled_mid_tick_does_not_fire_early():
+    loop = asyncio.get_event_loop()
+    wheel = TimerWheel(tick=0.05)
+    wheel.call_later(1, lambda: None)
+    await asyncio.sleep(0.03)
+
+    fired = []
+    scheduled_at = loop.time()
+    wheel.call_later(0.05, lambda: fired.append(loop.time() - scheduled_at))
+    # timers scheduled from callbacks are counted from the tick they run in
+    wheel.call_later(0.05, lambda: wheel.call_later(0.05, lambda: fired.append(loop.time() - scheduled_at)))
+    await asyncio.sleep(0.25)
+    assert len(fired) == 2
+    assert fired[0] >= 0.05 and fired[1] >= 0.1
+    # rounded up to the tick, not more
+    assert fired[0] < 0.15
+    wheel.close()
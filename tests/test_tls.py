@@ -0,0 +1,56 @@
+import asyncio
+import os
+import ssl
+
+import pytest
+
+import gmqtt
+from gmqtt.tls import ResumingSSLContext, create_default_context
+
+CERT = os.path.join(os.path.dirname(__file__), 'certs', 'localhost.pem')
+
+
+class ConnackProtocol(asyncio.Protocol):
+    # accepts any CONNECT, nothing else is needed to establish the session
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if data[0] == 0x10:
+            self.transport.write(b'\x20\x03\x00\x00\x00')
+
+
+async def serve_tls():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(CERT)
+    return await asyncio.get_running_loop().create_server(ConnackProtocol, '127.0.0.1', 0, ssl=context)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('version', [ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3], ids=['tls1.2', 'tls1.3'])
+async def test_tls_session_resumed_on_reconnect(version):
+    server = await serve_tls()
+    port = server.sockets[0].getsockname()[1]
+    context = create_default_context(cafile=CERT)
+    context.maximum_version = version
+    assert isinstance(context, ResumingSSLContext)
+
+    for client_id in ('first', 'second'):
+        client = gmqtt.Client(client_id)
+        await client.connect('127.0.0.1', port, ssl=context)
+        reused = client._connection.get_extra_info('ssl_object').session_reused
+        await client.disconnect()
+        assert reused == (client_id == 'second')
+    server.close()
+
+    assert client.metrics['tls_handshakes'] == 1
+    assert client.metrics['tls_sessions_reused'] == 1
+    assert client.metrics['tls_handshake_time_last'] > 0
+    assert '127.0.0.1' in context.sessions
+
+
+def test_default_context_is_shared():
+    client = gmqtt.Client('ssl-default')
+    assert gmqtt.tls.default_context() is gmqtt.tls.default_context()
+    assert gmqtt.tls.default_context().verify_mode == ssl.CERT_REQUIRED
+    assert client.metrics['tls_handshakes'] == 0
@@ -0,0 +1,83 @@
+import asyncio
+import struct
+
+import pytest
+
+import gmqtt
+from gmqtt.transports import MemoryServer, MemoryTransport, UnixTransport
+
+
+class AckingBroker(asyncio.Protocol):
+    # answers CONNECT and QoS 1 PUBLISH, expects every packet to arrive in one chunk
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        while data:
+            cmd, length, offset = data[0], 0, 1
+            while True:
+                length += (data[offset] & 0x7F) << (7 * (offset - 1))
+                offset += 1
+                if not data[offset - 1] & 0x80:
+                    break
+            packet, data = data[offset:offset + length], data[offset + length:]
+            if cmd == 0x10:
+                self.transport.write(b'\x20\x03\x00\x00\x00')
+            elif cmd & 0xF0 == 0x30 and cmd & 0x06:
+                (topic_len, ) = struct.unpack_from('!H', packet)
+                self.transport.write(b'\x40\x02' + packet[2 + topic_len:4 + topic_len])
+
+
+async def publish_acked(client, count=10):
+    for i in range(count):
+        client.publish('t', str(i), qos=1)
+    await asyncio.wait_for(client._persistent_storage.wait_empty(), 5)
+
+
+@pytest.mark.asyncio
+async def test_memory_transport():
+    server = MemoryServer('broker', AckingBroker)
+    client = gmqtt.Client('memory')
+    await client.connect('broker', transport=MemoryTransport())
+    assert client.is_connected
+    await publish_acked(client)
+    await client.disconnect()
+    server.close()
+
+    with pytest.raises(ConnectionRefusedError):
+        await gmqtt.Client('memory').connect('broker', transport=MemoryTransport())
+
+
+@pytest.mark.asyncio
+async def test_memory_transport_pause_reading():
+    received = []
+
+    class Collector(asyncio.Protocol):
+        def data_received(self, data):
+            received.append(data)
+
+    server = MemoryServer('collector', Collector)
+    transport, _ = await MemoryTransport().create_connection(asyncio.get_running_loop(), asyncio.Protocol,
+                                                             'collector', None)
+    peer = transport._peer
+    peer.pause_reading()
+    transport.write(b'a')
+    transport.write(b'b')
+    await asyncio.sleep(0)
+    assert received == []
+    peer.resume_reading()
+    await asyncio.sleep(0)
+    assert received == [b'ab']
+    transport.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_unix_transport(tmp_path):
+    path = str(tmp_path / 'broker.sock')
+    server = await asyncio.get_running_loop().create_unix_server(AckingBroker, path)
+    client = gmqtt.Client('unix')
+    await client.connect(path, transport=UnixTransport())
+    await publish_acked(client)
+    await client.disconnect()
+    server.close()
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import gmqtt
+from gmqtt.transports import MemoryServer, MemoryTransport
+from gmqtt.websocket import FrameParser, PerMessageDeflate, WebSocketError, WebSocketProtocol, \
+    WebSocketTransport, encode_frame, parse_extensions, OP_BINARY, OP_CONTINUATION, OP_PING
+
+from tests.test_transports import AckingBroker
+
+
+@pytest.mark.parametrize('size', [0, 125, 126, 65535, 65536])
+@pytest.mark.parametrize('mask', [True, False])
+def test_frame_roundtrip_split_stream(size, mask):
+    payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    data = encode_frame(OP_BINARY, payload, mask=mask) + encode_frame(OP_CONTINUATION, b'end', fin=False, rsv1=True)
+    parser = FrameParser()
+    frames = []
+    # data arrives in arbitrary pieces
+    for i in range(0, len(data), 1000):
+        frames.extend(parser.feed(data[i:i + 1000]))
+    assert [(f.fin, f.rsv1, f.opcode) for f in frames] == [(True, False, OP_BINARY), (False, True, OP_CONTINUATION)]
+    assert frames[0].payload == payload
+    assert frames[1].payload == b'end'
+
+
+@pytest.mark.parametrize('no_context_takeover', [False, True])
+def test_permessage_deflate(no_context_takeover):
+    sender = PerMessageDeflate(compress_no_context_takeover=no_context_takeover, threshold=16)
+    receiver = PerMessageDeflate(decompress_no_context_takeover=no_context_takeover)
+    messages = [('{"device": "sensor-1", "temperature": %d, "humidity": 40}' % i).encode() for i in range(20)]
+    compressed = [sender.compress(message) for message in messages]
+    assert [receiver.decompress(data) for data in compressed] == messages
+    # with context takeover repeated messages shrink to a few bytes
+    assert (len(compressed[-1]) < 20) != no_context_takeover
+    assert sender.compress(b'\xc0\x00') is None
+
+
+def test_parse_extensions():
+    assert parse_extensions('permessage-deflate; client_max_window_bits=10; server_no_context_takeover, x-y') == \
+        [('permessage-deflate', {'client_max_window_bits': '10', 'server_no_context_takeover': None}), ('x-y', {})]
+
+
+class PublishingBroker(AckingBroker):
+    # sends CONNACK and PUBLISH to the client in one write, so they come in one WebSocket message
+    def data_received(self, data):
+        if data[0] == 0x10:
+            self.transport.write(b'\x20\x03\x00\x00\x00' + b'\x30\x0c\x00\x01t\x00{"v": 1}')
+        else:
+            super(PublishingBroker, self).data_received(data)
+
+
+def websocket_server(name, protocol_factory, **kwargs):
+    servers = []
+
+    def factory():
+        servers.append(WebSocketProtocol(protocol_factory, is_client=False, **kwargs))
+        return servers[-1]
+
+    return MemoryServer(name, factory), servers
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('compression', [True, False])
+async def test_mqtt_over_websocket(compression):
+    server, websockets = websocket_server('ws-broker-{}'.format(compression), PublishingBroker)
+    received = []
+    client = gmqtt.Client('ws')
+    client.on_message = lambda client, topic, payload, qos, properties: received.append(payload)
+    # every MQTT packet is split into several frames
+    await client.connect('ws-broker-{}'.format(compression), transport=WebSocketTransport(
+        transport=MemoryTransport(), max_frame_size=8, compression=compression, compression_threshold=16))
+
+    client.publish('telemetry', b'{"temperature": 21.5, "humidity": 40}' * 4, qos=1)
+    await asyncio.wait_for(client._persistent_storage.wait_empty(), 5)
+    assert received == [b'{"v": 1}']
+
+    websocket = client._connection.get_extra_info('websocket')
+    assert (websocket.deflate is not None) == compression
+    assert websocket.metrics['payload_bytes_sent'] == websockets[0].metrics['payload_bytes_received']
+
+    received_before = websockets[0].metrics['bytes_received']
+    websockets[0].raw_transport.write(encode_frame(OP_PING, b'hi', mask=False))
+    await asyncio.sleep(0.01)
+    # masked PONG with the same payload
+    assert websockets[0].metrics['bytes_received'] - received_before == 8
+    await client.disconnect()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_websocket_handshake_rejected():
+    class HttpOnly(asyncio.Protocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def data_received(self, data):
+            self.transport.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+
+    server = MemoryServer('http-only', HttpOnly)
+    with pytest.raises(WebSocketError):
+        await WebSocketTransport(transport=MemoryTransport()).create_connection(
+            asyncio.get_running_loop(), asyncio.Protocol, 'http-only', 80)
+    server.close()